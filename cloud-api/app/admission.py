@@ -0,0 +1,272 @@
+"""
+PocketShield Admission Control
+Per-endpoint adaptive concurrency limits, tier-priority queueing and load shedding
+
+Each expensive endpoint gets an AIMD concurrency limit per worker: it grows by
+one slot per ``limit`` completions while the smoothed latency is under the
+target, and shrinks multiplicatively (at most once per target-latency
+interval) when it is over the target or a request fails. Requests over the
+limit wait in a queue ordered by API tier. A request is shed straight away
+with 503 + Retry-After when its estimated wait exceeds the endpoint's
+deadline, and shed after waiting if it is not admitted in time.
+
+The slot is released by AdmissionMiddleware once the response status is
+known, so 5xx responses (including HTTPExceptions raised by the endpoint)
+count as failures. A cancelled request frees its slot without a latency
+sample.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+TIER_PRIORITY = {"enterprise": 0, "premium": 1, "free": 2}
+LOWEST_PRIORITY = max(TIER_PRIORITY.values())
+
+LATENCY_EWMA_WEIGHT = 0.1
+
+TICKETS_SCOPE_KEY = "admission_tickets"
+
+
+@dataclass(frozen=True)
+class AdmissionPolicy:
+    initial_limit: int
+    max_limit: int
+    min_limit: int = 2
+    target_latency: float = 0.25  # seconds; a slower latency EWMA shrinks the limit
+    max_queue_wait: float = 0.5   # seconds; longer estimated waits are shed
+    backoff: float = 0.9
+
+
+DEFAULT_POLICIES: Dict[str, AdmissionPolicy] = {
+    "threat:analyze_url": AdmissionPolicy(32, 256, target_latency=0.25, max_queue_wait=1.0),
+    "threat:analyze_app": AdmissionPolicy(32, 256, target_latency=0.1),
+    "threat:prefix_lookup": AdmissionPolicy(32, 256, target_latency=0.1),
+    "threat:feed": AdmissionPolicy(32, 128, target_latency=0.2),
+    "device:assess": AdmissionPolicy(32, 128, target_latency=0.25, max_queue_wait=2.0),
+    "behavior:analyze": AdmissionPolicy(16, 128, target_latency=0.25),
+}
+
+
+class LoadShed(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one endpoint with a tier-ordered wait queue"""
+
+    def __init__(self, endpoint: str, policy: AdmissionPolicy):
+        self.endpoint = endpoint
+        self.policy = policy
+        self.limit = float(policy.initial_limit)
+        self.in_flight = 0
+        self.avg_latency = policy.target_latency / 2
+
+        self._queue: List[list] = []  # heap of [priority, seq, future]
+        self._seq = itertools.count()
+        self._waiting = [0] * (LOWEST_PRIORITY + 1)
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+        self._limit_gauge = metrics.ADMISSION_LIMIT.labels(endpoint)
+        self._in_flight_gauge = metrics.ADMISSION_IN_FLIGHT.labels(endpoint)
+        self._queue_gauge = metrics.ADMISSION_QUEUE_DEPTH.labels(endpoint)
+        self._limit_gauge.set(self.limit)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self._waiting)
+
+    def estimated_wait(self, priority: int) -> float:
+        """Rough wait for a new request: work queued ahead of it / throughput"""
+        ahead = sum(self._waiting[: priority + 1])
+        return (ahead + 1) * self.avg_latency / max(self.limit, 1.0)
+
+    async def acquire(self, priority: int):
+        if self.in_flight < int(self.limit) and not self.queue_depth:
+            self._admit()
+            return
+
+        estimate = self.estimated_wait(priority)
+        if estimate > self.policy.max_queue_wait:
+            self.shed += 1
+            raise LoadShed("queue_full", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._seq), future])
+        self._waiting[priority] += 1
+        self.queued += 1
+        self._queue_gauge.inc()
+
+        try:
+            await asyncio.wait_for(future, timeout=self.policy.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._waiting[priority] -= 1
+            self._queue_gauge.dec()
+            self.shed += 1
+            raise LoadShed("timeout", self.estimated_wait(priority))
+        except asyncio.CancelledError:
+            # Client went away; give back the slot if it was granted meanwhile
+            if future.done() and not future.cancelled():
+                self.release(None)
+            else:
+                future.cancel()
+                self._waiting[priority] -= 1
+                self._queue_gauge.dec()
+            raise
+
+    def _admit(self):
+        self.in_flight += 1
+        self.admitted += 1
+        self._in_flight_gauge.inc()
+
+    def release(self, latency: Optional[float], failed: bool = False):
+        """Free a slot; ``latency`` None (cancelled) leaves the latency average and limit alone"""
+        self.in_flight -= 1
+        self._in_flight_gauge.dec()
+        if latency is not None:
+            self._adjust(latency, failed)
+        self._wake()
+
+    def _adjust(self, latency: float, failed: bool):
+        self.avg_latency += LATENCY_EWMA_WEIGHT * (latency - self.avg_latency)
+
+        policy = self.policy
+        now = time.monotonic()
+        if failed or self.avg_latency > policy.target_latency:
+            # One decrease per target-latency interval, so a burst of slow
+            # completions from the same overload period counts once
+            if now - self._last_decrease > policy.target_latency:
+                self.limit = max(policy.min_limit, self.limit * policy.backoff)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit):
+            # Only grow while the current limit is actually being used
+            self.limit = min(policy.max_limit, self.limit + 1.0 / self.limit)
+        self._limit_gauge.set(self.limit)
+
+    def _wake(self):
+        while self._queue and self.in_flight < int(self.limit):
+            priority, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue  # timed out or cancelled; already uncounted
+            self._waiting[priority] -= 1
+            self._queue_gauge.dec()
+            self._admit()
+            future.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "avg_latency_ms": round(self.avg_latency * 1000, 2),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+        }
+
+
+@dataclass
+class Ticket:
+    limiter: AdaptiveLimiter
+    tier: str
+    admitted_at: float
+
+
+class AdmissionController:
+    """Adaptive limiters for the endpoints that have an admission policy"""
+
+    def __init__(self, policies: Optional[Dict[str, AdmissionPolicy]] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.limiters = {
+            endpoint: AdaptiveLimiter(endpoint, policy)
+            for endpoint, policy in (policies or DEFAULT_POLICIES).items()
+        }
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(enabled=os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true")
+
+    async def acquire(self, endpoint: str, tier: str) -> Optional[Ticket]:
+        """Wait for a slot or raise LoadShed; None when the endpoint is unmanaged"""
+        limiter = self.limiters.get(endpoint)
+        if not self.enabled or limiter is None:
+            return None
+
+        priority = TIER_PRIORITY.get(tier, LOWEST_PRIORITY)
+        start = time.perf_counter()
+        try:
+            await limiter.acquire(priority)
+        except LoadShed as e:
+            metrics.ADMISSION_SHED.labels(endpoint, tier, e.reason).inc()
+            raise
+        admitted_at = time.perf_counter()
+        metrics.ADMISSION_QUEUE_WAIT.labels(endpoint, tier).observe(admitted_at - start)
+        return Ticket(limiter, tier, admitted_at)
+
+    def release(self, ticket: Optional[Ticket], failed: bool = False, cancelled: bool = False):
+        if ticket is not None:
+            latency = None if cancelled else time.perf_counter() - ticket.admitted_at
+            ticket.limiter.release(latency, failed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "endpoints": {endpoint: limiter.get_stats() for endpoint, limiter in self.limiters.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware releasing the request's admission tickets with its response status
+
+    The admit() dependency appends its ticket to ``scope[TICKETS_SCOPE_KEY]``.
+    FastAPI's yield dependencies do not see HTTPExceptions raised by the
+    endpoint, so the status only becomes known out here.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tickets: List[Ticket] = []
+        scope[TICKETS_SCOPE_KEY] = tickets
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            for ticket in tickets:
+                self.controller.release(ticket, cancelled=True)
+            raise
+        except Exception:
+            for ticket in tickets:
+                self.controller.release(ticket, failed=True)
+            raise
+        for ticket in tickets:
+            self.controller.release(ticket, failed=status[0] >= 500)
@@ -0,0 +1,311 @@
+"""
+PocketShield Alert Delivery Log
+Shared alert rows plus per-device cursors for replaying missed WebSocket alerts
+
+Each threat alert is written once to real_time_alerts and numbered by its seq,
+which is the message_id devices acknowledge. A device's cursor is the highest
+seq it acknowledged; on reconnect every alert after it that the device would
+have received is replayed in one frame.
+
+Seqs are taken when a row is inserted, not when it commits, so on a busy log
+a lower seq can become visible after a higher one. Each refresh reads new
+rows in seq order and re-reads the last ``late_window`` seconds; a seq missing
+between rows read is a gap (in flight, or rolled back once older than the
+window). Acknowledgements and replay cursors are held below the oldest open
+gap, so an alert that commits late is replayed rather than skipped; at worst a
+few alerts near the cursor are sent twice (clients drop seqs they have).
+
+Reconnect storms stay cheap: the recent tail of the log is cached in memory and
+refreshed by at most one query per refresh interval, cursor lookups from
+devices connecting together share one query, and acknowledgements are
+buffered and upserted in bulk.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+INSERT_ALERT_QUERY = """
+INSERT INTO real_time_alerts (alert_type, severity, title, message, alert_data, target_devices, delivery_method)
+VALUES ($1, $2, $3, $4, $5::jsonb, $6, 'websocket')
+RETURNING seq
+"""
+
+# The next $3 rows after seq $1, plus rows at or below it created in the last $4 seconds (late commits)
+TAIL_QUERY = """
+SELECT seq, alert_data, target_devices, EXTRACT(EPOCH FROM NOW() - created_at)::float8 AS age
+FROM (
+    (SELECT * FROM real_time_alerts
+     WHERE device_id IS NULL AND seq > $1 AND created_at > NOW() - make_interval(secs => $2)
+     ORDER BY seq
+     LIMIT $3)
+    UNION ALL
+    (SELECT * FROM real_time_alerts
+     WHERE device_id IS NULL AND seq <= $1 AND created_at > NOW() - make_interval(secs => $4))
+) tail
+ORDER BY seq
+"""
+
+# Newest rows, to fill the tail when a node starts
+SEED_QUERY = """
+SELECT seq, alert_data, target_devices, EXTRACT(EPOCH FROM NOW() - created_at)::float8 AS age
+FROM real_time_alerts
+WHERE device_id IS NULL AND created_at > NOW() - make_interval(secs => $1)
+ORDER BY seq DESC
+LIMIT $2
+"""
+
+CURSORS_QUERY = """
+SELECT device_id, last_acked_seq FROM alert_delivery_cursors WHERE device_id = ANY($1::text[])
+"""
+
+# Unknown devices are skipped by the join instead of failing the whole batch
+UPSERT_CURSORS_QUERY = """
+INSERT INTO alert_delivery_cursors (device_id, last_acked_seq, acked_at)
+SELECT d.device_id, u.seq, NOW()
+FROM unnest($1::text[], $2::bigint[]) AS u(device_id, seq)
+JOIN devices d ON d.device_id = u.device_id
+ON CONFLICT (device_id) DO UPDATE
+SET last_acked_seq = GREATEST(alert_delivery_cursors.last_acked_seq, EXCLUDED.last_acked_seq),
+    acked_at = EXCLUDED.acked_at
+"""
+
+PRUNE_QUERY = """
+DELETE FROM real_time_alerts WHERE device_id IS NULL AND created_at < NOW() - make_interval(secs => $1)
+"""
+
+PRUNE_INTERVAL = 3600.0
+MAX_TRACKED_GAP = 1000  # larger jumps (sequence cache after a crash) are not in-flight inserts
+
+
+@dataclass
+class AlertLogConfig:
+    retention: float = 86400.0  # seconds an alert stays replayable
+    max_tail: int = 1000  # newest alerts cached for replay
+    max_replay: int = 100  # alerts per replay frame (the newest are kept)
+    refresh_interval: float = 1.0  # seconds the cached tail may lag alerts from other nodes
+    ack_flush_interval: float = 5.0
+    cursor_batch_delay: float = 0.02  # seconds cursor lookups wait to share a query
+    late_window: float = 30.0  # seconds an insert may take to commit (well above its 2s timeout)
+
+    @classmethod
+    def from_env(cls) -> "AlertLogConfig":
+        return cls(
+            retention=float(os.getenv("ALERT_REPLAY_RETENTION", "86400")),
+            max_tail=int(os.getenv("ALERT_LOG_TAIL", "1000")),
+            max_replay=int(os.getenv("ALERT_REPLAY_MAX", "100")),
+            refresh_interval=float(os.getenv("ALERT_LOG_REFRESH_INTERVAL", "1.0")),
+            ack_flush_interval=float(os.getenv("ALERT_ACK_FLUSH_INTERVAL", "5.0")),
+            late_window=float(os.getenv("ALERT_LOG_LATE_WINDOW", "30")),
+        )
+
+
+class LogEntry:
+    """One logged alert; ``text`` is encoded once and reused by every replay"""
+
+    __slots__ = ("seq", "alert", "targets", "at", "text")
+
+    def __init__(self, seq: int, alert: Dict[str, Any], targets: Optional[Iterable[str]], at: float):
+        self.seq = seq
+        self.alert = alert
+        self.targets = frozenset(targets) if targets else None  # None: every matching subscriber
+        self.at = at
+        self.text = json.dumps({"seq": seq, "alert": alert})
+
+
+class AlertLog:
+    """Alert log writer, replay tail cache and cursor store"""
+
+    def __init__(self, db_manager, config: Optional[AlertLogConfig] = None):
+        self.db = db_manager
+        self.config = config or AlertLogConfig.from_env()
+        self.db.register("alert_log.insert", INSERT_ALERT_QUERY, timeout=2.0)
+        self.db.register("alert_log.tail", TAIL_QUERY, timeout=2.0)
+        self.db.register("alert_log.seed", SEED_QUERY, timeout=2.0)
+        self.db.register("alert_log.cursors", CURSORS_QUERY, timeout=2.0)
+        self.db.register("alert_log.ack", UPSERT_CURSORS_QUERY)
+        self.db.register("alert_log.prune", PRUNE_QUERY)
+
+        self._entries: Dict[int, LogEntry] = {}
+        self._synced_seq: Optional[int] = None  # every committed row up to here has been read
+        self._gaps: Dict[int, float] = {}  # seq not seen yet -> time.monotonic() it was noticed
+        self._refreshed_at = float("-inf")
+        self._refresh: Optional[asyncio.Future] = None
+        self._pending_cursors: Dict[str, asyncio.Future] = {}
+        self._cursor_batch: Optional[asyncio.TimerHandle] = None
+        self._acks: Dict[str, int] = {}
+        self._pruned_at = time.monotonic()
+        self._flush_task = None
+
+    async def start(self):
+        await self.refresh()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush_acks()
+
+    # Log
+    async def append(self, alert: Dict[str, Any], target_devices: Optional[List[str]] = None) -> int:
+        """Write an alert (``ThreatAlert.to_dict()``) once; returns its seq"""
+        row = await self.db.execute_one(
+            "alert_log.insert", alert["alert_type"], alert["severity"], alert["title"],
+            alert["description"], json.dumps(alert), target_devices or None
+        )
+        metrics.ALERT_LOG_QUERIES.labels("insert").inc()
+        self.remember(row["seq"], alert, target_devices)
+        return row["seq"]
+
+    def remember(self, seq: int, alert: Dict[str, Any], target_devices: Optional[Iterable[str]],
+                 at: Optional[float] = None):
+        """Add an alert to the replay tail (e.g. one logged by another node)"""
+        if seq in self._entries:
+            return
+        self._entries[seq] = LogEntry(seq, alert, target_devices, at if at is not None else time.time())
+        if len(self._entries) > self.config.max_tail:
+            for old in sorted(self._entries)[:len(self._entries) - self.config.max_tail]:
+                del self._entries[old]
+
+    @property
+    def stable_seq(self) -> int:
+        """Highest seq below which every alert has been read (or given up on)"""
+        synced = self._synced_seq or 0
+        return min(self._gaps) - 1 if self._gaps else synced
+
+    async def refresh(self):
+        """Load alerts logged since the last refresh (by any node)"""
+        try:
+            if self._synced_seq is None:
+                rows = await self.db.execute_query("alert_log.seed", self.config.retention, self.config.max_tail)
+                metrics.ALERT_LOG_QUERIES.labels("tail").inc()
+                rows = sorted(rows, key=lambda row: row["seq"])
+                self._synced_seq = rows[0]["seq"] - 1 if rows else 0
+                self._load_rows(rows)
+            while True:
+                synced = self._synced_seq
+                rows = await self.db.execute_query(
+                    "alert_log.tail", synced, self.config.retention, self.config.max_tail, self.config.late_window
+                )
+                metrics.ALERT_LOG_QUERIES.labels("tail").inc()
+                self._load_rows(rows)
+                # A full page: more rows follow the last one read
+                if sum(1 for row in rows if row["seq"] > synced) < self.config.max_tail:
+                    break
+        except Exception as e:
+            logger.warning(f"Alert log refresh failed, replaying from cache: {e}")
+        now = time.monotonic()
+        for seq, noticed in list(self._gaps.items()):
+            if now - noticed > self.config.late_window:
+                del self._gaps[seq]  # rolled back
+        self._refreshed_at = now
+
+    def _load_rows(self, rows: List[Dict[str, Any]]):
+        """Cache rows (in seq order), noting seqs skipped past and filling ones that committed late"""
+        now, noticed = time.time(), time.monotonic()
+        for row in rows:
+            seq = row["seq"]
+            alert = row["alert_data"]
+            if isinstance(alert, str):  # asyncpg returns JSONB as text unless a codec is registered
+                alert = json.loads(alert)
+            self.remember(seq, alert, row["target_devices"], now - row["age"])
+            if seq <= self._synced_seq:
+                self._gaps.pop(seq, None)
+                continue
+            if seq - self._synced_seq <= MAX_TRACKED_GAP:
+                for missing in range(self._synced_seq + 1, seq):
+                    self._gaps[missing] = noticed
+            self._synced_seq = seq
+
+    async def _fresh(self, force: bool = False):
+        """Refresh unless that happened within the refresh interval"""
+        if force or time.monotonic() - self._refreshed_at > self.config.refresh_interval:
+            # Devices reconnecting together wait on the same query
+            if self._refresh is None:
+                self._refresh = asyncio.ensure_future(self.refresh())
+                self._refresh.add_done_callback(lambda _: setattr(self, "_refresh", None))
+            await asyncio.shield(self._refresh)
+
+    async def missed(self, cursor: int) -> List[LogEntry]:
+        """Alerts after ``cursor`` (held below open gaps) that are still replayable, oldest first"""
+        await self._fresh()
+        cursor = min(cursor, self.stable_seq)
+        horizon = time.time() - self.config.retention
+        return sorted(
+            (entry for entry in self._entries.values() if entry.seq > cursor and entry.at >= horizon),
+            key=lambda entry: entry.seq
+        )
+
+    # Cursors
+    async def cursor(self, device_id: str) -> Optional[int]:
+        """Last seq the device acknowledged, or None if it never did"""
+        future = self._pending_cursors.get(device_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending_cursors[device_id] = loop.create_future()
+            if self._cursor_batch is None:
+                self._cursor_batch = loop.call_later(self.config.cursor_batch_delay, self._start_cursor_batch)
+        return await asyncio.shield(future)
+
+    def _start_cursor_batch(self):
+        pending, self._pending_cursors = self._pending_cursors, {}
+        self._cursor_batch = None
+        asyncio.create_task(self._load_cursors(pending))
+
+    async def _load_cursors(self, pending: Dict[str, asyncio.Future]):
+        cursors: Dict[str, int] = {}
+        try:
+            rows = await self.db.execute_query("alert_log.cursors", list(pending))
+            metrics.ALERT_LOG_QUERIES.labels("cursors").inc()
+            cursors = {row["device_id"]: row["last_acked_seq"] for row in rows}
+        except Exception as e:
+            logger.warning(f"Alert cursor lookup failed for {len(pending)} devices: {e}")
+        for device_id, future in pending.items():
+            if not future.done():
+                # An ack still waiting to be flushed is newer than the stored cursor
+                known = [seq for seq in (cursors.get(device_id), self._acks.get(device_id)) if seq is not None]
+                future.set_result(max(known, default=None))
+
+    async def ack(self, device_id: str, seq: int):
+        """Record that the device processed everything up to ``seq`` (written in bulk)"""
+        # Held below any alert that may still commit: the device cannot have seen it yet
+        await self._fresh(force=seq > (self._synced_seq or 0))
+        self._record(device_id, min(seq, self.stable_seq))
+
+    def _record(self, device_id: str, seq: int):
+        if seq > self._acks.get(device_id, 0):
+            self._acks[device_id] = seq
+
+    async def flush_acks(self):
+        acks, self._acks = self._acks, {}
+        if not acks:
+            return
+        try:
+            await self.db.execute("alert_log.ack", list(acks), list(acks.values()))
+        except Exception:
+            # Keep them for the next flush
+            for device_id, seq in acks.items():
+                self._record(device_id, seq)
+            raise
+        metrics.ALERT_LOG_QUERIES.labels("ack").inc()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.config.ack_flush_interval)
+                await self.flush_acks()
+                if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    await self.db.execute("alert_log.prune", self.config.retention)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush alert acknowledgements: {e}")
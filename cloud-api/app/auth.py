@@ -0,0 +1,239 @@
+"""
+PocketShield Authentication Layer
+Cached JWT verification with device validation and Redis-synced revocation
+
+Revocations live in a Redis sorted set scored by when they stop mattering: a
+token's own ``exp``, or for a device, when the last token issued before the
+revocation expires. Each sync drops the entries past their score, so the set
+only holds revocations that can still reject a token.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+
+from app import profiling
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_SET_KEY = "auth:revocations"  # sorted set: entry -> time.time() it lapses
+REVOCATION_VERSION_KEY = "auth:revoked:version"
+
+
+class AuthError(Exception):
+    """Token rejected; carries the WebSocket close code for the failure"""
+
+    def __init__(self, reason: str, close_code: int = 4001):
+        super().__init__(reason)
+        self.reason = reason
+        self.close_code = close_code
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries carry their own expiry (time.time() based)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key, now: Optional[float] = None):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= (now if now is not None else time.time()):
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at: float):
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def token_digest(token: str) -> str:
+    """Stable digest used to key caches and revocations without storing raw tokens"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+class TokenVerifier:
+    """Verifies device tokens for both the HTTP and WebSocket paths"""
+
+    def __init__(
+        self,
+        db_manager,
+        secret: str,
+        algorithm: str = "HS256",
+        cache_size: int = 50000,
+        device_cache_ttl: int = 300,
+        missing_device_ttl: int = 30,
+        revocation_sync_interval: float = 5.0,
+        token_lifetime: int = 30 * 86400,
+    ):
+        self.db = db_manager
+        self.redis = None
+        self.secret = secret
+        self.algorithm = algorithm
+        self.device_cache_ttl = device_cache_ttl
+        self.missing_device_ttl = missing_device_ttl
+        self.revocation_sync_interval = revocation_sync_interval
+        self.token_lifetime = token_lifetime  # longest exp the API issues; bounds device revocations
+
+        # token digest -> device_id, expiring with the token
+        self._claims = TTLCache(cache_size)
+        # device_id -> is_active
+        self._devices = TTLCache(cache_size)
+        self._device_lookups: Dict[str, asyncio.Future] = {}
+
+        self._revoked: Dict[str, float] = {}  # entry -> lapses at
+        self._revocation_version: Optional[str] = None
+        self._sync_task = None
+
+    async def start(self, redis_client):
+        """Load the revocation set and keep it in sync with Redis"""
+        self.redis = redis_client
+        await self._sync_revocations()
+        self._sync_task = asyncio.create_task(self._revocation_sync_loop())
+
+    async def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+
+    async def verify(self, token: str) -> str:
+        """Return the device_id for a valid token or raise AuthError"""
+        with profiling.span("auth"):
+            digest = token_digest(token)
+            now = time.time()
+
+            device_id = self._claims.get(digest, now)
+            if device_id is None:
+                with profiling.span("auth.jwt_decode"):
+                    device_id, expires_at = self._decode(token)
+                self._claims.set(digest, device_id, expires_at)
+
+            for entry in (f"token:{digest}", f"device:{device_id}"):
+                if self._revoked.get(entry, 0.0) > now:
+                    raise AuthError("Token revoked", close_code=4003)
+
+            with profiling.span("auth.device_lookup"):
+                is_active = await self._device_is_active(device_id, now)
+            if not is_active:
+                raise AuthError("Device not found", close_code=4002)
+
+            return device_id
+
+    def _decode(self, token: str) -> Tuple[str, float]:
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.InvalidTokenError as e:
+            raise AuthError(f"Invalid token: {e}")
+
+        device_id = payload.get("device_id")
+        if not device_id:
+            raise AuthError("Invalid token: missing device_id")
+
+        # Tokens without exp are still cached, but revalidated periodically
+        expires_at = float(payload.get("exp") or time.time() + self.device_cache_ttl)
+        return device_id, expires_at
+
+    async def _device_is_active(self, device_id: str, now: float) -> bool:
+        cached = self._devices.get(device_id, now)
+        if cached is not None:
+            return cached
+
+        # Collapse concurrent lookups for the same device into one query
+        pending = self._device_lookups.get(device_id)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._device_lookups[device_id] = future
+        try:
+            row = await self.db.execute_one(
+                "SELECT is_active FROM devices WHERE device_id = $1", device_id
+            )
+            is_active = bool(row and row["is_active"])
+            ttl = self.device_cache_ttl if is_active else self.missing_device_ttl
+            self._devices.set(device_id, is_active, now + ttl)
+            future.set_result(is_active)
+            return is_active
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._device_lookups[device_id]
+
+    def forget_device(self, device_id: str):
+        """Drop the cached device state (e.g. after registration or deactivation)"""
+        self._devices.pop(device_id)
+
+    async def revoke_device(self, device_id: str):
+        """Reject every token issued to the device so far"""
+        await self._revoke(f"device:{device_id}", time.time() + self.token_lifetime)
+        self.forget_device(device_id)
+
+    async def revoke_token(self, token: str):
+        """Reject one token until its exp (raises AuthError if it is not a token of ours)"""
+        try:
+            payload = jwt.decode(
+                token, self.secret, algorithms=[self.algorithm], options={"verify_exp": False}
+            )
+        except jwt.InvalidTokenError as e:
+            raise AuthError(f"Invalid token: {e}")
+        # A token without exp never lapses, so neither does its revocation
+        expires_at = float(payload["exp"]) if payload.get("exp") else float("inf")
+        if expires_at > time.time():
+            await self._revoke(f"token:{token_digest(token)}", expires_at)
+
+    async def _revoke(self, entry: str, expires_at: float):
+        self._revoked[entry] = max(expires_at, self._revoked.get(entry, 0.0))
+        if self.redis:
+            pipe = self.redis.pipeline()
+            pipe.zadd(REVOCATION_SET_KEY, {entry: expires_at}, gt=True)  # never shorten one
+            pipe.incr(REVOCATION_VERSION_KEY)
+            await pipe.execute()
+
+    async def _sync_revocations(self):
+        """Prune lapsed revocations and reload the local copy when the Redis version changes"""
+        if not self.redis:
+            return
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zremrangebyscore(REVOCATION_SET_KEY, "-inf", now)
+        pipe.get(REVOCATION_VERSION_KEY)
+        _, version = await pipe.execute()
+        if version == self._revocation_version:
+            self._revoked = {entry: lapses for entry, lapses in self._revoked.items() if lapses > now}
+            return
+        members = await self.redis.zrange(REVOCATION_SET_KEY, 0, -1, withscores=True)
+        self._revoked = {entry: float(lapses) for entry, lapses in members}
+        self._revocation_version = version
+        logger.info(f"Revocation set synced: {len(self._revoked)} entries (version {version})")
+
+    async def _revocation_sync_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.revocation_sync_interval)
+                await self._sync_revocations()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error syncing revocation set: {e}")
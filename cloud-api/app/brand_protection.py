@@ -0,0 +1,327 @@
+"""
+PocketShield Brand Protection
+Typosquat and homoglyph detection against a protected-brand list
+
+Host labels are reduced to a confusable "skeleton" (punycode decoded, NFKD with
+marks stripped, lookalike characters and digit substitutions mapped to ASCII)
+and matched against brand skeletons with a SymSpell-style deletion index:
+every brand registers its variants with up to ``max_distance`` characters
+deleted, a lookup generates the same deletions of each token, and only brands
+sharing a variant are checked with the real (optimal string alignment)
+distance. Lookup cost depends on the host, not on the number of brands.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import json
+import logging
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Characters that render like ASCII letters (subset of Unicode confusables.txt)
+CONFUSABLES = str.maketrans({
+    # Cyrillic
+    "а": "a", "в": "b", "е": "e", "ё": "e", "һ": "h", "і": "i", "ї": "i", "ј": "j", "к": "k",
+    "ӏ": "l", "м": "m", "н": "h", "о": "o", "р": "p", "с": "c", "ԁ": "d", "ѕ": "s", "т": "t",
+    "у": "y", "ү": "y", "х": "x", "ԛ": "q", "ԝ": "w", "ь": "b", "ɡ": "g",
+    # Greek
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p",
+    "τ": "t", "υ": "u", "χ": "x", "ω": "w",
+    # Latin lookalikes without a decomposition
+    "ı": "i", "ł": "l", "ø": "o", "đ": "d", "ħ": "h", "ǀ": "l", "ß": "b",
+    # Digits used as letters
+    "0": "o", "1": "l", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b",
+    # Separators some registrars allow inside labels
+    "_": "",
+})
+
+# Letter pairs that read as one letter at a glance (applied after CONFUSABLES)
+CONFUSABLE_PAIRS = (("rn", "m"), ("vv", "w"), ("cl", "d"))
+
+# Multi-label public suffixes we see in traffic; anything else is treated as a one-label TLD
+MULTI_LABEL_SUFFIXES = frozenset({
+    "co.in", "net.in", "org.in", "gov.in", "ac.in", "edu.in", "res.in", "firm.in", "gen.in", "ind.in",
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "com.au", "net.au", "org.au", "co.nz",
+    "com.br", "com.cn", "com.sg", "com.my", "com.pk", "com.bd", "com.np", "com.lk", "co.za",
+    "co.jp", "com.mx", "com.tr", "com.hk", "co.id", "com.ph", "com.vn", "com.ng",
+})
+
+# Second-level labels of suffixes missing above (amazon.com.ar splits as labels ["amazon", "com"])
+GENERIC_SECOND_LEVEL = frozenset({"com", "co", "net", "org", "gov", "edu", "ac"})
+
+# Used until the protected_brands table has been loaded (and merged under it)
+DEFAULT_BRANDS: Dict[str, Tuple[str, ...]] = {
+    "paypal": ("paypal.com", "paypal.me"),
+    "google": ("google.com", "google.co.in", "youtube.com", "gmail.com"),
+    "amazon": ("amazon.com", "amazon.in", "amazonaws.com"),
+    "flipkart": ("flipkart.com",),
+    "paytm": ("paytm.com", "paytm.in"),
+    "phonepe": ("phonepe.com",),
+    "whatsapp": ("whatsapp.com", "whatsapp.net"),
+    "facebook": ("facebook.com", "fb.com"),
+    "instagram": ("instagram.com",),
+    "microsoft": ("microsoft.com", "live.com", "office.com"),
+    "apple": ("apple.com", "icloud.com"),
+    "netflix": ("netflix.com",),
+    "onlinesbi": ("onlinesbi.sbi", "sbi.co.in"),
+    "hdfcbank": ("hdfcbank.com",),
+    "icicibank": ("icicibank.com",),
+    "axisbank": ("axisbank.com",),
+    "kotak": ("kotak.com",),
+    "incometax": ("incometax.gov.in",),
+    "irctc": ("irctc.co.in",),
+}
+
+# Skeleton length -> allowed edit distance; short names only match exactly
+DISTANCE_BY_LENGTH = ((9, 2), (5, 1), (0, 0))
+MAX_DISTANCE = DISTANCE_BY_LENGTH[0][1]
+MIN_TOKEN_LENGTH = 3
+MAX_LABEL_LENGTH = 63
+# Only the first PREFIX_LENGTH characters are indexed (SymSpell's prefix trick):
+# edits beyond it are caught by the full-string check, and long names stop
+# dominating index size and lookup cost
+PREFIX_LENGTH = 7
+MATCH_CACHE_SIZE = 65536
+
+# Threat confidence by how the lookalike was built. A lone brand_impersonation
+# threat scores 60 * confidence against a suspicious threshold of 50: one edit
+# away from a short name (kodak/kotak, apply/apple) is too common to flag on its
+# own, and <brand>.<another suffix> (google.de, amazon.co.uk) is most likely the
+# brand's own regional site missing from its domain list.
+CONFIDENCE = {"homoglyph": 0.95, "brand_in_domain": 0.95, "other_suffix": 0.3, 1: 0.85, 2: 0.7}
+SHORT_NAME_LENGTH = 8  # skeleton length up to which a single edit is weak evidence
+SHORT_TYPO_CONFIDENCE = 0.6
+
+
+def allowed_distance(length: int) -> int:
+    for min_length, distance in DISTANCE_BY_LENGTH:
+        if length >= min_length:
+            return distance
+    return 0
+
+
+def decode_label(label: str) -> str:
+    """Punycode A-label -> Unicode; other labels unchanged"""
+    if label.startswith("xn--"):
+        try:
+            return codecs.decode(label[4:].encode("ascii"), "punycode")
+        except (UnicodeError, ValueError):
+            return label
+    return label
+
+
+def skeleton(text: str) -> str:
+    """Confusable-folded ASCII-ish form used on both brands and hosts"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).translate(CONFUSABLES)
+    for pair, replacement in CONFUSABLE_PAIRS:
+        text = text.replace(pair, replacement)
+    return text
+
+
+def split_host(host: str) -> Tuple[List[str], str]:
+    """(labels left of the registrable domain's suffix, registrable domain)"""
+    labels = [label for label in host.lower().rstrip(".").split(".") if label]
+    suffix_labels = 2 if len(labels) > 2 and ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 1
+    if len(labels) <= suffix_labels:
+        return [], ".".join(labels)
+    return labels[:-suffix_labels], ".".join(labels[-suffix_labels - 1:])
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    """``word`` with every combination of up to ``distance`` characters removed"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def osa_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or ``limit + 1`` once it must exceed ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+@dataclass(frozen=True)
+class BrandMatch:
+    brand: str
+    token: str
+    distance: int
+    kind: str  # "brand_in_domain", "other_suffix", "homoglyph" (same skeleton, different spelling) or "typosquat"
+    confidence: float
+
+    def to_threat(self) -> Dict[str, Any]:
+        return {
+            "type": "brand_impersonation",
+            "confidence": self.confidence,
+            "description": f"Domain imitates protected brand '{self.brand}' (edit distance {self.distance})",
+            "tags": ["brand_impersonation", self.kind],
+            "brand": self.brand,
+            "distance": self.distance,
+        }
+
+
+class BrandIndex:
+    """Deletion index over brand skeletons plus the brands' own registrable domains"""
+
+    def __init__(self, brands: Dict[str, Iterable[str]]):
+        self.brands: List[str] = []
+        self._skeletons: List[str] = []
+        self._variants: Dict[str, Any] = {}  # variant -> brand id, or list of ids when shared
+        self.official_domains: Set[str] = set()
+        # Hosts repeat heavily in URL traffic
+        self.match = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._match)
+
+        for name, domains in brands.items():
+            self.official_domains.update(domain.lower() for domain in domains)
+            brand_skeleton = skeleton(name)
+            if len(brand_skeleton) < MIN_TOKEN_LENGTH:
+                continue
+            brand_id = len(self.brands)
+            self.brands.append(name)
+            self._skeletons.append(brand_skeleton)
+            for variant in deletes(brand_skeleton[:PREFIX_LENGTH], allowed_distance(len(brand_skeleton))):
+                existing = self._variants.get(variant)
+                if existing is None:
+                    self._variants[variant] = brand_id
+                elif isinstance(existing, list):
+                    existing.append(brand_id)
+                else:
+                    self._variants[variant] = [existing, brand_id]
+
+    def __len__(self) -> int:
+        return len(self.brands)
+
+    def _tokens(self, labels: List[str]) -> Set[Tuple[str, str]]:
+        """(raw, skeleton) tokens: each label, its hyphen-separated parts and the label without hyphens"""
+        tokens = set()
+        for label in labels:
+            if label == "www" or len(label) > MAX_LABEL_LENGTH:
+                continue
+            label = decode_label(label)
+            parts = label.split("-")
+            if len(parts) > 1:
+                parts.append("".join(parts))
+            for part in parts:
+                if len(part) >= MIN_TOKEN_LENGTH:
+                    tokens.add((part, skeleton(part)))
+        return tokens
+
+    def _match(self, host: str) -> Tuple[BrandMatch, ...]:
+        """Brands the host imitates; empty for the brands' own domains (use ``match``)"""
+        labels, registrable = split_host(host)
+        if not labels or registrable in self.official_domains:
+            return ()
+
+        best: Dict[str, BrandMatch] = {}
+        for raw, token in self._tokens(labels):
+            candidates: Set[int] = set()
+            for variant in deletes(token[:PREFIX_LENGTH], min(MAX_DISTANCE, allowed_distance(len(token)) + 1)):
+                found = self._variants.get(variant)
+                if found is None:
+                    continue
+                if isinstance(found, list):
+                    candidates.update(found)
+                else:
+                    candidates.add(found)
+
+            for brand_id in candidates:
+                brand_skeleton = self._skeletons[brand_id]
+                limit = allowed_distance(len(brand_skeleton))
+                distance = osa_distance(token, brand_skeleton, limit)
+                if distance > limit:
+                    continue
+                if distance == 0 and raw == brand_skeleton:
+                    # The brand name itself outside its own domains (brand-secure.tk, brand.evil.com),
+                    # or as the whole registrable label under another suffix (brand.de)
+                    own_label = raw == labels[-1] or (
+                        len(labels) > 1 and raw == labels[-2] and labels[-1] in GENERIC_SECOND_LEVEL
+                    )
+                    kind = "other_suffix" if own_label else "brand_in_domain"
+                    confidence = CONFIDENCE[kind]
+                elif distance == 0:
+                    kind, confidence = "homoglyph", CONFIDENCE["homoglyph"]
+                else:
+                    kind = "typosquat"
+                    if distance == 1 and len(brand_skeleton) <= SHORT_NAME_LENGTH:
+                        confidence = SHORT_TYPO_CONFIDENCE
+                    else:
+                        confidence = CONFIDENCE.get(distance, 0.6)
+                brand = self.brands[brand_id]
+                if brand not in best or confidence > best[brand].confidence:
+                    best[brand] = BrandMatch(brand, raw, distance, kind, confidence)
+        return tuple(sorted(best.values(), key=lambda m: -m.confidence))
+
+
+def brand_list_version(brands: Dict[str, Tuple[str, ...]]) -> str:
+    """Short digest of the brand list, the same on every worker that loaded it"""
+    return hashlib.sha256(json.dumps(sorted(brands.items())).encode()).hexdigest()[:12]
+
+
+class BrandProtection:
+    """Keeps the BrandIndex in sync with the protected_brands table"""
+
+    def __init__(self, db_manager, refresh_interval: float = 300.0):
+        self.db = db_manager
+        self.refresh_interval = refresh_interval
+        self.index = BrandIndex(DEFAULT_BRANDS)
+        self._brands: Dict[str, Tuple[str, ...]] = dict(DEFAULT_BRANDS)
+        self.version = brand_list_version(self._brands)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.refresh_interval)
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Brand list refresh failed: {e}")
+
+    async def refresh(self):
+        rows = await self.db.execute_query(
+            "SELECT name, domains FROM protected_brands WHERE enabled", readonly=True
+        )
+        brands = dict(DEFAULT_BRANDS)
+        brands.update((row["name"], tuple(row["domains"] or ())) for row in rows)
+        if brands == self._brands:
+            return
+        # Building the deletion index for tens of thousands of brands takes a while; keep it off the loop
+        self.index = await asyncio.to_thread(BrandIndex, brands)
+        self._brands = brands
+        self.version = brand_list_version(brands)
+        logger.info(f"Loaded {len(self.index)} protected brands")
+
+    def check(self, host: str) -> List[Dict[str, Any]]:
+        return [match.to_threat() for match in self.index.match(host)]
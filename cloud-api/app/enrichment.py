@@ -0,0 +1,390 @@
+"""
+PocketShield URL Enrichment
+Redirect-chain expansion and DNS resolution for URL analysis
+
+Optional stage (URL_ENRICHMENT_ENABLED). One pooled HTTP client and one DNS
+resolver per worker; every host gets at most ``per_host_limit`` concurrent
+requests, results are cached with TTLs, and each URL's enrichment is bounded
+by ``timeout`` seconds in total. When the budget runs out the analysis uses
+whatever was learned so far instead of waiting.
+
+By default only URLs on known shortener/redirector hosts are expanded, so
+ordinary URLs never wait on the network. Hosts that resolve to private,
+loopback or link-local addresses are never fetched, and each hop connects to
+the address resolved here.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import aiohttp
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+from app import metrics
+from app.auth import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SHORTENER_HOSTS = frozenset({
+    "bit.ly", "bitly.com", "tinyurl.com", "t.co", "goo.gl", "is.gd", "v.gd", "ow.ly", "buff.ly",
+    "rebrand.ly", "cutt.ly", "shorturl.at", "tiny.cc", "rb.gy", "bit.do", "s.id", "t.ly",
+    "lnkd.in", "shorte.st", "adf.ly", "bl.ink", "soo.gd", "clck.ru", "qr.ae", "surl.li",
+})
+
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+# Cached NXDOMAIN/empty answers are retried after this long; lookup errors sooner
+NEGATIVE_TTL = 60
+ERROR_TTL = 5
+
+
+@dataclass
+class EnrichmentConfig:
+    enabled: bool = False
+    expand_all: bool = False  # False: only SHORTENER_HOSTS (and extra_shorteners)
+    extra_shorteners: Tuple[str, ...] = ()
+    timeout: float = 1.5  # seconds per URL, redirects + DNS together
+    hop_timeout: float = 1.0
+    max_redirects: int = 5
+    per_host_limit: int = 4
+    max_connections: int = 100
+    redirect_ttl: int = 3600
+    dns_min_ttl: int = 60
+    dns_max_ttl: int = 3600
+    nameservers: Tuple[str, ...] = ()
+    dns_port: int = 53
+    allow_private: bool = False  # only for local stand-in servers
+    cache_size: int = 50000
+
+    @classmethod
+    def from_env(cls) -> "EnrichmentConfig":
+        def split(value: str) -> Tuple[str, ...]:
+            return tuple(item.strip() for item in value.split(",") if item.strip())
+
+        return cls(
+            enabled=os.getenv("URL_ENRICHMENT_ENABLED", "false").lower() == "true",
+            expand_all=os.getenv("URL_ENRICHMENT_EXPAND", "shorteners") == "all",
+            extra_shorteners=split(os.getenv("URL_ENRICHMENT_SHORTENERS", "")),
+            timeout=float(os.getenv("URL_ENRICHMENT_TIMEOUT", cls.timeout)),
+            max_redirects=int(os.getenv("URL_ENRICHMENT_MAX_REDIRECTS", cls.max_redirects)),
+            per_host_limit=int(os.getenv("URL_ENRICHMENT_PER_HOST_LIMIT", cls.per_host_limit)),
+            max_connections=int(os.getenv("URL_ENRICHMENT_MAX_CONNECTIONS", cls.max_connections)),
+            nameservers=split(os.getenv("DNS_NAMESERVERS", "")),
+        )
+
+
+@dataclass
+class DnsResult:
+    addresses: List[str] = field(default_factory=list)
+    status: str = "ok"  # ok, nxdomain, no_answer, error
+
+
+@dataclass
+class Enrichment:
+    url: str
+    final_url: Optional[str] = None
+    redirects: List[str] = field(default_factory=list)
+    dns: Optional[DnsResult] = None
+    status: str = "ok"  # ok, timeout, blocked (unresolvable or internal host), unreachable, redirect_limit, error
+    elapsed_ms: float = 0.0
+
+    @property
+    def redirected(self) -> bool:
+        return bool(self.final_url) and self.final_url != self.url
+
+    def threats(self) -> List[Dict[str, Any]]:
+        threats = []
+        if self.dns and self.dns.status == "nxdomain":
+            threats.append({
+                "type": "suspicious",
+                "confidence": 0.3,
+                "description": "Final destination domain does not resolve",
+                "tags": ["enrichment", "nxdomain"],
+            })
+        if self.status == "redirect_limit":
+            threats.append({
+                "type": "suspicious",
+                "confidence": 0.5,
+                "description": f"Redirect chain longer than {len(self.redirects)} hops",
+                "tags": ["enrichment", "redirect_chain"],
+            })
+        return threats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "final_url": self.final_url,
+            "redirects": self.redirects,
+            "addresses": self.dns.addresses if self.dns else [],
+            "dns_status": self.dns.status if self.dns else None,
+            "status": self.status,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+        }
+
+
+class HostLimiter:
+    """Per-host semaphores, dropped once a host has nothing in flight"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    def slot(self, host: str) -> "_HostSlot":
+        return _HostSlot(self, host)
+
+    def _enter(self, host: str) -> asyncio.Semaphore:
+        semaphore, users = self._semaphores.get(host) or (asyncio.Semaphore(self.limit), 0)
+        self._semaphores[host] = (semaphore, users + 1)
+        return semaphore
+
+    def _exit(self, host: str):
+        semaphore, users = self._semaphores[host]
+        if users <= 1:
+            del self._semaphores[host]
+        else:
+            self._semaphores[host] = (semaphore, users - 1)
+
+
+class _HostSlot:
+    def __init__(self, limiter: HostLimiter, host: str):
+        self.limiter = limiter
+        self.host = host
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = self.limiter._enter(self.host)
+        try:
+            await self.semaphore.acquire()
+        except BaseException:
+            self.limiter._exit(self.host)
+            raise
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+        self.limiter._exit(self.host)
+
+
+class UrlEnricher:
+    """Expands redirect chains and resolves the final host, with caching and time limits"""
+
+    def __init__(self, config: EnrichmentConfig):
+        self.config = config
+        self.client: Optional[aiohttp.ClientSession] = None
+        self.resolver: Optional[dns.asyncresolver.Resolver] = None
+        self.shorteners = SHORTENER_HOSTS | frozenset(config.extra_shorteners)
+        self._hosts = HostLimiter(config.per_host_limit)
+        self._redirects = TTLCache(config.cache_size)  # url -> (location or None, status)
+        self._dns = TTLCache(config.cache_size)        # host -> DnsResult
+        self._inflight: Dict[Tuple[str, str], list] = {}  # key -> [task, waiters]
+
+    @classmethod
+    def from_env(cls) -> "UrlEnricher":
+        return cls(EnrichmentConfig.from_env())
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self.client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.config.max_connections, ttl_dns_cache=None),
+            timeout=aiohttp.ClientTimeout(total=self.config.hop_timeout),
+            headers={"User-Agent": "PocketShield-LinkExpander/1.0"},
+            auto_decompress=False,
+        )
+        self.resolver = dns.asyncresolver.Resolver(configure=not self.config.nameservers)
+        if self.config.nameservers:
+            self.resolver.nameservers = list(self.config.nameservers)
+            self.resolver.port = self.config.dns_port
+        self.resolver.lifetime = self.config.hop_timeout
+
+    async def stop(self):
+        for task, _ in list(self._inflight.values()):
+            task.cancel()
+        if self.client:
+            await self.client.close()
+
+    def should_enrich(self, url: str) -> bool:
+        if not self.enabled or self.client is None:
+            return False
+        if self.config.expand_all:
+            return True
+        host = (urlsplit(url).hostname or "").lower()
+        return host in self.shorteners or host.removeprefix("www.") in self.shorteners
+
+    async def enrich(self, url: str) -> Enrichment:
+        """Expand ``url`` and resolve its final host within the time budget"""
+        result = Enrichment(url=url)
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.config.timeout):
+                await self._expand(result)
+                host = urlsplit(result.final_url or url).hostname
+                if host and not _is_ip(host):
+                    result.dns = await self.resolve(host)
+        except TimeoutError:
+            result.status = "timeout"
+            metrics.ENRICHMENT_LOOKUPS.labels("url", "timeout").inc()
+        except Exception as e:
+            result.status = "error"
+            logger.warning(f"URL enrichment failed: {e}")
+        result.elapsed_ms = (time.perf_counter() - start) * 1000
+        return result
+
+    async def _expand(self, result: Enrichment):
+        current = result.url
+        for _ in range(self.config.max_redirects):
+            parts = urlsplit(current)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                break
+            cached = self._redirects.get(current)
+            if cached is not None:
+                metrics.ENRICHMENT_LOOKUPS.labels("redirect", "hit").inc()
+            else:
+                metrics.ENRICHMENT_LOOKUPS.labels("redirect", "miss").inc()
+                address = await self._address(parts.hostname)
+                if address is None:
+                    result.status = "blocked"
+                    break
+                cached = await self._single_flight("redirect", current, self._location, current, address)
+            location, outcome = cached
+            if outcome == "error":
+                result.status = "unreachable"
+            if location is None:
+                break
+            result.redirects.append(location)
+            current = location
+        else:
+            result.status = "redirect_limit"
+        result.final_url = current
+
+    async def _address(self, host: str) -> Optional[str]:
+        """Address to connect to for ``host``, or None if it must not be fetched
+
+        Requests go to the address resolved here rather than letting the client
+        resolve again, so a host cannot pass the check and then rebind to an
+        internal address.
+        """
+        if _is_ip(host):
+            addresses = [host.strip("[]")]
+        else:
+            addresses = (await self.resolve(host)).addresses
+        if not addresses:
+            return None
+        if not self.config.allow_private and not all(_is_public(address) for address in addresses):
+            metrics.ENRICHMENT_LOOKUPS.labels("redirect", "blocked").inc()
+            return None
+        return addresses[0]
+
+    async def _location(self, url: str, address: str) -> Tuple[Optional[str], str]:
+        """One hop: (absolute redirect target or None, outcome), cached"""
+        parts = urlsplit(url)
+        host = f"[{address}]" if ":" in address else address
+        if parts.port:
+            host = f"{host}:{parts.port}"
+        target = urlunsplit((parts.scheme, host, parts.path or "/", parts.query, ""))
+        options = {
+            "headers": {"Host": parts.netloc.rpartition("@")[2]},
+            "allow_redirects": False,
+            "server_hostname": parts.hostname if parts.scheme == "https" else None,
+        }
+
+        try:
+            async with self._hosts.slot(parts.hostname):
+                async with self.client.head(target, **options) as response:
+                    status, location = response.status, response.headers.get("Location")
+                if status in (403, 405, 501):
+                    # Some redirectors reject HEAD; read the headers of a GET and drop the body
+                    async with self.client.get(target, **options) as response:
+                        status, location = response.status, response.headers.get("Location")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.ENRICHMENT_LOOKUPS.labels("redirect", "error").inc()
+            logger.debug(f"Redirect lookup failed for {parts.hostname}: {e!r}")
+            return self._remember(url, None, "error", ERROR_TTL)
+
+        if status in REDIRECT_STATUSES and location:
+            # Permanent redirects are cached longer than temporary ones
+            ttl = self.config.redirect_ttl if status in (301, 308) else self.config.redirect_ttl // 4
+            return self._remember(url, urljoin(url, location), "redirect", ttl)
+        return self._remember(url, None, "final", self.config.redirect_ttl)
+
+    def _remember(self, url: str, location: Optional[str], outcome: str, ttl: float) -> Tuple[Optional[str], str]:
+        entry = (location, outcome)
+        self._redirects.set(url, entry, time.time() + ttl)
+        return entry
+
+    async def resolve(self, host: str) -> DnsResult:
+        cached = self._dns.get(host)
+        if cached is not None:
+            metrics.ENRICHMENT_LOOKUPS.labels("dns", "hit").inc()
+            return cached
+        metrics.ENRICHMENT_LOOKUPS.labels("dns", "miss").inc()
+        return await self._single_flight("dns", host, self._resolve, host)
+
+    async def _resolve(self, host: str) -> DnsResult:
+        answers = await asyncio.gather(
+            self.resolver.resolve(host, "A"),
+            self.resolver.resolve(host, "AAAA"),
+            return_exceptions=True,
+        )
+        result = DnsResult()
+        ttl = self.config.dns_max_ttl
+        for answer in answers:
+            if isinstance(answer, dns.resolver.Answer):
+                result.addresses.extend(record.address for record in answer)
+                ttl = min(ttl, answer.rrset.ttl)
+        if not result.addresses:
+            errors = [answer for answer in answers if isinstance(answer, Exception)]
+            if any(isinstance(error, dns.resolver.NXDOMAIN) for error in errors):
+                result.status = "nxdomain"
+            elif all(isinstance(error, dns.resolver.NoAnswer) for error in errors):
+                result.status = "no_answer"
+            else:
+                result.status = "error"
+                metrics.ENRICHMENT_LOOKUPS.labels("dns", "error").inc()
+            ttl = ERROR_TTL if result.status == "error" else NEGATIVE_TTL
+        ttl = max(self.config.dns_min_ttl, ttl) if result.addresses else ttl
+        self._dns.set(host, result, time.time() + ttl)
+        return result
+
+    async def _single_flight(self, kind: str, key: str, func, *args):
+        """Concurrent lookups of the same key share one request
+
+        The shared lookup is cancelled once every caller waiting on it has given
+        up (time budget spent), so abandoned hops do not keep holding host slots.
+        """
+        entry = self._inflight.get((kind, key))
+        if entry is None:
+            entry = [asyncio.ensure_future(func(*args)), 0]
+            self._inflight[(kind, key)] = entry
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                if self._inflight.get((kind, key)) is entry:
+                    del self._inflight[(kind, key)]
+                entry[0].cancel()
+
+
+def _is_public(address: str) -> bool:
+    """Globally routable (not private, loopback, link-local or reserved)"""
+    return ipaddress.ip_address(address).is_global
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,365 @@
+"""
+PocketShield Evidence Store
+Content-addressed storage for incident evidence (screenshots, message dumps, etc.)
+
+A blob row is touched (last_referenced_at) before its content is committed, and
+only blobs that no incident references and nobody has touched for the grace
+period are collected, so an upload racing the collector keeps its blob.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Evidence values whose JSON encoding is larger than this are moved out of the row
+INLINE_EVIDENCE_LIMIT = 4096
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_EVIDENCE_BYTES = 25 * 1024 * 1024
+# Unreferenced blobs younger than this may belong to an upload still in flight
+DEFAULT_GC_GRACE = 24 * 3600
+DEFAULT_GC_INTERVAL = 3600.0
+DEFAULT_GC_BATCH = 500
+
+# Marker key used inside incident_reports.evidence for offloaded values
+EVIDENCE_REF_KEY = "$evidence"
+
+
+class EvidenceTooLarge(ValueError):
+    """Raised when an upload exceeds the configured evidence size limit"""
+
+
+class BlobWriter(ABC):
+    """Incremental writer for a single blob upload"""
+
+    @abstractmethod
+    async def write(self, chunk: bytes):
+        ...
+
+    @abstractmethod
+    async def commit(self, digest: str) -> bool:
+        """Persist the blob under its digest; return False if it already existed"""
+
+    @abstractmethod
+    async def abort(self):
+        ...
+
+
+class BlobBackend(ABC):
+    """Pluggable blob storage backend keyed by SHA-256 digest"""
+
+    name = "abstract"
+
+    @abstractmethod
+    async def open_writer(self) -> BlobWriter:
+        ...
+
+    @abstractmethod
+    def read(self, digest: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        ...
+
+    @abstractmethod
+    async def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete(self, digest: str):
+        ...
+
+
+class _LocalBlobWriter(BlobWriter):
+    def __init__(self, backend: "LocalBlobBackend"):
+        self.backend = backend
+        self.tmp_path = os.path.join(backend.tmp_dir, uuid.uuid4().hex)
+        self._file = open(self.tmp_path, "wb")
+
+    async def write(self, chunk: bytes):
+        await asyncio.to_thread(self._file.write, chunk)
+
+    async def commit(self, digest: str) -> bool:
+        await asyncio.to_thread(self._file.close)
+        final_path = self.backend._path_for(digest)
+        if os.path.exists(final_path):
+            # Identical content already stored - drop the duplicate
+            os.unlink(self.tmp_path)
+            return False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(self.tmp_path, final_path)
+        return True
+
+    async def abort(self):
+        try:
+            self._file.close()
+            os.unlink(self.tmp_path)
+        except OSError as e:
+            logger.warning(f"Failed to discard partial evidence upload: {e}")
+
+
+class LocalBlobBackend(BlobBackend):
+    """Filesystem backend storing blobs as <root>/<aa>/<bb>/<sha256>"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def _path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    async def open_writer(self) -> BlobWriter:
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return _LocalBlobWriter(self)
+
+    async def read(self, digest: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        with open(self._path_for(digest), "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path_for(digest))
+
+    async def delete(self, digest: str):
+        try:
+            os.unlink(self._path_for(digest))
+        except FileNotFoundError:
+            pass
+
+
+class EvidenceStore:
+    """Streams evidence into a blob backend and tracks metadata in Postgres"""
+
+    def __init__(
+        self,
+        db_manager,
+        backend: BlobBackend,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_blob_size: int = MAX_EVIDENCE_BYTES,
+        gc_grace: int = DEFAULT_GC_GRACE,
+        gc_interval: float = DEFAULT_GC_INTERVAL,
+        gc_batch: int = DEFAULT_GC_BATCH,
+    ):
+        self.db = db_manager
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.max_blob_size = max_blob_size
+        self.gc_grace = gc_grace
+        self.gc_interval = gc_interval
+        self.gc_batch = gc_batch
+        self._gc_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.gc_interval > 0:
+            self._gc_task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self):
+        if self._gc_task:
+            self._gc_task.cancel()
+
+    async def put_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str = "application/octet-stream",
+    ) -> Dict[str, Any]:
+        """Store a chunked upload; memory use is bounded by the chunk size"""
+        hasher = hashlib.sha256()
+        size = 0
+        writer = await self.backend.open_writer()
+
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > self.max_blob_size:
+                    raise EvidenceTooLarge(f"Evidence exceeds {self.max_blob_size} bytes")
+                hasher.update(chunk)
+                await writer.write(chunk)
+        except BaseException:
+            await writer.abort()
+            raise
+
+        digest = hasher.hexdigest()
+
+        # Touch the row first: the collector skips recently referenced blobs
+        query = """
+        INSERT INTO evidence_blobs (sha256, size_bytes, content_type, storage_backend, created_at)
+        VALUES ($1, $2, $3, $4, NOW())
+        ON CONFLICT (sha256) DO UPDATE SET last_referenced_at = NOW()
+        """
+        try:
+            await self.db.execute(query, digest, size, content_type, self.backend.name)
+        except BaseException:
+            await writer.abort()
+            raise
+        created = await writer.commit(digest)
+
+        if not created:
+            logger.info(f"Deduplicated evidence blob {digest} ({size} bytes)")
+
+        return {"sha256": digest, "size": size, "content_type": content_type}
+
+    async def put_bytes(self, data: bytes, content_type: str = "application/octet-stream") -> Dict[str, Any]:
+        """Store an in-memory value, fed to the backend in chunk-sized slices"""
+        async def _chunks():
+            view = memoryview(data)
+            for offset in range(0, len(view), self.chunk_size):
+                yield bytes(view[offset:offset + self.chunk_size])
+
+        return await self.put_stream(_chunks(), content_type)
+
+    def open_stream(self, digest: str) -> AsyncIterator[bytes]:
+        """Stream a stored blob back in chunk-sized pieces"""
+        return self.backend.read(digest, self.chunk_size)
+
+    def offload_evidence(
+        self, evidence: Optional[Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Replace large evidence values with content-addressed references
+
+        Nothing is stored yet: returns the compact evidence dict for the row and
+        the pending blobs, to hand to store_offloaded once the incident exists.
+        """
+        compact = {}
+        pending = []
+        for key, value in (evidence or {}).items():
+            encoded = json.dumps(value).encode()
+            if len(encoded) <= INLINE_EVIDENCE_LIMIT:
+                compact[key] = value
+                continue
+            if len(encoded) > self.max_blob_size:
+                raise EvidenceTooLarge(f"Evidence exceeds {self.max_blob_size} bytes")
+            ref = {
+                "sha256": hashlib.sha256(encoded).hexdigest(),
+                "size": len(encoded),
+                "content_type": "application/json",
+            }
+            compact[key] = {EVIDENCE_REF_KEY: ref}
+            pending.append({**ref, "name": key, "data": encoded})
+        return compact, pending
+
+    async def store_offloaded(self, incident_id: str, device_id: str, pending: List[Dict[str, Any]]):
+        """Store the blobs from offload_evidence and link them to the inserted incident"""
+        for blob in pending:
+            ref = await self.put_bytes(blob["data"], blob["content_type"])
+            await self.attach_to_incident(incident_id, device_id, ref, name=blob["name"])
+
+    async def owns_incident(self, incident_id: str, device_id: str) -> bool:
+        """Whether the incident exists and was reported by the device"""
+        query = """
+        SELECT 1 FROM incident_reports ir
+        JOIN devices d ON d.id = ir.device_id
+        WHERE ir.id = $1 AND d.device_id = $2
+        """
+        return await self.db.execute_one(query, incident_id, device_id) is not None
+
+    async def attach_to_incident(
+        self,
+        incident_id: str,
+        device_id: str,
+        ref: Dict[str, Any],
+        name: Optional[str] = None,
+    ) -> bool:
+        """Link a stored blob to an incident owned by the device"""
+        query = """
+        INSERT INTO incident_evidence (incident_id, sha256, name, content_type, size_bytes, created_at)
+        SELECT ir.id, $3, $4, $5, $6, NOW()
+        FROM incident_reports ir
+        JOIN devices d ON d.id = ir.device_id
+        WHERE ir.id = $1 AND d.device_id = $2
+        ON CONFLICT (incident_id, sha256) DO NOTHING
+        RETURNING incident_id
+        """
+        rows = await self.db.execute_query(
+            query,
+            incident_id,
+            device_id,
+            ref["sha256"],
+            name,
+            ref["content_type"],
+            ref["size"],
+        )
+        return bool(rows)
+
+    async def get_for_device(self, digest: str, device_id: str) -> Optional[Dict[str, Any]]:
+        """Return blob metadata if the device reported an incident referencing it"""
+        query = """
+        SELECT eb.sha256, eb.size_bytes, eb.content_type
+        FROM evidence_blobs eb
+        WHERE eb.sha256 = $1
+        AND EXISTS (
+            SELECT 1 FROM incident_evidence ie
+            JOIN incident_reports ir ON ir.id = ie.incident_id
+            JOIN devices d ON d.id = ir.device_id
+            WHERE ie.sha256 = eb.sha256 AND d.device_id = $2
+        )
+        """
+        row = await self.db.execute_one(query, digest, device_id)
+        if not row:
+            return None
+        return {
+            "sha256": row["sha256"],
+            "size": row["size_bytes"],
+            "content_type": row["content_type"],
+        }
+
+
+    async def _gc_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.gc_interval)
+                await self.collect_garbage()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Evidence garbage collection failed: {e}")
+
+    async def collect_garbage(self) -> int:
+        """Delete blobs no incident references once they are past the grace period
+
+        Rows go first, one batch per statement; the content follows only for the
+        rows this pass actually deleted.
+        """
+        query = """
+        DELETE FROM evidence_blobs
+        WHERE sha256 IN (
+            SELECT eb.sha256 FROM evidence_blobs eb
+            WHERE eb.last_referenced_at < NOW() - make_interval(secs => $1)
+            AND NOT EXISTS (SELECT 1 FROM incident_evidence ie WHERE ie.sha256 = eb.sha256)
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+        AND last_referenced_at < NOW() - make_interval(secs => $1)
+        RETURNING sha256
+        """
+        collected = 0
+        while True:
+            rows = await self.db.execute_query(query, self.gc_grace, self.gc_batch)
+            for row in rows:
+                await self.backend.delete(row["sha256"])
+            collected += len(rows)
+            if len(rows) < self.gc_batch:
+                break
+        if collected:
+            logger.info(f"Collected {collected} unreferenced evidence blobs")
+        return collected
+
+
+def create_evidence_store(db_manager) -> EvidenceStore:
+    """Build the evidence store from environment configuration"""
+    root = os.getenv("EVIDENCE_STORAGE_PATH", "/app/data/evidence")
+    return EvidenceStore(
+        db_manager,
+        LocalBlobBackend(root),
+        gc_grace=int(os.getenv("EVIDENCE_GC_GRACE", str(DEFAULT_GC_GRACE))),
+        gc_interval=float(os.getenv("EVIDENCE_GC_INTERVAL", str(DEFAULT_GC_INTERVAL))),
+    )
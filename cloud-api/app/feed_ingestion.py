@@ -0,0 +1,706 @@
+"""
+PocketShield Feed Ingestion
+Streams external threat feeds (CSV, JSON/JSON Lines, STIX 2 bundles) into
+threats + threat_indicators using COPY into staging tables
+
+Run outside the API workers:
+    python -m app.feed_ingestion ingest --source openphish feed.csv [--format csv] [--snapshot]
+    python -m app.feed_ingestion sync            # queued threats, then every due threat_sources row of type 'feed'
+    python -m app.feed_ingestion backfill        # index threats queued by other writers (threat_index_queue)
+    python -m app.feed_ingestion publish         # hash-prefix snapshot only (the others publish too)
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from app.hash_prefix import PrefixPublisher
+from app.indicators import (
+    APP_PACKAGE, DOMAIN, FILE_HASH, INDICATOR_KINDS, IP, JSON_KEYS, URL,
+    canonicalize, hash_canonical, infer_kind,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TYPE = "suspicious"
+DEFAULT_RISK_SCORE = 70
+DEFAULT_CONFIDENCE = 0.8
+DEFAULT_TTL = 86400
+
+# STIX indicator_types -> threats.type
+STIX_TYPES = {
+    "phishing": "phishing",
+    "malicious-activity": "malware",
+    "compromised": "malware",
+    "anomalous-activity": "suspicious",
+    "attribution": "suspicious",
+    "unknown": "suspicious",
+}
+
+# STIX cyber-observable paths -> indicator kinds
+STIX_OBSERVABLES = {
+    "domain-name:value": DOMAIN,
+    "url:value": URL,
+    "ipv4-addr:value": IP,
+    "ipv6-addr:value": IP,
+    "software:x_package_name": APP_PACKAGE,
+}
+_STIX_COMPARISON = re.compile(r"([\w-]+:[\w.'-]+)\s*=\s*'((?:[^'\\]|\\.)*)'")
+
+
+@dataclass
+class FeedRecord:
+    """One threat from a feed with the indicators it covers"""
+    external_id: str
+    indicators: List[Tuple[str, str]]  # (kind, canonical value)
+    type: str = DEFAULT_TYPE
+    risk_score: int = DEFAULT_RISK_SCORE
+    confidence: float = DEFAULT_CONFIDENCE
+    tags: List[str] = field(default_factory=list)
+    description: Optional[str] = None
+    modified: Optional[datetime] = None
+    ttl: Optional[int] = None
+
+
+@dataclass
+class IngestStats:
+    records: int = 0
+    skipped_unchanged: int = 0
+    invalid: int = 0
+    threats: int = 0
+    indicators: int = 0
+    expired: int = 0
+    seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+# Parsing helpers
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    """ISO-8601 -> naive UTC (the schema uses TIMESTAMP without time zone)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _indicator(kind: Optional[str], value: str) -> Optional[Tuple[str, str]]:
+    kind = kind or infer_kind(value)
+    if kind not in INDICATOR_KINDS:
+        return None
+    canonical = canonicalize(kind, value)
+    return (kind, canonical) if canonical is not None else None
+
+
+def _derived_id(indicators: List[Tuple[str, str]]) -> str:
+    """Stable id for feeds without record ids: one threat per indicator set"""
+    digest = hashlib.sha256("\n".join(f"{k}:{v}" for k, v in sorted(indicators)).encode())
+    return digest.hexdigest()[:32]
+
+
+def _split_tags(value: Any) -> List[str]:
+    if isinstance(value, list):
+        return [str(tag) for tag in value]
+    return [tag.strip() for tag in re.split(r"[|;,]", value or "") if tag.strip()]
+
+
+def _record_from_mapping(row: Dict[str, Any], defaults: Dict[str, Any]) -> Optional[FeedRecord]:
+    """Shared by CSV and JSON feeds: one row/object with value/kind or per-kind lists"""
+    indicators = []
+    value = row.get("value") or row.get("indicator")
+    if value:
+        indicator = _indicator(row.get("kind") or defaults.get("default_kind"), str(value))
+        if indicator:
+            indicators.append(indicator)
+    for kind, key in JSON_KEYS.items():
+        items = row.get(key) or []
+        if isinstance(items, str):
+            items = _split_tags(items)  # CSV column with several values
+        for item in items:
+            indicator = _indicator(kind, str(item))
+            if indicator:
+                indicators.append(indicator)
+    if not indicators:
+        return None
+
+    try:
+        risk_score = int(row.get("risk_score") or defaults.get("default_risk_score", DEFAULT_RISK_SCORE))
+        confidence = float(row.get("confidence") or defaults.get("default_confidence", DEFAULT_CONFIDENCE))
+    except (TypeError, ValueError):
+        return None  # counted as invalid
+    modified = _parse_time(row.get("modified") or row.get("last_seen"))
+    valid_until = _parse_time(row.get("valid_until") or row.get("expires_at"))
+    return FeedRecord(
+        external_id=str(row.get("id") or _derived_id(indicators)),
+        indicators=indicators,
+        type=row.get("type") or defaults.get("default_type", DEFAULT_TYPE),
+        risk_score=risk_score,
+        confidence=confidence,
+        tags=_split_tags(row.get("tags")),
+        description=row.get("description"),
+        modified=modified,
+        ttl=int((valid_until - datetime.utcnow()).total_seconds()) if valid_until else None,
+    )
+
+
+def iter_json_array(f: io.TextIOBase, key: Optional[str] = None, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Yield elements of a top-level JSON array (or of ``key``'s array) without loading the file"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    pos = 0
+
+    def fill() -> bool:
+        nonlocal buffer, pos
+        more = f.read(chunk_size)
+        if not more:
+            return False
+        buffer = buffer[pos:] + more
+        pos = 0
+        return True
+
+    # Seek to the opening bracket of the array
+    marker = f'"{key}"' if key else None
+    while True:
+        start = buffer.find(marker, pos) if marker else buffer.find("[", pos)
+        if start >= 0:
+            bracket = buffer.find("[", start)
+            if bracket >= 0:
+                pos = bracket + 1
+                break
+        if not fill():
+            return
+
+    while True:
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or not fill():
+                break
+        if pos >= len(buffer) or buffer[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if not fill():
+                raise
+            continue
+        pos = end
+        yield element
+
+
+def iter_csv(f: io.TextIOBase, defaults: Dict[str, Any]) -> Iterator[Optional[FeedRecord]]:
+    """Header row required; recognised columns: value|indicator, kind, id, type,
+    risk_score, confidence, tags (| ; or , separated), description, modified, valid_until"""
+    for row in csv.DictReader(f):
+        yield _record_from_mapping(row, defaults)
+
+
+def iter_json(f: io.TextIOBase, defaults: Dict[str, Any]) -> Iterator[Optional[FeedRecord]]:
+    """JSON Lines, or a single top-level array of objects"""
+    first = f.read(1)
+    while first and first.isspace():
+        first = f.read(1)
+    if first == "[":
+        objects = iter_json_array(_prefixed(f, first))
+    else:
+        objects = (json.loads(line) for line in _prefixed(f, first) if line.strip())
+    for obj in objects:
+        yield _record_from_mapping(obj, defaults)
+
+
+def iter_stix(f: io.TextIOBase, defaults: Dict[str, Any]) -> Iterator[Optional[FeedRecord]]:
+    """STIX 2.x bundle: indicator objects with equality patterns on known observables"""
+    for obj in iter_json_array(f, key="objects"):
+        if obj.get("type") != "indicator" or obj.get("revoked"):
+            continue
+        indicators = []
+        for path, value in _STIX_COMPARISON.findall(obj.get("pattern", "")):
+            path = path.replace("'", "")
+            kind = FILE_HASH if path.startswith("file:hashes") else STIX_OBSERVABLES.get(path)
+            indicator = _indicator(kind, value.replace("\\'", "'")) if kind else None
+            if indicator:
+                indicators.append(indicator)
+        if not indicators:
+            yield None
+            continue
+
+        stix_types = obj.get("indicator_types") or obj.get("labels") or []
+        threat_type = next((STIX_TYPES[t] for t in stix_types if t in STIX_TYPES), defaults.get("default_type", DEFAULT_TYPE))
+        try:
+            confidence = obj.get("confidence")
+            confidence = float(confidence) / 100 if confidence is not None else defaults.get("default_confidence", DEFAULT_CONFIDENCE)
+            risk_score = int(obj.get("x_risk_score") or round(confidence * 100))
+        except (TypeError, ValueError):
+            yield None  # counted as invalid
+            continue
+        valid_until = _parse_time(obj.get("valid_until"))
+        yield FeedRecord(
+            external_id=obj.get("id") or _derived_id(indicators),
+            indicators=indicators,
+            type=threat_type,
+            risk_score=risk_score,
+            confidence=confidence,
+            tags=[str(label) for label in obj.get("labels", [])],
+            description=obj.get("description") or obj.get("name"),
+            modified=_parse_time(obj.get("modified") or obj.get("created")),
+            ttl=int((valid_until - datetime.utcnow()).total_seconds()) if valid_until else None,
+        )
+
+
+class _prefixed(io.TextIOBase):
+    """Text stream with already-consumed characters pushed back in front"""
+
+    def __init__(self, f: io.TextIOBase, prefix: str):
+        self.f = f
+        self.prefix = prefix
+
+    def read(self, size: int = -1) -> str:
+        prefix, self.prefix = self.prefix, ""
+        if size is None or size < 0:
+            return prefix + self.f.read()
+        return prefix + self.f.read(max(0, size - len(prefix)))
+
+    def __iter__(self):
+        prefix, self.prefix = self.prefix, ""
+        first = prefix + self.f.readline()
+        if first:
+            yield first
+        yield from self.f
+
+
+PARSERS = {"csv": iter_csv, "json": iter_json, "jsonl": iter_json, "stix": iter_stix}
+
+
+def detect_format(path: str) -> str:
+    lower = path.lower()
+    if "stix" in lower:
+        return "stix"
+    if lower.endswith(".csv") or lower.endswith(".txt"):
+        return "csv"
+    return "json"
+
+
+# Loading
+
+CREATE_STAGING_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS staging_threats (
+    external_id TEXT,
+    type TEXT,
+    indicators JSONB,
+    risk_score INTEGER,
+    confidence REAL,
+    tags TEXT[],
+    description TEXT,
+    ttl INTEGER
+) ON COMMIT DELETE ROWS;
+CREATE TEMP TABLE IF NOT EXISTS staging_indicators (
+    external_id TEXT,
+    kind TEXT,
+    value_hash BYTEA,
+    value TEXT
+) ON COMMIT DELETE ROWS;
+"""
+
+UPSERT_THREATS_SQL = """
+INSERT INTO threats (
+    source_id, source_name, external_id, type, indicators, risk_score, confidence,
+    tags, description, first_seen, last_seen, ttl, status
+)
+SELECT $1, $2, external_id, type, indicators, risk_score, confidence::decimal(3,2),
+       tags, description, NOW(), NOW(), ttl, 'active'
+FROM staging_threats
+ON CONFLICT (source_id, external_id) DO UPDATE SET
+    type = EXCLUDED.type,
+    -- Already loaded by an earlier chunk of this run ($3 = run start): union of the indicator lists
+    indicators = CASE WHEN threats.last_seen < $3 THEN EXCLUDED.indicators ELSE (
+        SELECT jsonb_object_agg(key, merged) FROM (
+            SELECT key, jsonb_agg(DISTINCT value) AS merged
+            FROM (
+                SELECT * FROM jsonb_each(threats.indicators)
+                UNION ALL
+                SELECT * FROM jsonb_each(EXCLUDED.indicators)
+            ) AS lists (key, list), jsonb_array_elements(list) AS value
+            GROUP BY key
+        ) AS grouped
+    ) END,
+    risk_score = EXCLUDED.risk_score,
+    confidence = EXCLUDED.confidence,
+    tags = EXCLUDED.tags,
+    description = EXCLUDED.description,
+    last_seen = NOW(),
+    -- ttl counts from first_seen; extend it so the refreshed threat lives ttl from now
+    ttl = CASE WHEN EXCLUDED.ttl = 0 THEN 0
+               ELSE EXTRACT(EPOCH FROM NOW() - threats.first_seen)::int + EXCLUDED.ttl END,
+    -- Analyst verdicts survive feed refreshes
+    status = CASE WHEN threats.status IN ('false_positive', 'under_review') THEN threats.status
+                  ELSE 'active' END
+"""
+
+# Indicators dropped from a threat that the feed just re-sent. Runs before the
+# upsert, and skips threats an earlier chunk of this run ($2 = run start)
+# already loaded: a threat repeated across chunks keeps the union.
+DELETE_STALE_INDICATORS_SQL = """
+DELETE FROM threat_indicators i
+USING threats t, staging_threats st
+WHERE t.source_id = $1
+AND t.external_id = st.external_id
+AND t.last_seen < $2
+AND i.threat_id = t.id
+AND NOT EXISTS (
+    SELECT 1 FROM staging_indicators s
+    WHERE s.external_id = st.external_id AND s.kind = i.kind AND s.value_hash = i.value_hash
+)
+"""
+
+INSERT_INDICATORS_SQL = """
+INSERT INTO threat_indicators (kind, value_hash, value, threat_id)
+SELECT s.kind, s.value_hash, s.value, t.id
+FROM staging_indicators s
+JOIN threats t ON t.source_id = $1 AND t.external_id = s.external_id
+ON CONFLICT (kind, value_hash, threat_id) DO NOTHING
+"""
+
+EXPIRE_MISSING_SQL = """
+UPDATE threats SET status = 'expired'
+WHERE source_id = $1 AND status = 'active' AND last_seen < $2
+"""
+
+# Threats queued by threat_index_queue triggers (written outside feed ingestion), one page
+CLAIM_QUEUED_SQL = """
+SELECT q.threat_id, t.indicators
+FROM threat_index_queue q
+JOIN threats t ON t.id = q.threat_id
+WHERE q.threat_id > $1
+ORDER BY q.threat_id
+LIMIT $2
+FOR UPDATE OF q SKIP LOCKED
+"""
+
+DELETE_UNLISTED_INDICATORS_SQL = """
+DELETE FROM threat_indicators i
+WHERE i.threat_id = ANY($1::uuid[])
+AND NOT EXISTS (
+    SELECT 1 FROM unnest($2::uuid[], $3::text[], $4::bytea[]) AS listed (threat_id, kind, value_hash)
+    WHERE listed.threat_id = i.threat_id AND listed.kind = i.kind AND listed.value_hash = i.value_hash
+)
+"""
+
+INSERT_LISTED_INDICATORS_SQL = """
+INSERT INTO threat_indicators (threat_id, kind, value_hash, value)
+SELECT * FROM unnest($1::uuid[], $2::text[], $3::bytea[], $4::text[])
+ON CONFLICT (kind, value_hash, threat_id) DO NOTHING
+"""
+
+THREAT_COLUMNS = ["external_id", "type", "indicators", "risk_score", "confidence", "tags", "description", "ttl"]
+INDICATOR_COLUMNS = ["external_id", "kind", "value_hash", "value"]
+
+# Bulk loads leave most pages not all-visible; vacuum so lookups stay index-only
+VACUUM_THRESHOLD = 10000
+
+
+class FeedIngestor:
+    """Deduplicates feed records and bulk-loads them chunk by chunk"""
+
+    def __init__(self, db_manager, batch_size: int = 50000):
+        self.db = db_manager
+        self.batch_size = batch_size
+
+    async def get_source(self, name: str) -> Dict[str, Any]:
+        row = await self.db.execute_one(
+            """
+            INSERT INTO threat_sources (name, type) VALUES ($1, 'feed')
+            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id, name, endpoint, watermark, configuration
+            """,
+            name,
+        )
+        source = dict(row)
+        config = source.get("configuration") or {}
+        source["configuration"] = json.loads(config) if isinstance(config, str) else config
+        return source
+
+    def _prepare_chunk(
+        self, records: List[Optional[FeedRecord]], watermark: Optional[datetime], default_ttl: int, stats: IngestStats
+    ) -> Tuple[List[tuple], List[tuple], Optional[datetime]]:
+        """Dedupe a chunk into staging rows; returns (threat_rows, indicator_rows, max_modified)"""
+        threats: Dict[str, FeedRecord] = {}
+        max_modified = None
+        for record in records:
+            stats.records += 1
+            if record is None:
+                stats.invalid += 1
+                continue
+            if record.modified:
+                if watermark and record.modified <= watermark:
+                    stats.skipped_unchanged += 1
+                    continue
+                if max_modified is None or record.modified > max_modified:
+                    max_modified = record.modified
+            existing = threats.get(record.external_id)
+            if existing is not None:
+                # Same threat repeated in the feed: union of indicators, later attributes win
+                # (across chunks the load SQL does the same)
+                record.indicators = existing.indicators + record.indicators
+            threats[record.external_id] = record
+
+        threat_rows, indicator_rows = [], []
+        for external_id, record in threats.items():
+            unique = dict.fromkeys(record.indicators)
+            grouped: Dict[str, List[str]] = {}
+            for kind, value in unique:
+                grouped.setdefault(JSON_KEYS[kind], []).append(value)
+                indicator_rows.append((external_id, kind, hash_canonical(value), value))
+            ttl = record.ttl if record.ttl is not None else default_ttl
+            threat_rows.append((
+                external_id, record.type, json.dumps(grouped), max(0, min(100, record.risk_score)),
+                max(0.0, min(1.0, record.confidence)), record.tags, record.description, max(ttl, 0),
+            ))
+        return threat_rows, indicator_rows, max_modified
+
+    async def _load_chunk(
+        self, source: Dict[str, Any], threat_rows: List[tuple], indicator_rows: List[tuple], sync_started_at: datetime
+    ):
+        async with self.db.acquire() as connection:
+            async with connection.transaction():
+                # This load writes threat_indicators itself: keep its threats out of threat_index_queue
+                await connection.execute("SET LOCAL pocketshield.indexed_writer = 'on'")
+                await connection.execute(CREATE_STAGING_SQL)
+                await connection.copy_records_to_table("staging_threats", records=threat_rows, columns=THREAT_COLUMNS)
+                await connection.copy_records_to_table(
+                    "staging_indicators", records=indicator_rows, columns=INDICATOR_COLUMNS
+                )
+                await connection.execute(DELETE_STALE_INDICATORS_SQL, source["id"], sync_started_at)
+                await connection.execute(UPSERT_THREATS_SQL, source["id"], source["name"], sync_started_at)
+                status = await connection.execute(INSERT_INDICATORS_SQL, source["id"])
+        return int(status.split()[-1])
+
+    async def ingest_file(
+        self,
+        source_name: str,
+        path: str,
+        fmt: Optional[str] = None,
+        full_snapshot: bool = False,
+    ) -> IngestStats:
+        """Stream ``path`` into the database for ``source_name``
+
+        Incremental feeds skip records not modified since the source's
+        watermark. ``full_snapshot`` feeds list every live threat, so active
+        threats of the source missing from the file are expired afterwards.
+        """
+        source = await self.get_source(source_name)
+        config = source["configuration"]
+        fmt = fmt or config.get("format") or detect_format(path)
+        default_ttl = int(config.get("default_ttl", DEFAULT_TTL))
+        watermark = None if full_snapshot else source["watermark"]
+        stats = IngestStats()
+        started = time.perf_counter()
+        # Database clock: upserts stamp last_seen with NOW()
+        sync_started_at = (await self.db.execute_one("SELECT LOCALTIMESTAMP AS now"))["now"]
+        max_modified = watermark
+
+        with open(path, newline="", encoding="utf-8") as f:
+            records = PARSERS[fmt](f, config)
+
+            def take() -> List[Optional[FeedRecord]]:
+                return list(islice(records, self.batch_size))
+
+            # Parse the next chunk in a thread while the current one is loading
+            next_chunk = asyncio.create_task(asyncio.to_thread(take))
+            while True:
+                chunk = await next_chunk
+                if not chunk:
+                    break
+                next_chunk = asyncio.create_task(asyncio.to_thread(take))
+                threat_rows, indicator_rows, chunk_max = self._prepare_chunk(chunk, watermark, default_ttl, stats)
+                if chunk_max and (max_modified is None or chunk_max > max_modified):
+                    max_modified = chunk_max
+                if threat_rows:
+                    stats.indicators += await self._load_chunk(source, threat_rows, indicator_rows, sync_started_at)
+                    stats.threats += len(threat_rows)
+
+        if full_snapshot:
+            status = await self.db.execute(EXPIRE_MISSING_SQL, source["id"], sync_started_at)
+            stats.expired = int(status.split()[-1])
+
+        stats.seconds = round(time.perf_counter() - started, 3)
+        await self.db.execute(
+            """
+            UPDATE threat_sources
+            SET watermark = $2, last_sync = NOW(), last_sync_stats = $3, status = 'active'
+            WHERE id = $1
+            """,
+            source["id"], max_modified, json.dumps(stats.to_dict()),
+        )
+        if stats.indicators >= VACUUM_THRESHOLD:
+            await self.db.execute("VACUUM (ANALYZE) threat_indicators")
+
+        logger.info(
+            f"Ingested {source_name}: {stats.records} records, {stats.threats} threats, "
+            f"{stats.indicators} new indicators in {stats.seconds:.1f}s"
+        )
+        return stats
+
+    async def sync_due_sources(self) -> Dict[str, Dict[str, Any]]:
+        """Fetch and ingest every feed source whose sync_frequency has elapsed"""
+        rows = await self.db.execute_query(
+            """
+            SELECT name, endpoint, configuration FROM threat_sources
+            WHERE type = 'feed' AND status != 'inactive' AND endpoint IS NOT NULL
+            AND (last_sync IS NULL OR last_sync + INTERVAL '1 second' * sync_frequency < NOW())
+            """
+        )
+        results = {}
+        for row in rows:
+            config = row["configuration"] or {}
+            config = json.loads(config) if isinstance(config, str) else config
+            try:
+                path = await self._fetch(row["endpoint"])
+                try:
+                    stats = await self.ingest_file(
+                        row["name"], path, config.get("format"), bool(config.get("full_snapshot"))
+                    )
+                finally:
+                    if path != row["endpoint"]:
+                        os.unlink(path)
+                results[row["name"]] = stats.to_dict()
+            except Exception as e:
+                logger.error(f"Feed sync failed for {row['name']}: {e}")
+                await self.db.execute(
+                    "UPDATE threat_sources SET status = 'error', last_sync_stats = $2 WHERE name = $1",
+                    row["name"], json.dumps({"error": str(e)}),
+                )
+                results[row["name"]] = {"error": str(e)}
+        return results
+
+    async def _fetch(self, endpoint: str) -> str:
+        """Download an http(s) feed to a temp file; local paths are used as-is"""
+        if not endpoint.startswith(("http://", "https://")):
+            return endpoint
+        import httpx
+
+        fd, path = tempfile.mkstemp(prefix="feed-")
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=300.0), follow_redirects=True) as client:
+            async with client.stream("GET", endpoint) as response:
+                response.raise_for_status()
+                with os.fdopen(fd, "wb") as out:
+                    async for chunk in response.aiter_bytes(1 << 20):
+                        out.write(chunk)
+        return path
+
+    async def backfill(self, page_size: int = 1000) -> int:
+        """Index threats in threat_index_queue from threats.indicators, a page per transaction"""
+        indexed, after = 0, UUID(int=0)
+        while True:
+            async with self.db.acquire() as connection:
+                async with connection.transaction():
+                    # Locked rows belong to another run; a threat updated meanwhile is queued again
+                    rows = await connection.fetch(CLAIM_QUEUED_SQL, after, page_size)
+                    if not rows:
+                        return indexed
+                    records = list(dict.fromkeys(
+                        (row["threat_id"], kind, hash_canonical(canonical), canonical)
+                        for row in rows
+                        for kind, canonical in _listed_indicators(row["indicators"])
+                    ))
+                    columns = [list(column) for column in zip(*records)] or [[], [], [], []]
+                    threat_ids = [row["threat_id"] for row in rows]
+                    await connection.execute(DELETE_UNLISTED_INDICATORS_SQL, threat_ids, *columns[:3])
+                    await connection.execute(INSERT_LISTED_INDICATORS_SQL, *columns)
+                    await connection.execute(
+                        "DELETE FROM threat_index_queue WHERE threat_id = ANY($1::uuid[])", threat_ids
+                    )
+            indexed += len(rows)
+            after = rows[-1]["threat_id"]
+
+
+def _listed_indicators(indicators) -> Iterator[Tuple[str, str]]:
+    """(kind, canonical value) of every valid indicator in a threats.indicators document"""
+    indicators = json.loads(indicators) if isinstance(indicators, str) else indicators or {}
+    for kind, key in JSON_KEYS.items():
+        for value in indicators.get(key) or []:
+            canonical = canonicalize(kind, str(value))
+            if canonical is not None:
+                yield kind, canonical
+
+
+async def _main(args):
+    from app.database import DatabaseConfig, DatabaseManager
+
+    # Bulk statements and VACUUM outlast the API's statement timeout
+    config = DatabaseConfig.from_env()
+    config.min_size, config.max_size = 1, 2
+    config.statement_timeout = float(os.getenv("FEED_STATEMENT_TIMEOUT", "600"))
+    db = DatabaseManager(config)
+    await db.connect()
+    try:
+        ingestor = FeedIngestor(db, batch_size=args.batch_size)
+        publisher = PrefixPublisher(db)
+        if args.command == "ingest":
+            stats = await ingestor.ingest_file(args.source, args.path, args.format, args.snapshot)
+            print(json.dumps(stats.to_dict()))
+        elif args.command == "sync":
+            while True:
+                # Threats written by other tools match only once indexed
+                indexed = await ingestor.backfill()
+                if indexed:
+                    logger.info(f"Indexed {indexed} queued threats")
+                print(json.dumps(await ingestor.sync_due_sources(), default=str))
+                # Also runs when no feed was due: TTL expiry changes the active set too
+                await publisher.publish()
+                if not args.loop:
+                    break
+                await asyncio.sleep(args.interval)
+        elif args.command == "backfill":
+            print(f"Indexed {await ingestor.backfill()} threats")
+        if args.command in ("ingest", "backfill", "publish"):
+            version = await publisher.publish()
+            print(f"Prefix snapshot {'v' + str(version) if version else 'unchanged'}")
+    finally:
+        await db.disconnect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PocketShield threat feed ingestion")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Load one feed file")
+    ingest.add_argument("--source", required=True, help="threat_sources.name (created if missing)")
+    ingest.add_argument("--format", choices=sorted(PARSERS))
+    ingest.add_argument("--snapshot", action="store_true", help="File lists every live threat of the source")
+    ingest.add_argument("path")
+
+    sync = commands.add_parser("sync", help="Sync due feed sources")
+    sync.add_argument("--loop", action="store_true")
+    sync.add_argument("--interval", type=float, default=60.0)
+
+    commands.add_parser("backfill", help="Index threats queued by writers other than feed ingestion")
+    commands.add_parser("publish", help="Publish a hash-prefix snapshot if the active set changed")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+PocketShield Hash-Prefix Lookups
+Versioned snapshots of 32-bit prefixes of malicious host/URL hashes, with deltas
+
+Devices keep the sorted prefix list locally and hash each URL the way
+app/indicators.py does (the host, its parent domains and the canonical URL).
+Only when one of those prefixes is in the list does the device ask for the full
+hashes behind it, so URLs that miss locally never reach the server and the rest
+are only disclosed as 4-byte prefixes.
+
+Snapshots are published by the feed ingestion job (``PrefixPublisher``) into
+threat_prefix_snapshots; API workers serve the latest one and the delta from
+any retained older version (``PrefixSnapshotService``).
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX_BYTES = 4
+
+# Indicator kinds a URL check can hit (see ThreatIntelligenceService._check_domain_reputation)
+ACTIVE_INDICATORS = """
+FROM threat_indicators i
+JOIN threats t ON t.id = i.threat_id
+WHERE i.kind IN ('domain', 'ip', 'url')
+AND t.status = 'active'
+AND (t.ttl = 0 OR t.first_seen + INTERVAL '1 second' * t.ttl > NOW())
+"""
+
+SNAPSHOT_PREFIXES_QUERY = f"""
+SELECT DISTINCT substring(i.value_hash from 1 for {PREFIX_BYTES}) AS prefix
+{ACTIVE_INDICATORS}
+ORDER BY 1
+"""
+
+LATEST_SNAPSHOT_QUERY = """
+SELECT version, checksum FROM threat_prefix_snapshots ORDER BY version DESC LIMIT 1
+"""
+
+RETAINED_VERSIONS_QUERY = """
+SELECT MIN(version) AS oldest, MAX(version) AS latest FROM threat_prefix_snapshots
+"""
+
+SNAPSHOT_QUERY = """
+SELECT version, prefixes, checksum FROM threat_prefix_snapshots WHERE version = $1
+"""
+
+FULL_HASHES_QUERY = f"""
+SELECT DISTINCT ON (i.value_hash) i.value_hash, i.kind, t.type, t.risk_score
+{ACTIVE_INDICATORS}
+AND substring(i.value_hash from 1 for {PREFIX_BYTES}) = ANY($1::bytea[])
+ORDER BY i.value_hash, t.risk_score DESC
+"""
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def unpack(blob: bytes) -> List[bytes]:
+    return [blob[i:i + PREFIX_BYTES] for i in range(0, len(blob), PREFIX_BYTES)]
+
+
+def checksum(blob: bytes) -> bytes:
+    return hashlib.sha256(blob).digest()
+
+
+def diff(old: bytes, new: bytes) -> Tuple[bytes, bytes]:
+    """(added, removed) prefixes going from ``old`` to ``new``, each sorted and packed"""
+    old_set, new_set = set(unpack(old)), set(unpack(new))
+    return b"".join(sorted(new_set - old_set)), b"".join(sorted(old_set - new_set))
+
+
+def apply_delta(blob: bytes, added: bytes, removed: bytes) -> bytes:
+    """Reference for clients: the sorted list after a delta"""
+    prefixes = set(unpack(blob))
+    prefixes.difference_update(unpack(removed))
+    prefixes.update(unpack(added))
+    return b"".join(sorted(prefixes))
+
+
+class PrefixPublisher:
+    """Writes a new snapshot version when the set of active prefixes changed"""
+
+    def __init__(self, db_manager, retain: int = 48):
+        self.db = db_manager
+        self.retain = retain
+
+    async def publish(self) -> Optional[int]:
+        """Returns the new version, or None if nothing changed"""
+        rows = await self.db.execute_query(SNAPSHOT_PREFIXES_QUERY, timeout=300)
+        blob = b"".join(bytes(row["prefix"]) for row in rows)
+        digest = checksum(blob)
+
+        latest = await self.db.execute_one(LATEST_SNAPSHOT_QUERY)
+        if latest and bytes(latest["checksum"]) == digest:
+            return None
+
+        row = await self.db.execute_one(
+            """
+            INSERT INTO threat_prefix_snapshots (prefix_count, checksum, prefixes)
+            VALUES ($1, $2, $3)
+            RETURNING version
+            """,
+            len(rows), digest, blob,
+        )
+        version = row["version"]
+        # Devices on a pruned version get a full snapshot instead of a delta
+        await self.db.execute(
+            "DELETE FROM threat_prefix_snapshots WHERE version <= $1", version - self.retain
+        )
+        logger.info(f"Published prefix snapshot v{version} ({len(rows)} prefixes)")
+        return version
+
+
+class PrefixSnapshotService:
+    """Serves the latest snapshot and deltas to devices from each API worker
+
+    Response bodies depend only on the device's current version, so each one
+    is built once per published version and shared by every request for it.
+    """
+
+    def __init__(self, db_manager, refresh_interval: float = 60.0, max_lookup_prefixes: int = 64):
+        self.db = db_manager
+        self.refresh_interval = refresh_interval
+        self.max_lookup_prefixes = max_lookup_prefixes
+        self.version: Optional[int] = None
+        self.oldest: Optional[int] = None
+        self.blob = b""
+        self.checksum = b""
+        self._bodies: Dict[Optional[int], asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.db.register("prefix.versions", RETAINED_VERSIONS_QUERY, readonly=True, timeout=2.0)
+        self.db.register("prefix.snapshot", SNAPSHOT_QUERY, readonly=True, timeout=10.0)
+        self.db.register("prefix.full_hashes", FULL_HASHES_QUERY, readonly=True, timeout=2.0)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.refresh_interval)
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Prefix snapshot refresh failed: {e}")
+
+    async def refresh(self):
+        """Load the latest published version if it is newer than the one served"""
+        versions = await self.db.execute_one("prefix.versions")
+        if not versions or versions["latest"] is None:
+            return
+        self.oldest = versions["oldest"]
+        if versions["latest"] == self.version:
+            return
+        row = await self.db.execute_one("prefix.snapshot", versions["latest"])
+        if not row:
+            return  # pruned between the two queries; next refresh picks up the newer one
+        self.blob = bytes(row["prefixes"])
+        self.checksum = bytes(row["checksum"])
+        self.version = row["version"]
+        self._bodies = {}
+        metrics.PREFIX_SNAPSHOT_VERSION.set(self.version)
+        logger.info(f"Serving prefix snapshot v{self.version} ({len(self.blob) // PREFIX_BYTES} prefixes)")
+
+    async def update_body(self, client_version: Optional[int]) -> bytes:
+        """Encoded JSON update for a device currently holding ``client_version``"""
+        if self.version is None:
+            raise SnapshotUnavailable("No prefix snapshot loaded yet")
+        if client_version is not None and not self.oldest <= client_version <= self.version:
+            client_version = None  # pruned, or from another deployment; all share the full body
+        task = self._bodies.get(client_version)
+        if task is None:
+            task = asyncio.create_task(self._build_body(client_version))
+            self._bodies[client_version] = task
+        try:
+            body, update_type = await asyncio.shield(task)
+        except Exception:
+            if self._bodies.get(client_version) is task:
+                del self._bodies[client_version]
+            raise
+        metrics.PREFIX_UPDATES.labels(update_type).inc()
+        return body
+
+    async def _build_body(self, client_version: Optional[int]) -> Tuple[bytes, str]:
+        version, blob = self.version, self.blob
+        response: Dict[str, Any] = {
+            "version": version,
+            "prefix_bytes": PREFIX_BYTES,
+            "prefix_count": len(blob) // PREFIX_BYTES,
+            "checksum": _b64(self.checksum),
+            "minimum_wait_seconds": int(self.refresh_interval),
+        }
+        old = None
+        if client_version is not None and client_version != version:
+            old = await self.db.execute_one("prefix.snapshot", client_version)
+
+        if client_version == version:
+            response["type"] = "none"
+        elif old is not None:
+            added, removed = await asyncio.to_thread(diff, bytes(old["prefixes"]), blob)
+            response.update(type="delta", base_version=client_version, add=_b64(added), remove=_b64(removed))
+        else:
+            response.update(type="full", add=_b64(blob), remove="")
+        return json.dumps(response).encode(), response["type"]
+
+    async def lookup(self, prefixes: List[bytes]) -> List[Dict[str, Any]]:
+        """Full hashes of active threats for each requested prefix"""
+        rows = await self.db.execute_query("prefix.full_hashes", prefixes)
+        matches: Dict[bytes, List[Dict[str, Any]]] = {}
+        for row in rows:
+            full_hash = bytes(row["value_hash"])
+            matches.setdefault(full_hash[:PREFIX_BYTES], []).append({
+                "hash": _b64(full_hash),
+                "kind": row["kind"],
+                "threat_type": row["type"],
+                "risk_score": row["risk_score"],
+            })
+        metrics.PREFIX_LOOKUPS.labels("hit").inc(len(matches))
+        metrics.PREFIX_LOOKUPS.labels("miss").inc(len(set(prefixes)) - len(matches))
+        return [
+            {"prefix": _b64(prefix), "full_hashes": matches.get(prefix, [])}
+            for prefix in dict.fromkeys(prefixes)
+        ]
@@ -0,0 +1,135 @@
+"""
+PocketShield Threat Indicators
+Canonical forms and hashes for indicators stored in threat_indicators
+
+Every indicator is stored and looked up by SHA-256 of its canonical value, so
+ingestion and lookups must canonicalize the same way; always go through
+``canonicalize``/``indicator_hash`` instead of hashing raw input.
+"""
+
+import hashlib
+import ipaddress
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+DOMAIN = "domain"
+URL = "url"
+IP = "ip"
+FILE_HASH = "file_hash"
+APP_PACKAGE = "app_package"
+
+INDICATOR_KINDS = (DOMAIN, URL, IP, FILE_HASH, APP_PACKAGE)
+
+# Keys used for each kind inside threats.indicators JSONB
+JSON_KEYS = {
+    DOMAIN: "domains",
+    URL: "urls",
+    IP: "ips",
+    FILE_HASH: "file_hashes",
+    APP_PACKAGE: "app_packages",
+}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+MAX_HOST_SUFFIXES = 5
+
+_HEX_HASH = re.compile(r"^[0-9a-fA-F]{32}$|^[0-9a-fA-F]{40}$|^[0-9a-fA-F]{64}$")
+
+
+def canonical_host(host: str) -> str:
+    """Lowercase host without userinfo, port or trailing dot"""
+    host = host.strip().rsplit("@", 1)[-1]
+    if host.startswith("["):
+        host = host[1:host.find("]")] if "]" in host else host[1:]
+    elif host.count(":") == 1:
+        host = host.split(":", 1)[0]
+    return host.lower().rstrip(".")
+
+
+def canonical_url(url: str) -> str:
+    """Lowercase scheme/host, default ports and fragment dropped, path at least '/'"""
+    url = url.strip()
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = canonical_host(parts.hostname or "")
+    netloc = host
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def canonicalize(kind: str, value: str) -> Optional[str]:
+    """Canonical form of an indicator, or None if the value is not valid for ``kind``"""
+    value = value.strip()
+    if not value:
+        return None
+    if kind == DOMAIN:
+        return canonical_host(value) or None
+    if kind == URL:
+        return canonical_url(value)
+    if kind == IP:
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            return None
+    if kind == FILE_HASH:
+        return value.lower() if _HEX_HASH.match(value) else None
+    if kind == APP_PACKAGE:
+        return value
+    return None
+
+
+def infer_kind(value: str) -> Optional[str]:
+    """Best-effort kind for feeds that omit it (app packages must be explicit)"""
+    value = value.strip()
+    if "://" in value or "/" in value:
+        return URL
+    try:
+        ipaddress.ip_address(value)
+        return IP
+    except ValueError:
+        pass
+    if _HEX_HASH.match(value):
+        return FILE_HASH
+    if "." in value:
+        return DOMAIN
+    return None
+
+
+def hash_canonical(canonical: str) -> bytes:
+    return hashlib.sha256(canonical.encode()).digest()
+
+
+def indicator_hash(kind: str, value: str) -> Optional[bytes]:
+    canonical = canonicalize(kind, value)
+    return hash_canonical(canonical) if canonical is not None else None
+
+
+def host_suffixes(host: str) -> List[str]:
+    """The host and its parent domains (at most MAX_HOST_SUFFIXES, never a bare TLD)"""
+    host = canonical_host(host)
+    try:
+        ipaddress.ip_address(host)
+        return [host]
+    except ValueError:
+        pass
+    labels = host.split(".")
+    suffixes = [host]
+    for i in range(max(1, len(labels) - MAX_HOST_SUFFIXES), len(labels) - 1):
+        suffix = ".".join(labels[i:])
+        if suffix != host:
+            suffixes.append(suffix)
+    return suffixes
+
+
+def url_lookup_hashes(url: str) -> Tuple[List[bytes], bytes]:
+    """Hashes a URL's reputation is looked up by: its host and parent domains, and the canonical URL"""
+    host = urlsplit(url if "://" in url else f"http://{url}").hostname or ""
+    host_hashes = [hash_canonical(suffix) for suffix in host_suffixes(host)] if host else []
+    return host_hashes, indicator_hash(URL, url) or b""
@@ -0,0 +1,297 @@
+"""
+PocketShield Metrics
+Prometheus metrics for the API and WebSocket service
+
+When PROMETHEUS_MULTIPROC_DIR is set (uvicorn --workers N), each worker writes
+its samples to that directory and /metrics aggregates them across workers.
+"""
+
+import os
+import time
+from typing import Callable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+# HTTP
+HTTP_REQUEST_DURATION = Histogram(
+    "pocketshield_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# URL analysis
+URL_ANALYSIS_STAGE = Histogram(
+    "pocketshield_url_analysis_stage_seconds",
+    "Time spent in each analyze_urls stage",
+    ["stage"],
+    buckets=FAST_BUCKETS,
+)
+VERDICT_CACHE_LOOKUPS = Counter(
+    "pocketshield_verdict_cache_lookups_total",
+    "URL verdict cache lookups (hit ratio = hit / total)",
+    ["result"],
+)
+VERDICT_CACHE_EVICTIONS = Counter(
+    "pocketshield_verdict_cache_evictions_total",
+    "Cached URL verdicts deleted because a threat they were looked up by changed",
+)
+VERDICT_INVALIDATIONS = Counter(
+    "pocketshield_verdict_invalidations_total",
+    "verdict_invalidations journal entries applied",
+)
+
+STAGE_CACHE = URL_ANALYSIS_STAGE.labels(stage="cache")
+STAGE_DOMAIN_LOOKUP = URL_ANALYSIS_STAGE.labels(stage="domain_lookup")
+STAGE_PATTERN_MATCH = URL_ANALYSIS_STAGE.labels(stage="pattern_match")
+STAGE_BRAND_MATCH = URL_ANALYSIS_STAGE.labels(stage="brand_match")
+STAGE_ENRICHMENT = URL_ANALYSIS_STAGE.labels(stage="enrichment")
+STAGE_STORE = URL_ANALYSIS_STAGE.labels(stage="store")
+CACHE_HIT = VERDICT_CACHE_LOOKUPS.labels(result="hit")
+CACHE_MISS = VERDICT_CACHE_LOOKUPS.labels(result="miss")
+ENRICHMENT_LOOKUPS = Counter(
+    "pocketshield_enrichment_lookups_total",
+    "URL enrichment lookups by kind (redirect, dns, url) and result",
+    ["kind", "result"],
+)
+
+# Postgres
+DB_POOL_ACQUIRE_WAIT = Histogram(
+    "pocketshield_db_pool_acquire_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ["pool"],
+    buckets=FAST_BUCKETS,
+)
+DB_POOL_IN_USE = Gauge(
+    "pocketshield_db_pool_connections_in_use",
+    "Connections currently checked out of the pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "pocketshield_db_query_duration_seconds",
+    "Query latency by registered query name",
+    ["query"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Redis
+REDIS_COMMAND_DURATION = Histogram(
+    "pocketshield_redis_command_duration_seconds",
+    "CacheManager Redis command latency",
+    ["command"],
+    buckets=FAST_BUCKETS,
+)
+
+# WebSocket
+WS_CONNECTIONS = Gauge(
+    "pocketshield_websocket_connections",
+    "Open WebSocket connections",
+    multiprocess_mode="livesum",
+)
+WS_FANOUT_DURATION = Histogram(
+    "pocketshield_websocket_fanout_duration_seconds",
+    "Time to deliver one alert/update to all targeted connections",
+    ["message_type"],
+    buckets=LATENCY_BUCKETS,
+)
+WS_MESSAGES_SENT = Counter(
+    "pocketshield_websocket_messages_sent_total",
+    "WebSocket messages delivered",
+    ["message_type"],
+)
+WS_SEND_FAILURES = Counter(
+    "pocketshield_websocket_send_failures_total",
+    "WebSocket messages that failed to send",
+    ["message_type"],
+)
+WS_HEARTBEAT_FAILURES = Counter(
+    "pocketshield_websocket_heartbeat_failures_total",
+    "Heartbeat pings that failed to send",
+)
+WS_IDLE_DISCONNECTS = Counter(
+    "pocketshield_websocket_idle_disconnects_total",
+    "Connections closed after no client traffic for WS_IDLE_TIMEOUT",
+)
+WS_OUTBOX_DEPTH = Gauge(
+    "pocketshield_websocket_outbox_depth",
+    "Messages queued for WebSocket clients (sampled once per ping interval)",
+    multiprocess_mode="livesum",
+)
+WS_OUTBOX_MAX_DEPTH = Gauge(
+    "pocketshield_websocket_outbox_max_depth",
+    "Deepest single-connection outbox (sampled once per ping interval)",
+    multiprocess_mode="livemax",
+)
+WS_OUTBOX_DROPPED = Counter(
+    "pocketshield_websocket_outbox_dropped_total",
+    "Outbound messages not delivered because a client fell behind (evicted, rejected, coalesced)",
+    ["reason"],
+)
+WS_SLOW_CONSUMER_DISCONNECTS = Counter(
+    "pocketshield_websocket_slow_consumer_disconnects_total",
+    "Connections closed by the outbox (overflow, send_timeout, send_error)",
+    ["reason"],
+)
+WS_CLUSTER_NODES = Gauge(
+    "pocketshield_websocket_cluster_nodes",
+    "Live WebSocket nodes in the presence registry",
+    multiprocess_mode="livemax",
+)
+WS_CLUSTER_MESSAGES = Counter(
+    "pocketshield_websocket_cluster_messages_total",
+    "Cross-node delivery requests by direction (published, received) and kind",
+    ["direction", "message_type"],
+)
+WS_CLUSTER_ACK_TIMEOUTS = Counter(
+    "pocketshield_websocket_cluster_ack_timeouts_total",
+    "Nodes that did not ack a delivery request in time",
+)
+WS_COALESCED_ALERTS = Counter(
+    "pocketshield_websocket_coalesced_alerts_total",
+    "Alert deliveries folded into threat_alert_batch frames",
+)
+WS_REPLAYED_ALERTS = Counter(
+    "pocketshield_websocket_replayed_alerts_total",
+    "Missed alerts replayed to reconnecting devices",
+)
+WS_ADMISSION_DEFERRED = Histogram(
+    "pocketshield_websocket_admission_deferred_seconds",
+    "Time new WebSocket sessions were held for an accept-rate token",
+    buckets=FAST_BUCKETS + (1.0, 2.5),
+)
+WS_ADMISSION_REJECTED = Counter(
+    "pocketshield_websocket_admission_rejected_total",
+    "New WebSocket sessions told to reconnect later (rate, full)",
+    ["reason"],
+)
+ALERT_LOG_QUERIES = Counter(
+    "pocketshield_alert_log_queries_total",
+    "Alert log database round-trips by kind (insert, tail, cursors, ack)",
+    ["kind"],
+)
+
+# Admission control
+ADMISSION_LIMIT = Gauge(
+    "pocketshield_admission_limit",
+    "Current adaptive concurrency limit (summed across workers)",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "pocketshield_admission_in_flight",
+    "Requests currently holding an admission slot",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "pocketshield_admission_queue_depth",
+    "Requests waiting for an admission slot",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "pocketshield_admission_queue_wait_seconds",
+    "Time admitted requests spent waiting for a slot",
+    ["endpoint", "tier"],
+    buckets=FAST_BUCKETS + (1.0, 2.5),
+)
+ADMISSION_SHED = Counter(
+    "pocketshield_admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["endpoint", "tier", "reason"],
+)
+
+# Startup
+STARTUP_PHASE_DURATION = Gauge(
+    "pocketshield_startup_phase_seconds",
+    "Duration of each startup/warm-up phase (slowest worker)",
+    ["phase"],
+    multiprocess_mode="max",
+)
+WORKER_READY = Gauge(
+    "pocketshield_worker_ready",
+    "1 once a worker finished warm-up (0 if any live worker is still warming)",
+    multiprocess_mode="livemin",
+)
+
+# Hash-prefix snapshots
+PREFIX_SNAPSHOT_VERSION = Gauge(
+    "pocketshield_prefix_snapshot_version",
+    "Hash-prefix snapshot version served (lowest live worker)",
+    multiprocess_mode="livemin",
+)
+PREFIX_UPDATES = Counter(
+    "pocketshield_prefix_updates_total",
+    "Prefix snapshot responses by kind (none, delta, full)",
+    ["type"],
+)
+PREFIX_LOOKUPS = Counter(
+    "pocketshield_prefix_lookups_total",
+    "Prefixes looked up, by whether any full hash matched",
+    ["result"],
+)
+
+# Usage metering
+USAGE_METERING_DROPPED = Counter(
+    "pocketshield_usage_metering_dropped_total",
+    "Requests left out of api_usage_stats, by reason (pressure, flush_failed)",
+    ["reason"],
+)
+
+
+def render_latest():
+    """Return (body, content_type) for the /metrics endpoint"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drop this worker's live gauges from the shared multiprocess directory"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware recording per-route request latency"""
+
+    def __init__(self, app, route_for: Callable[[dict], str], excluded_paths=("/metrics", "/health", "/ready")):
+        self.app = app
+        self.route_for = route_for
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(scope["method"], self.route_for(scope), str(status[0])).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,195 @@
+"""
+PocketShield Profiling
+Opt-in per-request span timing, slow-request capture and an on-demand sampling profiler
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "500"))
+MAX_PROFILE_SECONDS = 60
+# Sampling interval bounds: below 1ms the sampler thread competes with the loop it profiles
+MIN_PROFILE_INTERVAL = 0.001
+MAX_PROFILE_INTERVAL = 1.0
+
+
+class RequestTrace:
+    """Span timings collected for one request"""
+
+    __slots__ = ("method", "path", "spans", "start")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.spans: List[tuple] = []  # (name, offset_ms, duration_ms)
+        self.start = time.perf_counter()
+
+    def breakdown(self, total_ms: float) -> Dict[str, float]:
+        stages: Dict[str, float] = {}
+        for name, _, duration in self.spans:
+            stages[name] = stages.get(name, 0.0) + duration
+        # Routing, body parsing, Pydantic validation and response serialization
+        top_level = sum(duration for name, _, duration in self.spans if "." not in name)
+        stages["unattributed"] = max(total_ms - top_level, 0.0)
+        return stages
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.trace.spans.append(
+            (self.name, (self.start - self.trace.start) * 1000, (end - self.start) * 1000)
+        )
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str):
+    """Time a stage of the current request; a shared no-op when tracing is off
+
+    Names without a dot are top-level stages; dotted names (``db.x``) are
+    nested detail and are not subtracted from the unattributed time.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name)
+
+
+class SlowRequestLog:
+    """Ring buffer of the most recent slow-request breakdowns"""
+
+    def __init__(self, maxlen: int = 100):
+        self.entries: Deque[Dict] = deque(maxlen=maxlen)
+
+    def add(self, trace: RequestTrace, total_ms: float, status: int):
+        entry = {
+            "method": trace.method,
+            "path": trace.path,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            "stages_ms": {k: round(v, 3) for k, v in trace.breakdown(total_ms).items()},
+            "spans": [(name, round(offset, 3), round(duration, 3)) for name, offset, duration in trace.spans],
+            "timestamp": time.time(),
+        }
+        self.entries.append(entry)
+        logger.warning(f"Slow request: {json.dumps(entry)}")
+
+
+slow_requests = SlowRequestLog()
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware that attaches a RequestTrace to each HTTP request"""
+
+    def __init__(self, app, threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS):
+        self.app = app
+        self.threshold_ms = threshold_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            total_ms = (time.perf_counter() - trace.start) * 1000
+            if total_ms >= self.threshold_ms:
+                slow_requests.add(trace, total_ms, status[0])
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack and emits folded stacks
+
+    Output is the "folded" format (``frame;frame;frame count``) consumed by
+    flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+async def profile_event_loop(seconds: float, interval: float = 0.005) -> str:
+    """Profile the calling worker's event loop thread for ``seconds``"""
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    interval = min(max(interval, MIN_PROFILE_INTERVAL), MAX_PROFILE_INTERVAL)
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+    return profiler.folded()
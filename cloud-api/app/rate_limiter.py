@@ -0,0 +1,253 @@
+"""
+PocketShield Rate Limiter
+In-process token buckets with tier-aware quotas, reconciled with Redis in batches
+"""
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from app.auth import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIER = "free"
+DEFAULT_ENDPOINT = "default"
+
+
+@dataclass(frozen=True)
+class Quota:
+    """Allowed requests per period (seconds)"""
+    requests: int
+    period: int
+
+    @property
+    def rate(self) -> float:
+        return self.requests / self.period
+
+
+# Used until system_config has been loaded (and for tiers/endpoints it omits)
+DEFAULT_QUOTAS: Dict[str, Dict[str, Quota]] = {
+    "free": {DEFAULT_ENDPOINT: Quota(100, 60)},
+    "premium": {DEFAULT_ENDPOINT: Quota(10000, 3600)},
+    "enterprise": {DEFAULT_ENDPOINT: Quota(100000, 3600)},
+}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("quota", "tokens", "updated", "pending", "blocked_until")
+
+    def __init__(self, quota: Quota, now: float):
+        self.quota = quota
+        self.tokens = float(quota.requests)
+        self.updated = now
+        self.pending = 0  # Requests not yet reported to Redis
+        self.blocked_until = 0.0
+
+    def consume(self, now: float) -> float:
+        """Take one token; return 0 on success or the seconds until one is available"""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+
+        rate = self.quota.rate
+        self.tokens = min(self.quota.requests, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.pending += 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """Per-device, per-endpoint rate limiter
+
+    Each worker enforces quotas locally and reports consumption to Redis every
+    ``sync_interval`` seconds, so a device can overshoot by at most what the
+    other workers admitted since their last sync. ``sync_interval=0`` reports on
+    every request (exact, one Redis round-trip each).
+    """
+
+    def __init__(
+        self,
+        db_manager,
+        sync_interval: float = 1.0,
+        config_refresh_interval: float = 60.0,
+        tier_cache_ttl: int = 300,
+        max_buckets: int = 200000,
+    ):
+        self.db = db_manager
+        self.redis = None
+        self.sync_interval = sync_interval
+        self.config_refresh_interval = config_refresh_interval
+        self.tier_cache_ttl = tier_cache_ttl
+        self.max_buckets = max_buckets
+
+        self.quotas: Dict[str, Dict[str, Quota]] = dict(DEFAULT_QUOTAS)
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._tiers = TTLCache(max_buckets)
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, redis_client):
+        self.redis = redis_client
+        await self.refresh_config()
+        self._tasks = [
+            asyncio.create_task(self._periodic(self.config_refresh_interval, self.refresh_config)),
+        ]
+        if self.sync_interval > 0:
+            self._tasks.append(asyncio.create_task(self._periodic(self.sync_interval, self.reconcile)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await self.reconcile()
+
+    def quota_for(self, tier: str, endpoint: str) -> Quota:
+        tier_quotas = self.quotas.get(tier) or self.quotas[DEFAULT_TIER]
+        return tier_quotas.get(endpoint) or tier_quotas[DEFAULT_ENDPOINT]
+
+    async def tier_for(self, device_id: str) -> str:
+        """The device's API tier (cached for ``tier_cache_ttl`` seconds)"""
+        tier = self._tiers.get(device_id)
+        if tier is None:
+            tier = await self._load_tier(device_id)
+        return tier
+
+    async def check(self, device_id: str, endpoint: str):
+        """Admit one request or raise RateLimitExceeded"""
+        tier = await self.tier_for(device_id)
+
+        quota = self.quota_for(tier, endpoint)
+        now = time.monotonic()
+        key = (device_id, endpoint)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(quota, now)
+        elif bucket.quota != quota:
+            # Quota changed by a config refresh or tier upgrade
+            bucket.quota = quota
+            bucket.tokens = min(bucket.tokens, quota.requests)
+
+        retry_after = bucket.consume(now)
+        if retry_after:
+            raise RateLimitExceeded(retry_after)
+
+        if self.sync_interval <= 0:
+            await self.reconcile()
+
+    async def _load_tier(self, device_id: str) -> str:
+        row = await self.db.execute_one(
+            """
+            SELECT COALESCE(u.api_tier, 'free') AS api_tier
+            FROM devices d LEFT JOIN users u ON u.id = d.user_id
+            WHERE d.device_id = $1
+            """,
+            device_id,
+            readonly=True,
+        )
+        tier = row["api_tier"] if row else DEFAULT_TIER
+        self._tiers.set(device_id, tier, time.time() + self.tier_cache_ttl)
+        return tier
+
+    async def reconcile(self):
+        """Report local consumption to Redis and block buckets over their global quota"""
+        if not self.redis:
+            return
+
+        batch = [(key, bucket) for key, bucket in self._buckets.items() if bucket.pending]
+        if not batch:
+            self._evict_idle()
+            return
+
+        wall_now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        windows = []
+        for (device_id, endpoint), bucket in batch:
+            period = bucket.quota.period
+            window = int(wall_now // period)
+            redis_key = f"ratelimit:{device_id}:{endpoint}:{window}"
+            pipe.incrby(redis_key, bucket.pending)
+            pipe.expire(redis_key, period * 2)
+            windows.append((window + 1) * period)
+            bucket.pending = 0
+
+        results = await pipe.execute()
+
+        now = time.monotonic()
+        for i, (_, bucket) in enumerate(batch):
+            total = results[i * 2]
+            if total >= bucket.quota.requests:
+                bucket.tokens = 0.0
+                bucket.blocked_until = now + (windows[i] - wall_now)
+
+        self._evict_idle()
+
+    def _evict_idle(self):
+        """Drop full, idle buckets once the table grows past its limit"""
+        if len(self._buckets) <= self.max_buckets:
+            return
+        now = time.monotonic()
+        idle = [
+            key for key, bucket in self._buckets.items()
+            if not bucket.pending and now - bucket.updated > bucket.quota.period
+        ]
+        for key in idle:
+            del self._buckets[key]
+
+    async def refresh_config(self):
+        """Reload tier/endpoint quotas from system_config"""
+        rows = await self.db.execute_query(
+            """
+            SELECT key, value FROM system_config
+            WHERE key IN ('rate_limit_quotas', 'max_api_requests_per_hour')
+            """,
+            readonly=True,
+        )
+        config = {row["key"]: _json_value(row["value"]) for row in rows}
+        self.quotas = build_quotas(config)
+
+    async def _periodic(self, interval: float, func):
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                await func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Rate limiter {func.__name__} failed: {e}")
+
+
+def _json_value(value: Any) -> Any:
+    # asyncpg returns JSONB as text unless a codec is registered
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def build_quotas(config: Dict[str, Any]) -> Dict[str, Dict[str, Quota]]:
+    """Merge system_config entries over the default quota table
+
+    ``rate_limit_quotas`` looks like
+    ``{"free": {"default": [100, 60], "threat:analyze_url": [60, 60]}}``.
+    """
+    quotas = {tier: dict(endpoints) for tier, endpoints in DEFAULT_QUOTAS.items()}
+
+    hourly = config.get("max_api_requests_per_hour")
+    if hourly:
+        quotas["premium"][DEFAULT_ENDPOINT] = Quota(int(hourly), 3600)
+
+    for tier, endpoints in (config.get("rate_limit_quotas") or {}).items():
+        tier_quotas = quotas.setdefault(tier, dict(DEFAULT_QUOTAS[DEFAULT_TIER]))
+        for endpoint, (requests, period) in endpoints.items():
+            tier_quotas[endpoint] = Quota(int(requests), int(period))
+
+    return quotas
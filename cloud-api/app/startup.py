@@ -0,0 +1,176 @@
+"""
+PocketShield Startup
+Phase timing, background warm-up and readiness state for each worker
+
+Lifespan startup only opens connections (timed with ``phase``). Everything
+that makes the first requests fast runs afterwards as registered warm-up
+steps, and /ready stays 503 until they finish. /health reports only that the
+process is alive.
+
+Under ``uvicorn --workers N`` the probe reaches whichever worker accepts the
+connection, so each ready worker also drops a pid file in a directory shared
+by the pod's workers. /ready only passes once WEB_CONCURRENCY live workers
+have one.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+DRAINING = "draining"
+
+
+@dataclass
+class WarmupStep:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    timeout: float
+
+
+class StartupManager:
+    """Tracks startup phases and gates readiness on warm-up"""
+
+    def __init__(self, warmup_timeout: float = 30.0, workers: int = 1, ready_dir: Optional[str] = None):
+        self.warmup_timeout = warmup_timeout
+        self.workers = workers
+        self.ready_dir = ready_dir
+        self.imported_at = time.perf_counter()
+        self.state = STARTING
+        self.phases: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.steps: List[WarmupStep] = []
+        self._warmup_task: Optional[asyncio.Task] = None
+
+    def add_warmup(self, name: str, run: Callable[[], Awaitable[Any]], timeout: Optional[float] = None):
+        """Register a warm-up step; steps run concurrently once startup completes"""
+        self.steps.append(WarmupStep(name, run, timeout or self.warmup_timeout))
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+        metrics.STARTUP_PHASE_DURATION.labels(name).set(seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def ready_workers(self) -> int:
+        """Live workers in this pod that finished warm-up"""
+        if not self.ready_dir:
+            return int(self.ready)
+        count = 0
+        for name in os.listdir(self.ready_dir):
+            try:
+                os.kill(int(name), 0)
+            except (ValueError, ProcessLookupError):
+                continue  # a worker that died without draining
+            except PermissionError:
+                pass
+            count += 1
+        return count
+
+    @property
+    def all_ready(self) -> bool:
+        return self.ready and self.ready_workers() >= self.workers
+
+    def _mark_ready(self, ready: bool):
+        if not self.ready_dir:
+            return
+        path = os.path.join(self.ready_dir, str(os.getpid()))
+        try:
+            if ready:
+                open(path, "w").close()
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.error(f"Failed to update worker readiness file {path}: {e}")
+
+    # Lifecycle
+
+    def begin(self, imported_at: Optional[float] = None):
+        """Called first thing in lifespan startup with the perf_counter() taken before app imports"""
+        if imported_at is not None:
+            self.imported_at = imported_at
+        self.record("import", time.perf_counter() - self.imported_at)
+        if self.ready_dir:
+            os.makedirs(self.ready_dir, exist_ok=True)
+
+    def begin_warmup(self):
+        """Called at the end of lifespan startup; warm-up runs in the background"""
+        self.state = WARMING
+        self._warmup_task = asyncio.create_task(self._run_warmup())
+
+    async def _run_step(self, step: WarmupStep):
+        with self.phase(f"warmup.{step.name}"):
+            try:
+                await asyncio.wait_for(step.run(), timeout=step.timeout)
+            except asyncio.TimeoutError:
+                self.errors[step.name] = f"timed out after {step.timeout}s"
+                logger.warning(f"Warm-up step {step.name} timed out")
+            except Exception as e:
+                self.errors[step.name] = str(e)
+                logger.error(f"Warm-up step {step.name} failed: {e}")
+
+    async def _run_warmup(self):
+        # A failed step leaves that path cold but does not keep the worker out of rotation
+        with self.phase("warmup"):
+            await asyncio.gather(*(self._run_step(step) for step in self.steps))
+        if self.state == WARMING:
+            self.state = READY
+            metrics.WORKER_READY.set(1)
+            self._mark_ready(True)
+        self.record("total", time.perf_counter() - self.imported_at)
+        logger.info(
+            f"Worker ready in {self.phases['total']:.2f}s "
+            f"(warm-up {self.phases['warmup']:.2f}s, {len(self.errors)} step errors)"
+        )
+
+    async def drain(self):
+        """Fail readiness first so the load balancer stops routing before shutdown"""
+        self.state = DRAINING
+        metrics.WORKER_READY.set(0)
+        self._mark_ready(False)
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "workers_ready": f"{self.ready_workers()}/{self.workers}",
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "warmup_errors": self.errors,
+        }
+
+
+def _ready_dir() -> Optional[str]:
+    """STARTUP_READY_DIR, else a directory next to the workers' Prometheus files (cleared at boot)"""
+    if os.getenv("STARTUP_READY_DIR"):
+        return os.getenv("STARTUP_READY_DIR")
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return os.path.join(os.getenv("PROMETHEUS_MULTIPROC_DIR"), "ready")
+    return None
+
+
+startup = StartupManager(
+    warmup_timeout=float(os.getenv("STARTUP_WARMUP_TIMEOUT", "30")),
+    workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    ready_dir=_ready_dir(),
+)
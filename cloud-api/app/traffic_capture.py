@@ -0,0 +1,198 @@
+"""
+PocketShield Traffic Capture
+Records sanitized request shapes and timings for later replay (see benchmarks/replay.py)
+
+Enabled by setting TRAFFIC_CAPTURE_DIR. Each worker writes
+capture-<pid>.jsonl.gz there: one JSON header line, then one record per
+HTTP request or WebSocket event. URLs, hosts and device ids are replaced by
+keyed hashes so repetition patterns survive but the values do not. Workers
+sharing TRAFFIC_CAPTURE_SALT produce comparable hashes.
+
+HTTP requests are sampled one by one. WebSocket events are sampled by device
+hash instead, so a sampled device keeps its whole connect/message/disconnect
+history; fan-outs have no device and are always recorded.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+DEVICE_HASH_SPACE = 1 << 48  # hash_value digests are 6 bytes
+
+_current_record: ContextVar[Optional[Dict[str, Any]]] = ContextVar("capture_record", default=None)
+
+
+class TrafficCapture:
+    """Buffered, sampled writer of sanitized traffic records"""
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        sample_rate: float = 1.0,
+        salt: Optional[str] = None,
+        flush_interval: float = 1.0,
+        max_buffer: int = 100000,
+    ):
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.sample_rate = sample_rate
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self.path: Optional[str] = None
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self._buffer: List[Dict[str, Any]] = []
+        self._flush_task = None
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls) -> "TrafficCapture":
+        return cls(
+            directory=os.getenv("TRAFFIC_CAPTURE_DIR") or None,
+            sample_rate=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0")),
+            salt=os.getenv("TRAFFIC_CAPTURE_SALT") or None,
+        )
+
+    # Sanitization helpers
+
+    def hash_value(self, value: str) -> str:
+        return hashlib.blake2b(value.encode(), key=self.salt[:64], digest_size=6).hexdigest()
+
+    def url_shape(self, urls: Iterable[str]) -> Dict[str, Any]:
+        """URL batch shape: per-URL and per-host hashes plus path/query sizes"""
+        urls = list(urls)
+        hosts, url_ids, lengths = [], [], []
+        for url in urls:
+            parts = urlsplit(url)
+            hosts.append(self.hash_value(parts.netloc))
+            url_ids.append(self.hash_value(url))
+            lengths.append(len(url))
+        return {"n": len(urls), "u": url_ids, "h": hosts, "len": lengths}
+
+    # Recording
+
+    def _offset(self) -> float:
+        return round(time.perf_counter() - self._origin, 6)
+
+    def _append(self, record: Dict[str, Any]):
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append(record)
+
+    def annotate(self, **shape):
+        """Attach request shape fields to the current HTTP record (no-op when off)"""
+        record = _current_record.get()
+        if record is not None:
+            record.setdefault("q", {}).update(shape)
+
+    def record_ws(self, event: str, device_id: Optional[str] = None, **fields):
+        if not self.enabled:
+            return
+        record = {"t": self._offset(), "k": "ws", "e": event}
+        if device_id is not None:
+            device_hash = self.hash_value(device_id)
+            if int(device_hash, 16) >= self.sample_rate * DEVICE_HASH_SPACE:
+                return
+            record["d"] = device_hash
+        record.update(fields)
+        self._append(record)
+
+    # Lifecycle
+
+    async def start(self):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"capture-{os.getpid()}.jsonl.gz")
+        header = {"version": CAPTURE_VERSION, "started_at": self.started, "sample_rate": self.sample_rate}
+        await asyncio.to_thread(self._write_lines, [header], "wb")
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Traffic capture enabled: {self.path}")
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+
+    async def flush(self):
+        if not self.enabled or not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        await asyncio.to_thread(self._write_lines, records, "ab")
+
+    def _write_lines(self, records: List[Dict[str, Any]], mode: str):
+        # Each flush appends a gzip member; gzip readers treat them as one stream
+        with gzip.open(self.path, mode) as f:
+            f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode())
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush traffic capture: {e}")
+
+
+class CaptureMiddleware:
+    """Pure ASGI middleware recording one sanitized record per sampled HTTP request"""
+
+    def __init__(self, app, capture: TrafficCapture, route_for):
+        self.app = app
+        self.capture = capture
+        self.route_for = route_for
+
+    async def __call__(self, scope, receive, send):
+        capture = self.capture
+        if scope["type"] != "http" or random.random() >= capture.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        record: Dict[str, Any] = {"t": capture._offset(), "k": "http", "m": scope["method"]}
+        token = _current_record.set(record)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_record.reset(token)
+            record["r"] = self.route_for(scope)
+            record["s"] = status[0]
+            record["l"] = round((time.perf_counter() - start) * 1000, 3)
+            device_id = scope.get("state", {}).get("device_id")
+            if device_id:
+                record["d"] = capture.hash_value(device_id)
+            capture._append(record)
+
+
+def read_capture(path: str) -> Iterable[Dict[str, Any]]:
+    """Yield records (header first) from a capture file"""
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+traffic_capture = TrafficCapture.from_env()
@@ -0,0 +1,220 @@
+"""
+PocketShield Usage Metering
+ASGI middleware that pre-aggregates per-device API usage and bulk-writes api_usage_stats
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# (device_id, endpoint, method, status_code, minute)
+UsageKey = Tuple[Optional[str], str, str, int, int]
+
+INSERT_USAGE_QUERY = """
+INSERT INTO api_usage_stats (
+    device_id, endpoint, method, status_code, request_count,
+    response_time_ms, max_response_time_ms, request_size_bytes, response_size_bytes, created_at
+)
+VALUES ((SELECT id FROM devices WHERE device_id = $1), $2, $3, $4, $5, $6, $7, $8, $9, $10)
+"""
+
+
+class UsageMeter:
+    """In-memory usage aggregates, flushed to Postgres in the background
+
+    Requests are folded into one row per (device, endpoint, method, status,
+    minute). Updates happen on the event loop thread only, so no locking is
+    needed; a flush swaps the whole buffer out in one assignment, and a failed
+    write merges it back so the next flush retries it. When the buffer holds
+    ``max_keys`` distinct keys, requests that would add a new key are sampled
+    at ``pressure_sample_rate`` and weighted accordingly.
+    """
+
+    def __init__(
+        self,
+        db_manager,
+        flush_interval: float = 10.0,
+        max_keys: int = 50000,
+        pressure_sample_rate: float = 0.1,
+        excluded_paths: Tuple[str, ...] = ("/health", "/ready", "/metrics"),
+    ):
+        self.db = db_manager
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.pressure_sample_rate = pressure_sample_rate
+        self.excluded_paths = set(excluded_paths)
+
+        # key -> [count, total_ms, max_ms, request_bytes, response_bytes]
+        self._buffer: Dict[UsageKey, List[float]] = {}
+        self._route_paths: Dict[Any, str] = {}
+        self._flush_task = None
+        self.sampled_requests = 0
+        self.dropped_requests = 0
+
+    def set_routes(self, routes):
+        """Map endpoint functions to path templates so ids don't explode cardinality"""
+        self._route_paths = {
+            getattr(route, "endpoint", None): route.path for route in routes if hasattr(route, "path")
+        }
+
+    def endpoint_for(self, scope) -> str:
+        """Route template for a request; unmatched paths share one label"""
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    def record(
+        self,
+        device_id: Optional[str],
+        endpoint: str,
+        method: str,
+        status_code: int,
+        elapsed_ms: float,
+        request_bytes: int,
+        response_bytes: int,
+    ):
+        key = (device_id, endpoint, method, status_code, int(time.time() // 60))
+        entry = self._buffer.get(key)
+        weight = 1
+
+        if entry is None:
+            if len(self._buffer) >= self.max_keys:
+                if random.random() >= self.pressure_sample_rate:
+                    self.dropped_requests += 1
+                    metrics.USAGE_METERING_DROPPED.labels("pressure").inc()
+                    return
+                weight = round(1 / self.pressure_sample_rate)
+                self.sampled_requests += 1
+            entry = self._buffer[key] = [0, 0.0, 0.0, 0, 0]
+
+        entry[0] += weight
+        entry[1] += elapsed_ms * weight
+        if elapsed_ms > entry[2]:
+            entry[2] = elapsed_ms
+        entry[3] += request_bytes * weight
+        entry[4] += response_bytes * weight
+
+    async def start(self):
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+
+    async def flush(self):
+        """Write all buffered aggregates in one batch"""
+        buffer, self._buffer = self._buffer, {}
+        if not buffer:
+            return
+
+        rows = [
+            (
+                device_id,
+                endpoint,
+                method,
+                status_code,
+                int(count),
+                int(total_ms / count),
+                int(max_ms),
+                int(request_bytes),
+                int(response_bytes),
+                datetime.utcfromtimestamp(minute * 60),
+            )
+            for (device_id, endpoint, method, status_code, minute), (count, total_ms, max_ms, request_bytes, response_bytes)
+            in buffer.items()
+        ]
+        try:
+            await self.db.executemany(INSERT_USAGE_QUERY, rows)
+        except BaseException:
+            self._merge(buffer)
+            raise
+
+        if self.sampled_requests or self.dropped_requests:
+            logger.warning(
+                f"Usage metering under pressure: sampled={self.sampled_requests} dropped={self.dropped_requests}"
+            )
+            self.sampled_requests = 0
+            self.dropped_requests = 0
+
+    def _merge(self, buffer: Dict[UsageKey, List[float]]):
+        """Fold unwritten aggregates back in; keys past max_keys are dropped and counted"""
+        dropped = 0
+        for key, (count, total_ms, max_ms, request_bytes, response_bytes) in buffer.items():
+            entry = self._buffer.get(key)
+            if entry is None:
+                if len(self._buffer) >= self.max_keys:
+                    dropped += count
+                    continue
+                entry = self._buffer[key] = [0, 0.0, 0.0, 0, 0]
+            entry[0] += count
+            entry[1] += total_ms
+            entry[2] = max(entry[2], max_ms)
+            entry[3] += request_bytes
+            entry[4] += response_bytes
+        if dropped:
+            self.dropped_requests += int(dropped)
+            metrics.USAGE_METERING_DROPPED.labels("flush_failed").inc(dropped)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to flush usage stats: {e}")
+
+
+class UsageMeteringMiddleware:
+    """Pure ASGI middleware (avoids BaseHTTPMiddleware's per-request task overhead)"""
+
+    def __init__(self, app, meter: UsageMeter):
+        self.app = app
+        self.meter = meter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.meter.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        sizes = [0, 0]  # request bytes, response bytes
+        status = [500]
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            # verify_token stores the authenticated device on request.state
+            device_id = scope.get("state", {}).get("device_id")
+            self.meter.record(
+                device_id,
+                self.meter.endpoint_for(scope),
+                scope["method"],
+                status[0],
+                (time.perf_counter() - start) * 1000,
+                sizes[0],
+                sizes[1],
+            )
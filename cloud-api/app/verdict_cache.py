@@ -0,0 +1,279 @@
+"""
+PocketShield Verdict Cache
+URL verdicts in Redis, evicted when the threats behind them change
+
+A verdict depends on the indicator hashes its URL was looked up by (the host,
+its parent domains and the canonical URL, plus those of a redirect
+destination). Each cached verdict is added to a reverse index per hash
+(``verdict:by:<hash>``). Triggers on threats and threat_indicators journal the
+hashes of every change that can alter a lookup (new or removed indicators,
+status changes such as false_positive, re-scoring, earlier expiry) into
+verdict_invalidations; one API worker at a time drains the journal and deletes
+exactly the verdicts indexed under those hashes.
+
+Journal rows commit out of seq order (a feed load's transaction runs for
+seconds while API writes commit around it), so the journal is read by writing
+transaction id instead: each drain covers the ids from the shared cursor up to
+the current snapshot's xmin, below which every transaction has finished. A
+row is therefore read once its transaction commits, however late; a
+long-running transaction delays invalidation but never loses it. A verdict computed before a
+change but stored after its eviction sees the change's marker
+(``verdict:changed:<hash>``) when it is stored, and removes itself.
+
+Verdicts can therefore be cached for much longer. A verdict's TTL is the
+configured maximum, cut short by the earliest expiry among the threats it
+matched. Expiry is the one change that writes nothing. Redirect and DNS
+enrichment change without any journal entry (a shortener can be repointed),
+so verdicts that used it keep the old short TTL.
+
+Reputation lookups read from the replica, which can lag the eviction. While a
+hash's change marker exists, lookups by it go to the primary instead, so a
+verdict computed after the eviction never caches pre-change rows.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+INDEX_PREFIX = "verdict:by:"
+CHANGED_PREFIX = "verdict:changed:"
+CHANGED_MARKER_TTL = 300  # seconds; longer than any single URL analysis
+CLOCK_SLACK = 2.0  # seconds of clock skew tolerated between workers
+CURSOR_KEY = "verdict:invalidation:xid"
+LOCK_KEY = "verdict:invalidation:lock"
+
+# Deletes KEYS[1] only while it still holds this worker's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Rows of transactions in [$1, $3) (all finished), paged by (xid, seq) after ($1, $2)
+INVALIDATIONS_QUERY = """
+SELECT seq, xid::text AS xid, value_hash FROM verdict_invalidations
+WHERE (xid, seq) > ($1::text::xid8, $2) AND xid < $3::text::xid8
+ORDER BY xid, seq
+LIMIT $4
+"""
+
+# Every transaction with a lower id has committed or rolled back
+SNAPSHOT_XMIN_QUERY = """
+SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin
+"""
+
+# Seconds since each hash was last invalidated (for verdicts restored from url_analyses)
+RECENT_INVALIDATIONS_QUERY = """
+SELECT value_hash, EXTRACT(EPOCH FROM NOW() - MAX(created_at))::float8 AS age
+FROM verdict_invalidations
+WHERE value_hash = ANY($1::bytea[])
+GROUP BY value_hash
+"""
+
+PRUNE_QUERY = """
+DELETE FROM verdict_invalidations WHERE created_at < NOW() - make_interval(secs => $1)
+"""
+
+PRUNE_INTERVAL = 3600.0
+
+
+@dataclass
+class VerdictCacheConfig:
+    max_ttl: int = 86400  # seconds; verdicts that matched expiring threats live shorter
+    enriched_ttl: int = 3600  # seconds; cap for verdicts that used redirect/DNS enrichment
+    poll_interval: float = 1.0  # seconds between journal reads (the invalidation lag)
+    batch_size: int = 10000  # journal rows per read
+
+    @classmethod
+    def from_env(cls) -> "VerdictCacheConfig":
+        return cls(
+            max_ttl=int(os.getenv("VERDICT_CACHE_MAX_TTL", "86400")),
+            enriched_ttl=int(os.getenv("VERDICT_CACHE_ENRICHED_TTL", "3600")),
+            poll_interval=float(os.getenv("VERDICT_INVALIDATION_INTERVAL", "1.0")),
+        )
+
+
+def index_key(value_hash: bytes) -> str:
+    return f"{INDEX_PREFIX}{value_hash.hex()}"
+
+
+def changed_key(value_hash: bytes) -> str:
+    return f"{CHANGED_PREFIX}{value_hash.hex()}"
+
+
+class VerdictDependencies:
+    """Indicator hashes a verdict was looked up by, and its earliest-expiring matched threat"""
+
+    __slots__ = ("hashes", "expires_in")
+
+    def __init__(self):
+        self.hashes: Set[bytes] = set()
+        self.expires_in: Optional[float] = None  # seconds; None if no matched threat expires
+
+    def add(self, hashes: Iterable[bytes], expires_in: Iterable[Optional[float]] = ()):
+        self.hashes.update(value_hash for value_hash in hashes if value_hash)
+        for seconds in expires_in:
+            if seconds is not None and (self.expires_in is None or seconds < self.expires_in):
+                self.expires_in = seconds
+
+    def cap(self, seconds: float):
+        """Depend on something no journal entry invalidates: live at most ``seconds``"""
+        self.add((), (seconds,))
+
+    def ttl(self, max_ttl: int) -> int:
+        if self.expires_in is None:
+            return max_ttl
+        return max(1, min(max_ttl, int(self.expires_in)))
+
+
+class VerdictCache:
+    """Verdict storage with its reverse index, plus the invalidation journal consumer"""
+
+    def __init__(self, cache_manager, db_manager, config: Optional[VerdictCacheConfig] = None):
+        self.cache = cache_manager
+        self.db = db_manager
+        self.config = config or VerdictCacheConfig.from_env()
+        self.db.register("verdict_cache.invalidations", INVALIDATIONS_QUERY, timeout=5.0)
+        self.db.register("verdict_cache.snapshot_xmin", SNAPSHOT_XMIN_QUERY, timeout=2.0)
+        self.db.register("verdict_cache.recent_invalidations", RECENT_INVALIDATIONS_QUERY, readonly=True, timeout=5.0)
+        self.db.register("verdict_cache.prune", PRUNE_QUERY)
+        self._pruned_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._invalidation_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    # Verdicts
+    def set(self, pipe, key: str, result: Dict[str, Any], hashes: Iterable[bytes], ttl: int, nx: bool = False):
+        """Queue a verdict and its index entries on ``pipe``
+
+        Index sets live ``max_ttl`` past their last addition, so they outlive
+        every verdict they list.
+        """
+        pipe.set(key, json.dumps(result), ex=ttl, nx=nx)
+        for value_hash in hashes:
+            pipe.sadd(index_key(value_hash), key)
+            pipe.expire(index_key(value_hash), self.config.max_ttl)
+
+    async def store(self, key: str, result: Dict[str, Any], dependencies: VerdictDependencies, started_at: float):
+        """Cache a verdict whose lookups began at ``started_at`` (time.time())"""
+        hashes = list(dependencies.hashes)
+        with metrics.REDIS_COMMAND_DURATION.labels("pipeline").time():
+            async with self.cache.redis.pipeline(transaction=False) as pipe:
+                self.set(pipe, key, result, hashes, dependencies.ttl(self.config.max_ttl))
+                if hashes:
+                    pipe.mget([changed_key(value_hash) for value_hash in hashes])
+                replies = await pipe.execute()
+        # A threat it was looked up by changed meanwhile, possibly after the eviction pass
+        changed = replies[-1] if hashes else []
+        if any(at is not None and float(at) >= started_at - CLOCK_SLACK for at in changed):
+            await self.cache.delete(key)
+
+    async def recently_changed(self, hashes: List[bytes]) -> bool:
+        """Whether any of ``hashes`` still has a change marker (the replica may not have the change yet)"""
+        hashes = [value_hash for value_hash in hashes if value_hash]
+        if not hashes:
+            return False
+        markers = await self.cache.redis.mget([changed_key(value_hash) for value_hash in hashes])
+        return any(marker is not None for marker in markers)
+
+    async def invalidated_since(self, hashes: List[bytes]) -> Dict[bytes, float]:
+        """Seconds since each of ``hashes`` was last invalidated (only those still journaled)"""
+        if not hashes:
+            return {}
+        rows = await self.db.execute_query("verdict_cache.recent_invalidations", hashes)
+        return {bytes(row["value_hash"]): row["age"] for row in rows}
+
+    async def invalidate(self, hashes: Iterable[bytes]) -> int:
+        """Delete every verdict indexed under ``hashes``; returns how many were deleted"""
+        hashes = set(hashes)
+        if not hashes:
+            return 0
+        index_keys = [index_key(value_hash) for value_hash in hashes]
+        now = time.time()
+        async with self.cache.redis.pipeline(transaction=False) as pipe:
+            # Markers first: verdicts stored after the index is read still see the change
+            for value_hash in hashes:
+                pipe.set(changed_key(value_hash), now, ex=CHANGED_MARKER_TTL)
+            for key in index_keys:
+                pipe.smembers(key)
+            members = (await pipe.execute())[len(hashes):]
+        verdict_keys = set().union(*members)
+        if not verdict_keys:
+            return 0
+        async with self.cache.redis.pipeline(transaction=False) as pipe:
+            pipe.delete(*verdict_keys)
+            # Only what was read: a verdict indexed since then stays indexed
+            for key, listed in zip(index_keys, members):
+                if listed:
+                    pipe.srem(key, *listed)
+            await pipe.execute()
+        metrics.VERDICT_CACHE_EVICTIONS.inc(len(verdict_keys))
+        return len(verdict_keys)
+
+    # Journal
+    async def drain(self) -> int:
+        """Apply invalidations journaled by transactions finished since the shared cursor
+
+        Returns the verdicts evicted. A worker that dies mid-drain leaves the
+        cursor where it was; the next drain repeats the range, which is harmless.
+        """
+        redis = self.cache.redis
+        # One worker at a time; the lock outlives a stuck worker by a few intervals
+        token = uuid.uuid4().hex
+        if not await redis.set(LOCK_KEY, token, ex=max(10, int(self.config.poll_interval * 10)), nx=True):
+            return 0
+        try:
+            cursor = await redis.get(CURSOR_KEY)
+            xmin = (await self.db.execute_one("verdict_cache.snapshot_xmin"))["xmin"]
+            if cursor is None:
+                # Verdicts cached before the cursor existed were never indexed; start from now
+                await redis.set(CURSOR_KEY, xmin)
+                return 0
+            evicted = 0
+            after = (cursor, 0)
+            while True:
+                rows = await self.db.execute_query(
+                    "verdict_cache.invalidations", *after, xmin, self.config.batch_size
+                )
+                if rows:
+                    evicted += await self.invalidate(bytes(row["value_hash"]) for row in rows)
+                    metrics.VERDICT_INVALIDATIONS.inc(len(rows))
+                    after = (rows[-1]["xid"], rows[-1]["seq"])
+                if len(rows) < self.config.batch_size:
+                    break
+            await redis.set(CURSOR_KEY, xmin)
+            return evicted
+        finally:
+            # Never delete a lock another worker took after ours expired
+            await redis.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY, token)
+
+    async def _invalidation_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.config.poll_interval)
+                evicted = await self.drain()
+                if evicted:
+                    logger.info(f"Evicted {evicted} verdicts invalidated by threat changes")
+                if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    # A journal entry matters only while verdicts cached before it may still be live
+                    await self.db.execute("verdict_cache.prune", self.config.max_ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Verdict invalidation failed: {e}")
@@ -4,18 +4,33 @@ Handles real-time threat intelligence updates and device communication
 """
 
 import asyncio
+import itertools
 import json
 import logging
+import os
+import time
+import zlib
 from datetime import datetime, timedelta
-from typing import Dict, List, Set, Optional, Any
-import jwt
+from typing import Dict, List, Set, Optional, Any, Tuple, Union
 from fastapi import WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.security import HTTPBearer
 import redis.asyncio as redis
 import uuid
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from enum import Enum
 
+from app import metrics
+from app.admission import LoadShed
+from app.alert_log import AlertLog, LogEntry
+from app.auth import AuthError, TokenVerifier
+from app.traffic_capture import traffic_capture
+from app.ws_admission import RETRY_CLOSE_CODE, ConnectionAdmission, WSAdmissionConfig
+from app.ws_cluster import WebSocketCluster
+from app.ws_coalesce import AlertCoalescer, CoalesceConfig, PendingAlert, merge_alerts
+from app.ws_index import SubscriptionIndex
+from app.ws_liveness import Liveness, LivenessConfig
+from app.ws_outbox import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, Outbox, OutboxConfig
+
 logger = logging.getLogger(__name__)
 
 class AlertSeverity(Enum):
@@ -32,6 +47,20 @@ class AlertType(Enum):
     SUSPICIOUS_ACTIVITY = "suspicious_activity"
     SYSTEM_MAINTENANCE = "system_maintenance"
 
+# Alerts carry a severity rather than a risk score; compared against ConnectionInfo.risk_threshold
+SEVERITY_SCORES = {
+    AlertSeverity.LOW: 25,
+    AlertSeverity.MEDIUM: 50,
+    AlertSeverity.HIGH: 75,
+    AlertSeverity.CRITICAL: 95
+}
+
+def _json_default(value: Any):
+    """Serialize enums (e.g. ThreatAlert.alert_type/severity) by value"""
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
 @dataclass
 class WebSocketMessage:
     """Standardized WebSocket message format"""
@@ -42,7 +71,38 @@ class WebSocketMessage:
     device_id: Optional[str] = None
     
     def to_json(self) -> str:
-        return json.dumps(asdict(self))
+        return json.dumps({
+            "message_id": self.message_id,
+            "message_type": self.message_type,
+            "timestamp": self.timestamp,
+            "data": self.data,
+            "device_id": self.device_id
+        }, default=_json_default)
+
+class Frame:
+    """A message encoded once and shared by every recipient of a fan-out
+
+    Fan-out frames carry no per-device fields (``device_id`` is null; each
+    socket is already bound to its device), so the same immutable text goes
+    to every outbox. Clients that opted into compression get a zlib-deflated
+    binary frame instead once the text reaches ``compress_min_bytes``; it is
+    compressed on first use and then shared as well.
+    """
+
+    __slots__ = ("message_type", "text", "compress_min_bytes", "_deflated")
+
+    def __init__(self, message: WebSocketMessage, compress_min_bytes: int = 4096):
+        self.message_type = message.message_type
+        self.text = message.to_json()
+        self.compress_min_bytes = compress_min_bytes
+        self._deflated: Optional[bytes] = None
+
+    def payload(self, compressed: bool = False) -> Union[str, bytes]:
+        if not compressed or len(self.text) < self.compress_min_bytes:
+            return self.text
+        if self._deflated is None:
+            self._deflated = zlib.compress(self.text.encode(), 6)
+        return self._deflated
 
 @dataclass
 class ThreatAlert:
@@ -62,92 +122,173 @@ class ThreatAlert:
     def __post_init__(self):
         if not self.created_at:
             self.created_at = datetime.utcnow().isoformat()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "alert_id": self.alert_id,
+            "alert_type": self.alert_type.value,
+            "severity": self.severity.value,
+            "title": self.title,
+            "description": self.description,
+            "indicators": self.indicators,
+            "affected_regions": self.affected_regions,
+            "threat_tags": self.threat_tags,
+            "action_required": self.action_required,
+            "expires_at": self.expires_at,
+            "created_at": self.created_at
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ThreatAlert":
+        return cls(**{
+            **data,
+            "alert_type": AlertType(data["alert_type"]),
+            "severity": AlertSeverity(data["severity"])
+        })
 
-@dataclass
+@dataclass(slots=True)
 class ConnectionInfo:
-    """WebSocket connection information"""
+    """WebSocket connection information (one per socket, so kept compact)"""
+    connection_id: int
     device_id: str
     websocket: WebSocket
-    connected_at: datetime
-    last_ping: datetime
-    subscriptions: Set[str]  # Threat types subscribed to
+    connected_at: float  # time.monotonic()
+    last_seen: float  # time.monotonic() of the last client message
+    subscriptions: int  # Threat types subscribed to, mask over SubscriptionIndex.types
     risk_threshold: int  # Minimum risk score for alerts
-    geographic_regions: List[str]  # Regions of interest
+    regions: int  # Regions of interest, mask over SubscriptionIndex.regions (0 = all)
+    outbox: Optional[Outbox] = None  # Outbound queue; all sends go through it
+    accept_compressed: bool = False  # Client inflates binary (zlib) frames
 
 class WebSocketManager:
     """Manages WebSocket connections and real-time communications"""
     
-    def __init__(self, redis_client: redis.Redis):
+    def __init__(self, redis_client: redis.Redis, token_verifier: TokenVerifier,
+                 cluster: Optional[bool] = None, alert_log: Optional[AlertLog] = None):
         self.redis = redis_client
-        self.active_connections: Dict[str, ConnectionInfo] = {}
-        self.device_to_connection: Dict[str, str] = {}  # device_id -> connection_id
-        self.jwt_secret = "your-jwt-secret"  # Use environment variable
-        self.jwt_algorithm = "HS256"
+        # Durable threat alerts, replayed to devices that missed them (None: live delivery only)
+        self.alert_log = alert_log
+        self.active_connections: Dict[int, ConnectionInfo] = {}
+        self.device_to_connection: Dict[str, int] = {}  # device_id -> connection_id
+        self.subscription_index = SubscriptionIndex(SEVERITY_SCORES.values(), (t.value for t in AlertType))
+        self._connection_ids = itertools.count(1)
+        self._default_regions = self.subscription_index.regions.mask(["IN"])
+        self.started_at = datetime.utcnow()
+        self.stale_connections = 0  # expired over the last ping interval
+        self.outbox_config = OutboxConfig.from_env()
+        self.compress_min_bytes = int(os.getenv("WS_COMPRESS_MIN_BYTES", "4096"))
+        self.liveness = Liveness(LivenessConfig.from_env())
+        self.coalescer = AlertCoalescer(CoalesceConfig.from_env(), self._deliver_alert_batches)
+        self.admission = ConnectionAdmission(WSAdmissionConfig.from_env())
+        self._window_start = time.monotonic()
+        self._queued_in_window = 0
+        self._deepest_in_window = 0
+        self._expired_in_window = 0
+        
+        # The HTTP API's verifier (same secret, device checks, revocations and caches); its owner starts it
+        self.token_verifier = token_verifier
+        
+        # Cross-node delivery (WS_CLUSTER_ENABLED); without it only local sockets are reached
+        if cluster is None:
+            cluster = os.getenv("WS_CLUSTER_ENABLED", "false").lower() == "true"
+        self.cluster: Optional[WebSocketCluster] = None
+        if cluster:
+            self.cluster = WebSocketCluster.from_env(redis_client, self.cluster_summary)
+            self.cluster.on("threat_alert", self._deliver_threat_alert_payload)
+            self.cluster.on("security_update", self._deliver_security_update_payload)
+            self.cluster.on("broadcast", self._deliver_broadcast_payload)
         
         # Background tasks
-        self._cleanup_task = None
-        self._heartbeat_task = None
+        self._liveness_task = None
         
     async def start_background_tasks(self):
         """Start background maintenance tasks"""
-        self._cleanup_task = asyncio.create_task(self._cleanup_stale_connections())
-        self._heartbeat_task = asyncio.create_task(self._heartbeat_monitor())
+        self._liveness_task = asyncio.create_task(self._liveness_loop())
+        if self.alert_log:
+            await self.alert_log.start()
+        if self.cluster:
+            await self.cluster.start()
         
     async def stop_background_tasks(self):
         """Stop background maintenance tasks"""
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
-        if self._heartbeat_task:
-            self._heartbeat_task.cancel()
+        if self._liveness_task:
+            self._liveness_task.cancel()
+        self.coalescer.flush()
+        if self.alert_log:
+            await self.alert_log.stop()
+        if self.cluster:
+            await self.cluster.stop()
+    
+    async def admit(self, websocket: WebSocket) -> bool:
+        """Admission control for a new session; call before authenticate_connection
+
+        Returns False after closing the socket with RETRY_CLOSE_CODE and a
+        ``retry_after=<seconds>`` reason when the pod is over its accept rate
+        or connection cap.
+        """
+        try:
+            await self.admission.admit(len(self.active_connections))
+            return True
+        except LoadShed as e:
+            # A close code only reaches the client once the handshake is accepted
+            try:
+                await websocket.accept()
+                await websocket.close(code=RETRY_CLOSE_CODE, reason=f"retry_after={e.retry_after:.1f}")
+            except Exception as close_error:
+                logger.debug(f"Error closing rejected WebSocket: {close_error}")
+            return False
     
     async def authenticate_connection(self, websocket: WebSocket, token: str) -> str:
         """Authenticate WebSocket connection and return device_id"""
         try:
-            payload = jwt.decode(token, self.jwt_secret, algorithms=[self.jwt_algorithm])
-            device_id = payload.get("device_id")
-            
-            if not device_id:
-                await websocket.close(code=4001, reason="Invalid token: missing device_id")
-                return None
-                
-            # Verify device exists in database (implement as needed)
-            # device_exists = await self._verify_device_exists(device_id)
-            # if not device_exists:
-            #     await websocket.close(code=4002, reason="Device not found")
-            #     return None
-                
-            return device_id
-            
-        except jwt.InvalidTokenError as e:
-            logger.warning(f"Invalid JWT token: {e}")
-            await websocket.close(code=4001, reason="Invalid token")
+            return await self.token_verifier.verify(token)
+        except AuthError as e:
+            logger.warning(f"WebSocket authentication failed: {e.reason}")
+            await websocket.close(code=e.close_code, reason=e.reason)
             return None
     
-    async def connect(self, websocket: WebSocket, device_id: str, subscriptions: Set[str] = None) -> str:
-        """Establish new WebSocket connection"""
-        connection_id = str(uuid.uuid4())
+    async def connect(self, websocket: WebSocket, device_id: str, subscriptions: Set[str] = None,
+                      accept_compressed: bool = False, last_message_id: Optional[str] = None) -> int:
+        """Establish new WebSocket connection
+
+        ``last_message_id`` is the last alert the client acknowledged; alerts
+        logged after it (or after its stored cursor) are replayed in one frame.
+        """
+        connection_id = next(self._connection_ids)
         
         # Accept WebSocket connection
         await websocket.accept()
         
-        # Disconnect existing connection for this device (if any)
+        # Close the device's previous connection (if any) without waiting on its close handshake
         if device_id in self.device_to_connection:
-            await self.disconnect_device(device_id)
+            asyncio.create_task(self.disconnect(self.device_to_connection[device_id], reason="replaced"))
         
         # Create connection info
+        now = time.monotonic()
         connection_info = ConnectionInfo(
+            connection_id=connection_id,
             device_id=device_id,
             websocket=websocket,
-            connected_at=datetime.utcnow(),
-            last_ping=datetime.utcnow(),
-            subscriptions=subscriptions or {"phishing", "malware", "scam"},
+            connected_at=now,
+            last_seen=now,
+            subscriptions=self.subscription_index.types.mask(subscriptions or ("phishing", "malware", "scam")),
             risk_threshold=50,  # Default threshold
-            geographic_regions=["IN"]  # Default to India
+            regions=self._default_regions,  # Default to India
+            accept_compressed=accept_compressed
         )
         
+        # Outbound queue with its own writer, so a slow client only delays itself
+        connection_info.outbox = Outbox(websocket, self.outbox_config, connection_id, self._on_send_failure)
+        
         # Store connection
         self.active_connections[connection_id] = connection_info
         self.device_to_connection[device_id] = connection_id
+        self._index_connection(connection_id, connection_info)
+        self.liveness.add(connection_id, connection_info.last_seen)
+        metrics.WS_CONNECTIONS.inc()
+        traffic_capture.record_ws(
+            "connect", device_id, subs=sorted(self.subscription_index.types.names(connection_info.subscriptions))
+        )
         
         # Send welcome message
         welcome_msg = WebSocketMessage(
@@ -162,45 +303,48 @@ class WebSocketManager:
             }
         )
         
-        await self._send_message(websocket, welcome_msg)
-        
-        # Store connection info in Redis for clustering
-        await self.redis.setex(
-            f"ws_connection:{connection_id}",
-            3600,  # 1 hour TTL
-            json.dumps({
-                "device_id": device_id,
-                "connected_at": connection_info.connected_at.isoformat(),
-                "subscriptions": list(connection_info.subscriptions)
-            })
-        )
+        self._send_message(connection_info, welcome_msg, PRIORITY_HIGH)
+        
+        if self.alert_log:
+            asyncio.create_task(self._replay_missed_alerts(connection_info, last_message_id))
+        
+        # Register presence so alerts published on other nodes reach this device
+        if self.cluster:
+            await self._announce(connection_info)
         
         logger.info(f"WebSocket connected: device_id={device_id}, connection_id={connection_id}")
         return connection_id
     
-    async def disconnect(self, connection_id: str):
+    async def disconnect(self, connection_id: int, code: int = 1000, reason: Optional[str] = None):
         """Disconnect specific connection"""
-        if connection_id not in self.active_connections:
+        # Remove from active connections
+        connection = self.active_connections.pop(connection_id, None)
+        if connection is None:
             return
-            
-        connection = self.active_connections[connection_id]
         device_id = connection.device_id
+        self.subscription_index.remove(connection_id)
+        self.liveness.remove(connection_id)
+        self.coalescer.discard(connection_id)
+        metrics.WS_CONNECTIONS.dec()
         
-        # Close WebSocket
+        # Stop the writer and close WebSocket (a stuck client may never finish the close handshake)
+        connection.outbox.stop()
         try:
-            await connection.websocket.close()
+            async with asyncio.timeout(self.outbox_config.send_timeout):
+                await connection.websocket.close(code=code, reason=reason)
         except Exception as e:
             logger.warning(f"Error closing WebSocket: {e}")
         
-        # Remove from active connections
-        del self.active_connections[connection_id]
+        traffic_capture.record_ws(
+            "disconnect", device_id,
+            age=round(time.monotonic() - connection.connected_at, 3)
+        )
         
-        # Remove device mapping
-        if device_id in self.device_to_connection:
+        # Remove device mapping and presence (unless the device already reconnected)
+        if self.device_to_connection.get(device_id) == connection_id:
             del self.device_to_connection[device_id]
-        
-        # Remove from Redis
-        await self.redis.delete(f"ws_connection:{connection_id}")
+            if self.cluster:
+                await self.cluster.device_offline(device_id)
         
         logger.info(f"WebSocket disconnected: device_id={device_id}, connection_id={connection_id}")
     
@@ -211,17 +355,34 @@ class WebSocketManager:
             await self.disconnect(connection_id)
     
     async def send_threat_alert(self, alert: ThreatAlert, target_devices: List[str] = None):
-        """Send threat alert to connected devices"""
-        message = WebSocketMessage(
-            message_id=str(uuid.uuid4()),
-            message_type="threat_alert",
-            timestamp=datetime.utcnow().isoformat(),
-            data={
-                "alert": asdict(alert),
-                "priority": "high" if alert.severity in [AlertSeverity.HIGH, AlertSeverity.CRITICAL] else "normal"
-            }
-        )
-        
+        """Send threat alert to connected devices (on every node, if clustered)
+
+        With an alert log the alert is written first, so devices that are
+        offline or miss it get it on reconnect.
+        """
+        seq = None
+        if self.alert_log:
+            try:
+                seq = await self.alert_log.append(alert.to_dict(), target_devices)
+            except Exception as e:
+                logger.error(f"Failed to log alert {alert.alert_id}; delivering live only: {e}")
+        if self.cluster:
+            return await self.cluster.fanout(
+                "threat_alert", {"alert": alert.to_dict(), "seq": seq}, target_devices,
+                node_filter=lambda summary: self._node_may_receive_alert(summary, alert)
+            )
+        return await self._deliver_threat_alert(alert, target_devices, seq)
+    
+    async def _deliver_threat_alert_payload(self, payload: Dict[str, Any], target_devices: Optional[List[str]]):
+        seq = payload.get("seq")
+        if seq is not None and self.alert_log:
+            # Logged by the sending node; keep it for replays from this one
+            self.alert_log.remember(seq, payload["alert"], target_devices)
+        return await self._deliver_threat_alert(ThreatAlert.from_dict(payload["alert"]), target_devices, seq)
+    
+    async def _deliver_threat_alert(self, alert: ThreatAlert, target_devices: Optional[List[str]] = None,
+                                    seq: Optional[int] = None):
+        """Send threat alert to devices connected to this node"""
         # Determine target connections
         target_connections = []
         
@@ -234,29 +395,106 @@ class WebSocketManager:
                         target_connections.append(self.active_connections[connection_id])
         else:
             # Send to all matching connections
-            for connection in self.active_connections.values():
-                if self._should_receive_alert(connection, alert):
-                    target_connections.append(connection)
-        
-        # Send alerts
-        sent_count = 0
-        for connection in target_connections:
-            try:
-                message.device_id = connection.device_id
-                await self._send_message(connection.websocket, message)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send alert to device {connection.device_id}: {e}")
-                # Remove failed connection
-                asyncio.create_task(self.disconnect(
-                    next(cid for cid, conn in self.active_connections.items() if conn == connection)
-                ))
-        
+            target_connections = [
+                self.active_connections[connection_id]
+                for connection_id in self.subscription_index.match(
+                    alert.alert_type.value, SEVERITY_SCORES[alert.severity], alert.affected_regions
+                )
+            ]
+        
+        fanout_start = time.perf_counter()
+        if self.coalescer.enabled and alert.severity is AlertSeverity.CRITICAL:
+            # Goes out alone and first; only its recipients' pending alerts leave the window
+            frame = Frame(self._alert_message(seq, alert.to_dict()), self.compress_min_bytes)
+            sent_count = 0
+            for connection in target_connections:
+                sent_count += self._send_frame(connection, frame, PRIORITY_HIGH)
+            pending = self.coalescer.take(connection.connection_id for connection in target_connections)
+            if pending:
+                # Let the writers pick up the critical frame before queueing the batches behind it
+                await asyncio.sleep(0)
+                self._deliver_alert_batches(pending)
+        elif self.coalescer.enabled:
+            # Batched with the rest of the window's alerts
+            sent_count = self.coalescer.add(
+                (seq, alert.to_dict()), [connection.connection_id for connection in target_connections]
+            )
+        else:
+            # Queue alerts (writers deliver them)
+            priority = PRIORITY_HIGH if alert.severity in [AlertSeverity.HIGH, AlertSeverity.CRITICAL] else PRIORITY_NORMAL
+            sent_count = 0
+            frame = Frame(self._alert_message(seq, alert.to_dict()), self.compress_min_bytes)
+            for connection in target_connections:
+                sent_count += self._send_frame(connection, frame, priority)
+        
+        fanout_duration = time.perf_counter() - fanout_start
+        metrics.WS_FANOUT_DURATION.labels("threat_alert").observe(fanout_duration)
+        traffic_capture.record_ws(
+            "fanout", kind="threat_alert", alert_type=alert.alert_type.value, severity=alert.severity.value,
+            targeted=bool(target_devices), n=sent_count, l=round(fanout_duration * 1000, 3)
+        )
         logger.info(f"Sent threat alert {alert.alert_id} to {sent_count} devices")
         return sent_count
     
+    @staticmethod
+    def _alert_message(seq: Optional[int], alert: Dict[str, Any]) -> WebSocketMessage:
+        data = {
+            "alert": alert,
+            "priority": "high" if alert["severity"] in ("high", "critical") else "normal"
+        }
+        if seq is not None:
+            data["seq"] = seq
+        return WebSocketMessage(
+            # Logged alerts are acknowledged by their log seq
+            message_id=str(seq) if seq is not None else str(uuid.uuid4()),
+            message_type="threat_alert",
+            timestamp=datetime.utcnow().isoformat(),
+            data=data
+        )
+    
+    def _deliver_alert_batches(self, groups: List[Tuple[List[PendingAlert], List[int]]]):
+        """Send each group of connections its coalesced alerts in one frame
+
+        A single alert goes out as a plain threat_alert; several as a
+        threat_alert_batch with their indicators merged.
+        """
+        for alerts, connection_ids in groups:
+            high = any(alert["severity"] in ("high", "critical") for _, alert in alerts)
+            if len(alerts) == 1:
+                message = self._alert_message(*alerts[0])
+            else:
+                kept, indicators = merge_alerts(alerts)
+                seqs = [seq for seq, _ in alerts]
+                message = WebSocketMessage(
+                    # Acknowledging the batch acknowledges every logged alert in it
+                    message_id=str(max(seqs)) if None not in seqs else str(uuid.uuid4()),
+                    message_type="threat_alert_batch",
+                    timestamp=datetime.utcnow().isoformat(),
+                    data={
+                        "alerts": [{"seq": seq, "alert": alert} for seq, alert in kept],
+                        "indicators": indicators,
+                        "coalesced": len(alerts),
+                        "priority": "high" if high else "normal"
+                    }
+                )
+            frame = Frame(message, self.compress_min_bytes)
+            priority = PRIORITY_HIGH if high else PRIORITY_NORMAL
+            for connection_id in connection_ids:
+                connection = self.active_connections.get(connection_id)
+                if connection:
+                    self._send_frame(connection, frame, priority)
+    
     async def send_security_update(self, update_data: Dict[str, Any], target_devices: List[str] = None):
-        """Send security update notification"""
+        """Send security update notification (on every node, if clustered)"""
+        if self.cluster:
+            return await self.cluster.fanout("security_update", {"update": update_data}, target_devices)
+        return await self._deliver_security_update(update_data, target_devices)
+    
+    async def _deliver_security_update_payload(self, payload: Dict[str, Any], target_devices: Optional[List[str]]):
+        return await self._deliver_security_update(payload["update"], target_devices)
+    
+    async def _deliver_security_update(self, update_data: Dict[str, Any], target_devices: Optional[List[str]] = None):
+        """Send security update to devices connected to this node"""
         message = WebSocketMessage(
             message_id=str(uuid.uuid4()),
             message_type="security_update",
@@ -276,26 +514,30 @@ class WebSocketManager:
         else:
             target_connections = list(self.active_connections.values())
         
+        fanout_start = time.perf_counter()
+        frame = Frame(message, self.compress_min_bytes)
         for connection in target_connections:
-            try:
-                message.device_id = connection.device_id
-                await self._send_message(connection.websocket, message)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send update to device {connection.device_id}: {e}")
+            sent_count += self._send_frame(connection, frame)
         
+        fanout_duration = time.perf_counter() - fanout_start
+        metrics.WS_FANOUT_DURATION.labels("security_update").observe(fanout_duration)
+        traffic_capture.record_ws(
+            "fanout", kind="security_update", targeted=bool(target_devices),
+            n=sent_count, l=round(fanout_duration * 1000, 3)
+        )
         return sent_count
     
-    async def handle_client_message(self, connection_id: str, message_data: dict):
+    async def handle_client_message(self, connection_id: int, message_data: dict):
         """Handle incoming message from client"""
         if connection_id not in self.active_connections:
             return
             
         connection = self.active_connections[connection_id]
         message_type = message_data.get("type")
+        traffic_capture.record_ws("message", connection.device_id, type=message_type)
         
-        # Update last ping time
-        connection.last_ping = datetime.utcnow()
+        # Any client traffic counts as liveness; the timer reads it when it next fires
+        connection.last_seen = time.monotonic()
         
         if message_type == "ping":
             # Respond with pong
@@ -306,16 +548,22 @@ class WebSocketManager:
                 device_id=connection.device_id,
                 data={"server_time": datetime.utcnow().isoformat()}
             )
-            await self._send_message(connection.websocket, pong_msg)
+            self._send_message(connection, pong_msg)
             
         elif message_type == "subscribe":
             # Update subscriptions
-            new_subscriptions = set(message_data.get("threat_types", []))
-            connection.subscriptions.update(new_subscriptions)
+            new_subscriptions = self.subscription_index.types.mask(message_data.get("threat_types", []))
+            connection.subscriptions |= new_subscriptions
             
             # Update risk threshold if provided
             if "risk_threshold" in message_data:
                 connection.risk_threshold = message_data["risk_threshold"]
+            if "compression" in message_data:
+                connection.accept_compressed = message_data["compression"] == "deflate"
+            self._index_connection(connection_id, connection)
+            
+            if self.cluster:
+                await self._announce(connection)
             
             # Acknowledge subscription
             ack_msg = WebSocketMessage(
@@ -324,16 +572,25 @@ class WebSocketManager:
                 timestamp=datetime.utcnow().isoformat(),
                 device_id=connection.device_id,
                 data={
-                    "subscriptions": list(connection.subscriptions),
+                    "subscriptions": self.subscription_index.types.names(connection.subscriptions),
                     "risk_threshold": connection.risk_threshold
                 }
             )
-            await self._send_message(connection.websocket, ack_msg)
+            self._send_message(connection, ack_msg)
             
         elif message_type == "unsubscribe":
             # Remove subscriptions
-            remove_subscriptions = set(message_data.get("threat_types", []))
-            connection.subscriptions -= remove_subscriptions
+            remove_subscriptions = self.subscription_index.types.mask(message_data.get("threat_types", []))
+            connection.subscriptions &= ~remove_subscriptions
+            self._index_connection(connection_id, connection)
+            
+        elif message_type == "ack":
+            # Client processed every logged alert up to this message_id
+            if self.alert_log:
+                try:
+                    await self.alert_log.ack(connection.device_id, int(message_data.get("message_id")))
+                except (TypeError, ValueError):
+                    logger.warning(f"Invalid ack from {connection.device_id}: {message_data.get('message_id')!r}")
             
         elif message_type == "report_threat":
             # Handle threat report from client
@@ -343,7 +600,16 @@ class WebSocketManager:
             logger.warning(f"Unknown message type from {connection.device_id}: {message_type}")
     
     async def broadcast_system_message(self, message: str, message_type: str = "system_announcement"):
-        """Broadcast system message to all connected devices"""
+        """Broadcast system message to all connected devices (on every node, if clustered)"""
+        if self.cluster:
+            return await self.cluster.fanout("broadcast", {"message": message, "message_type": message_type})
+        return await self._deliver_broadcast(message, message_type)
+    
+    async def _deliver_broadcast_payload(self, payload: Dict[str, Any], target_devices: Optional[List[str]]):
+        return await self._deliver_broadcast(payload["message"], payload["message_type"])
+    
+    async def _deliver_broadcast(self, message: str, message_type: str):
+        """Broadcast system message to devices connected to this node"""
         broadcast_msg = WebSocketMessage(
             message_id=str(uuid.uuid4()),
             message_type=message_type,
@@ -355,82 +621,127 @@ class WebSocketManager:
         )
         
         sent_count = 0
-        failed_connections = []
+        fanout_start = time.perf_counter()
+        frame = Frame(broadcast_msg, self.compress_min_bytes)
         
-        for connection_id, connection in self.active_connections.items():
-            try:
-                broadcast_msg.device_id = connection.device_id
-                await self._send_message(connection.websocket, broadcast_msg)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to broadcast to {connection.device_id}: {e}")
-                failed_connections.append(connection_id)
+        # Iterate over a copy: a disconnect policy overflow can drop connections mid-loop
+        for connection in list(self.active_connections.values()):
+            sent_count += self._send_frame(connection, frame)
         
-        # Clean up failed connections
-        for connection_id in failed_connections:
-            asyncio.create_task(self.disconnect(connection_id))
+        fanout_duration = time.perf_counter() - fanout_start
+        metrics.WS_FANOUT_DURATION.labels(message_type).observe(fanout_duration)
+        traffic_capture.record_ws(
+            "fanout", kind=message_type, targeted=False, n=sent_count, l=round(fanout_duration * 1000, 3)
+        )
         
         logger.info(f"Broadcast message sent to {sent_count} devices")
         return sent_count
     
     def get_connection_stats(self) -> Dict[str, Any]:
         """Get connection statistics"""
-        now = datetime.utcnow()
-        active_count = len(self.active_connections)
-        
-        # Count by subscription type
-        subscription_counts = {}
-        stale_connections = 0
-        
-        for connection in self.active_connections.values():
-            # Count subscriptions
-            for subscription in connection.subscriptions:
-                subscription_counts[subscription] = subscription_counts.get(subscription, 0) + 1
-            
-            # Check for stale connections (no ping in 5 minutes)
-            if (now - connection.last_ping).total_seconds() > 300:
-                stale_connections += 1
-        
         return {
-            "total_connections": active_count,
-            "subscription_counts": subscription_counts,
-            "stale_connections": stale_connections,
-            "uptime_seconds": (now - datetime.utcnow()).total_seconds()
+            "total_connections": len(self.active_connections),
+            "subscription_counts": dict(self.subscription_index.type_counts),
+            "stale_connections": self.stale_connections,
+            "admission": self.admission.get_stats(),
+            "uptime_seconds": (datetime.utcnow() - self.started_at).total_seconds()
         }
     
-    async def _send_message(self, websocket: WebSocket, message: WebSocketMessage):
-        """Send message to WebSocket connection"""
+    def cluster_summary(self) -> Dict[str, Any]:
+        """What this node's connections can receive, published for cross-node targeting"""
+        return self.subscription_index.summary()
+    
+    def _index_connection(self, connection_id: int, connection: ConnectionInfo):
+        self.subscription_index.add(
+            connection_id, connection.subscriptions, connection.regions, connection.risk_threshold
+        )
+    
+    async def _announce(self, connection: ConnectionInfo):
+        await self.cluster.device_online(
+            connection.device_id, self.subscription_index.types.names(connection.subscriptions),
+            self.subscription_index.regions.names(connection.regions), connection.risk_threshold
+        )
+    
+    def _wants_alert(self, connection: ConnectionInfo, alert: Dict[str, Any]) -> bool:
+        """The subscription index's matching rule, for one connection and a logged alert"""
+        index = self.subscription_index
+        type_bit = index.types.bit(alert["alert_type"])
+        if type_bit is None or not connection.subscriptions >> type_bit & 1:
+            return False
+        if SEVERITY_SCORES[AlertSeverity(alert["severity"])] < connection.risk_threshold:
+            return False
+        if alert["affected_regions"] and connection.regions:
+            region_bits = (index.regions.bit(region) for region in alert["affected_regions"])
+            return any(bit is not None and connection.regions >> bit & 1 for bit in region_bits)
+        return True
+    
+    async def _replay_missed_alerts(self, connection: ConnectionInfo, last_message_id: Optional[str]):
+        """Send the logged alerts a reconnecting device missed, as one alert_replay frame"""
+        device_id = connection.device_id
         try:
-            await websocket.send_text(message.to_json())
+            if last_message_id is not None:
+                await self.alert_log.ack(device_id, int(last_message_id))
+            # The stored cursor is held below alerts that committed late; the client's own id is not
+            cursor = await self.alert_log.cursor(device_id)
+            if cursor is not None and last_message_id is not None:
+                cursor = min(cursor, int(last_message_id))
+            if cursor is None:
+                return  # never acknowledged anything: nothing to catch up on
+            
+            entries = [
+                entry for entry in await self.alert_log.missed(cursor)
+                if (device_id in entry.targets if entry.targets is not None else self._wants_alert(connection, entry.alert))
+            ][-self.alert_log.config.max_replay:]
+            if not entries:
+                return
+            if connection.outbox.put(self._replay_frame(device_id, entries), "alert_replay", PRIORITY_NORMAL):
+                metrics.WS_REPLAYED_ALERTS.inc(len(entries))
+                traffic_capture.record_ws("replay", device_id, n=len(entries))
         except Exception as e:
-            logger.error(f"Failed to send WebSocket message: {e}")
-            raise
+            logger.error(f"Failed to replay missed alerts to {device_id}: {e}")
+    
+    @staticmethod
+    def _replay_frame(device_id: str, entries: List[LogEntry]) -> str:
+        """WebSocketMessage JSON around the entries' pre-encoded alerts"""
+        envelope = WebSocketMessage(
+            message_id=str(uuid.uuid4()),
+            message_type="alert_replay",
+            timestamp=datetime.utcnow().isoformat(),
+            device_id=device_id,
+            data={"cursor": entries[-1].seq, "alerts": []}
+        ).to_json()
+        head, tail = envelope.split('"alerts": []', 1)
+        return f'{head}"alerts": [{", ".join(entry.text for entry in entries)}]{tail}'
     
-    def _should_receive_alert(self, connection: ConnectionInfo, alert: ThreatAlert) -> bool:
-        """Determine if connection should receive this alert"""
-        # Check threat type subscription
-        if alert.alert_type.value not in connection.subscriptions:
+    @staticmethod
+    def _node_may_receive_alert(summary: Dict[str, Any], alert: ThreatAlert) -> bool:
+        """Whether any connection described by a node summary can match the alert"""
+        if alert.alert_type.value not in summary["types"]:
             return False
-        
-        # Check risk threshold
-        # For alerts, we don't have a direct risk score, so we use severity
-        severity_scores = {
-            AlertSeverity.LOW: 25,
-            AlertSeverity.MEDIUM: 50,
-            AlertSeverity.HIGH: 75,
-            AlertSeverity.CRITICAL: 95
-        }
-        
-        if severity_scores.get(alert.severity, 0) < connection.risk_threshold:
+        if SEVERITY_SCORES[alert.severity] < summary["min_threshold"]:
             return False
-        
-        # Check geographic relevance
-        if alert.affected_regions and connection.geographic_regions:
-            if not set(alert.affected_regions) & set(connection.geographic_regions):
-                return False
-        
+        if alert.affected_regions and not summary["any_region"]:
+            return bool(set(alert.affected_regions) & set(summary["regions"]))
         return True
     
+    def _send_message(self, connection: ConnectionInfo, message: WebSocketMessage,
+                      priority: int = PRIORITY_NORMAL, key: Optional[str] = None) -> bool:
+        """Queue message on the connection's outbox; False if it was dropped"""
+        return connection.outbox.put(message.to_json(), message.message_type, priority, key)
+    
+    def _send_frame(self, connection: ConnectionInfo, frame: Frame,
+                    priority: int = PRIORITY_NORMAL, key: Optional[str] = None) -> bool:
+        """Queue a shared fan-out frame; nothing is serialized per recipient"""
+        return connection.outbox.put(frame.payload(connection.accept_compressed), frame.message_type, priority, key)
+    
+    def _on_send_failure(self, connection_id: int, reason: str):
+        """Outbox gave up on a slow or broken client"""
+        connection = self.active_connections.get(connection_id)
+        if connection:
+            logger.warning(f"Closing slow WebSocket consumer {connection.device_id}: {reason}")
+        # 1013 (try again later): the client reconnects and resyncs
+        asyncio.create_task(self.disconnect(connection_id, code=1013, reason=reason))
+    
     async def _handle_threat_report(self, connection: ConnectionInfo, report_data: Dict[str, Any]):
         """Handle threat report from client"""
         try:
@@ -454,74 +765,80 @@ class WebSocketManager:
                 data={"report_id": report_id}
             )
             
-            await self._send_message(connection.websocket, ack_msg)
+            self._send_message(connection, ack_msg)
             logger.info(f"Threat report received from {connection.device_id}: {report_id}")
             
         except Exception as e:
             logger.error(f"Failed to handle threat report: {e}")
     
-    async def _cleanup_stale_connections(self):
-        """Background task to clean up stale connections"""
+    async def _liveness_loop(self):
+        """Background task firing per-connection ping and expiry timers"""
+        tick = self.liveness.config.tick
         while True:
             try:
-                await asyncio.sleep(60)  # Run every minute
-                
-                now = datetime.utcnow()
-                stale_connections = []
-                
-                for connection_id, connection in self.active_connections.items():
-                    # Consider connection stale if no ping in 5 minutes
-                    if (now - connection.last_ping).total_seconds() > 300:
-                        stale_connections.append(connection_id)
-                
-                # Disconnect stale connections
-                for connection_id in stale_connections:
-                    logger.info(f"Cleaning up stale connection: {connection_id}")
-                    await self.disconnect(connection_id)
-                    
+                await asyncio.sleep(tick)
+                self._liveness_tick(time.monotonic())
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Error in cleanup task: {e}")
+                logger.error(f"Error in liveness task: {e}")
     
-    async def _heartbeat_monitor(self):
-        """Background task to send heartbeat pings"""
-        while True:
-            try:
-                await asyncio.sleep(30)  # Send heartbeat every 30 seconds
-                
-                ping_msg = WebSocketMessage(
-                    message_id=str(uuid.uuid4()),
-                    message_type="server_ping",
-                    timestamp=datetime.utcnow().isoformat(),
-                    data={"server_time": datetime.utcnow().isoformat()}
-                )
-                
-                failed_connections = []
-                
-                for connection_id, connection in self.active_connections.items():
-                    try:
-                        ping_msg.device_id = connection.device_id
-                        await self._send_message(connection.websocket, ping_msg)
-                    except Exception as e:
-                        logger.warning(f"Heartbeat failed for {connection.device_id}: {e}")
-                        failed_connections.append(connection_id)
-                
-                # Clean up failed connections
-                for connection_id in failed_connections:
-                    asyncio.create_task(self.disconnect(connection_id))
-                    
-            except Exception as e:
-                logger.error(f"Error in heartbeat monitor: {e}")
+    def _liveness_tick(self, now: float):
+        """Expire or ping the connections whose timer is due"""
+        due = self.liveness.due(now)
+        if due:
+            config = self.liveness.config
+            reschedule = self.liveness.reschedule
+            ping_frame = None
+            failed = 0
+            for connection_id in due:
+                connection = self.active_connections.get(connection_id)
+                if connection is None:
+                    continue
+                if now - connection.last_seen >= config.idle_timeout:
+                    logger.info(f"Closing idle connection: {connection_id}")
+                    self._expired_in_window += 1
+                    metrics.WS_IDLE_DISCONNECTS.inc()
+                    asyncio.create_task(self.disconnect(connection_id, reason="idle"))
+                    continue
+                if config.ping_interval > 0:
+                    if ping_frame is None:
+                        ping_frame = Frame(WebSocketMessage(
+                            message_id=str(uuid.uuid4()),
+                            message_type="server_ping",
+                            timestamp=datetime.utcnow().isoformat(),
+                            data={"server_time": datetime.utcnow().isoformat()}
+                        ), self.compress_min_bytes)
+                    # Queued pings coalesce, so a backed-up client holds at most one
+                    if not self._send_frame(connection, ping_frame, PRIORITY_LOW, key="server_ping"):
+                        failed += 1
+                depth = connection.outbox.depth
+                self._queued_in_window += depth
+                if depth > self._deepest_in_window:
+                    self._deepest_in_window = depth
+                reschedule(connection_id, connection.last_seen, now)
+            metrics.WS_HEARTBEAT_FAILURES.inc(failed)
+        
+        # Each connection's timer fires about once per interval, so the
+        # connections visited in one interval make up a full outbox sample
+        if now - self._window_start >= (self.liveness.config.ping_interval or self.liveness.config.idle_timeout):
+            metrics.WS_OUTBOX_DEPTH.set(self._queued_in_window)
+            metrics.WS_OUTBOX_MAX_DEPTH.set(self._deepest_in_window)
+            self.stale_connections = self._expired_in_window
+            self._window_start = now
+            self._queued_in_window = self._deepest_in_window = self._expired_in_window = 0
 
 # Global WebSocket manager instance
 ws_manager: Optional[WebSocketManager] = None
 
-def get_websocket_manager() -> WebSocketManager:
-    """Get global WebSocket manager instance"""
+def get_websocket_manager(token_verifier: TokenVerifier, db_manager, redis_client: redis.Redis) -> WebSocketManager:
+    """Get global WebSocket manager instance, sharing the API's verifier, database and Redis"""
     global ws_manager
     if ws_manager is None:
-        # Initialize with Redis connection
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-        ws_manager = WebSocketManager(redis_client)
+        alert_log = None
+        if os.getenv("ALERT_REPLAY_ENABLED", "true").lower() == "true":
+            alert_log = AlertLog(db_manager)
+        ws_manager = WebSocketManager(redis_client, token_verifier, alert_log=alert_log)
     return ws_manager
 
 # Helper functions for creating common alerts
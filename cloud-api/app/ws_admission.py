@@ -0,0 +1,119 @@
+"""
+PocketShield WebSocket Admission Control
+Accept-rate and connection-cap limits for new WebSocket sessions
+
+After a deploy or a network blip every device reconnects at once. New
+sessions are admitted through a token bucket (``rate`` per second, bursts of
+``burst``) before any authentication or setup work is done. A session that
+would wait longer than ``max_wait`` for a token, or that arrives while the pod
+holds ``max_connections``, is closed with code 1013 (Try Again Later) and a
+``retry_after=<seconds>`` reason.
+
+Rejected clients are handed reconnect slots spaced ``1 / rate`` apart past the
+backlog (plus jitter), so a mass reconnect comes back spread at the rate the
+pod can admit instead of in lockstep.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+
+from app import metrics
+from app.admission import LoadShed
+
+logger = logging.getLogger(__name__)
+
+# RFC 6455 "Try Again Later"
+RETRY_CLOSE_CODE = 1013
+
+
+@dataclass
+class WSAdmissionConfig:
+    rate: float = 500.0  # sessions admitted per second (0 disables admission control)
+    burst: int = 500
+    max_connections: int = 20000  # per pod
+    max_wait: float = 2.0  # seconds a session may be held for a token before it is told to retry
+    max_retry_after: float = 120.0
+    full_retry_after: float = 30.0  # mean hint when the pod is full (jittered +-50%)
+
+    @classmethod
+    def from_env(cls) -> "WSAdmissionConfig":
+        return cls(
+            rate=float(os.getenv("WS_ADMIT_RATE", "500")),
+            burst=int(os.getenv("WS_ADMIT_BURST", "500")),
+            max_connections=int(os.getenv("WS_MAX_CONNECTIONS", "20000")),
+            max_wait=float(os.getenv("WS_ADMIT_MAX_WAIT", "2.0")),
+            max_retry_after=float(os.getenv("WS_RETRY_AFTER_MAX", "120")),
+            full_retry_after=float(os.getenv("WS_FULL_RETRY_AFTER", "30")),
+        )
+
+
+class ConnectionAdmission:
+    """Token bucket and connection cap for one pod's WebSocket sessions"""
+
+    def __init__(self, config: WSAdmissionConfig):
+        self.config = config
+        self.tokens = float(config.burst)
+        self._updated = time.monotonic()
+        self._retry_horizon = 0.0  # monotonic time of the last reconnect slot handed out
+
+        self.admitted = 0
+        self.deferred = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.rate > 0
+
+    async def admit(self, open_connections: int):
+        """Wait for a token or raise LoadShed("rate" | "full", retry_after)"""
+        if not self.enabled:
+            return
+        config = self.config
+        if open_connections >= config.max_connections:
+            self._reject("full")
+            raise LoadShed("full", config.full_retry_after * random.uniform(0.5, 1.5))
+
+        # Take a token, possibly one that only refills in the future
+        now = time.monotonic()
+        self.tokens = min(config.burst, self.tokens + (now - self._updated) * config.rate)
+        self._updated = now
+        self.tokens -= 1
+        wait = -self.tokens / config.rate if self.tokens < 0 else 0.0
+        if wait > config.max_wait:
+            self.tokens += 1
+            self._reject("rate")
+            raise LoadShed("rate", self._retry_slot(now))
+
+        self.admitted += 1
+        if wait > 0:
+            self.deferred += 1
+            metrics.WS_ADMISSION_DEFERRED.observe(wait)
+            await asyncio.sleep(wait)
+
+    def _retry_slot(self, now: float) -> float:
+        """Next free reconnect slot, past the current backlog, with jitter"""
+        config = self.config
+        interval = 1.0 / config.rate
+        slot = max(self._retry_horizon, now + config.max_wait) + interval
+        if slot - now > config.max_retry_after:
+            # Past the cap slots are not tracked; spread over its second half
+            return random.uniform(config.max_retry_after / 2, config.max_retry_after)
+        self._retry_horizon = slot
+        return slot - now + random.uniform(0, interval * 10)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        metrics.WS_ADMISSION_REJECTED.labels(reason).inc()
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tokens": round(max(self.tokens, 0.0), 1),
+            "admitted": self.admitted,
+            "deferred": self.deferred,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,316 @@
+"""
+PocketShield WebSocket Cluster
+Presence registry and node-addressed pub/sub for cross-pod alert delivery
+
+Every API worker is a node with its own Redis channel (``ws_node:<node_id>``).
+Nodes record which devices they hold in ``ws_presence:<device_id>`` (a hash of
+node_id -> expiry, so a node only ever removes its own entry) and publish a
+summary of their subscriptions in ``ws_nodes``. Both are refreshed in pipelined
+batches, and presence changes from connections opening or closing together
+(e.g. a reconnect storm) share one pipeline.
+
+An alert for specific devices goes only to the nodes holding them; an alert
+for everyone matching a filter goes only to nodes whose summary can match.
+Each node delivers locally and acks its delivery count to the sender, which
+returns the cluster-wide total.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+import redis.asyncio as redis
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+NODES_KEY = "ws_nodes"
+PRESENCE_BATCH = 500
+
+# kind -> coroutine(payload, device_ids or None) returning the local delivery count
+DeliveryHandler = Callable[[Dict[str, Any], Optional[List[str]]], Awaitable[int]]
+
+
+def node_channel(node_id: str) -> str:
+    return f"ws_node:{node_id}"
+
+
+def presence_key(device_id: str) -> str:
+    return f"ws_presence:{device_id}"
+
+
+def default_node_id() -> str:
+    return os.getenv("WS_NODE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WebSocketCluster:
+    """Cross-node delivery for one WebSocketManager"""
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        summary: Callable[[], Dict[str, Any]],
+        node_id: Optional[str] = None,
+        presence_ttl: float = 90.0,
+        refresh_interval: float = 30.0,
+        ack_timeout: float = 2.0,
+    ):
+        self.redis = redis_client
+        self.summary = summary  # local subscription summary, see WebSocketManager.cluster_summary
+        self.node_id = node_id or default_node_id()
+        self.presence_ttl = presence_ttl
+        self.refresh_interval = refresh_interval
+        self.ack_timeout = ack_timeout
+
+        self.handlers: Dict[str, DeliveryHandler] = {}
+        self.devices: Set[str] = set()  # devices connected to this node
+        self._published_summary: Dict[str, Any] = {}
+        self._presence_updates: Dict[str, bool] = {}  # device_id -> online, waiting for the next pipeline
+        self._presence_flush: Optional[asyncio.Future] = None
+        self._publish_pending = False
+        self._pending: Dict[str, Dict[str, Any]] = {}  # fan-out id -> {"waiting", "sent", "done"}
+        self._pubsub = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._listen_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, redis_client: redis.Redis, summary: Callable[[], Dict[str, Any]]) -> "WebSocketCluster":
+        return cls(
+            redis_client,
+            summary,
+            presence_ttl=float(os.getenv("WS_PRESENCE_TTL", "90")),
+            refresh_interval=float(os.getenv("WS_PRESENCE_REFRESH_INTERVAL", "30")),
+            ack_timeout=float(os.getenv("WS_CLUSTER_ACK_TIMEOUT", "2.0")),
+        )
+
+    def on(self, kind: str, handler: DeliveryHandler):
+        self.handlers[kind] = handler
+
+    async def start(self):
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(node_channel(self.node_id))
+        await self.refresh()
+        self._listen_task = asyncio.create_task(self._listen())
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        logger.info(f"WebSocket cluster node {self.node_id} started")
+
+    async def stop(self):
+        for task in (self._listen_task, self._refresh_task):
+            if task:
+                task.cancel()
+        try:
+            await self.redis.hdel(NODES_KEY, self.node_id)
+            await self._pubsub.unsubscribe()
+            await self._pubsub.close()
+        except Exception as e:
+            logger.warning(f"WebSocket cluster shutdown incomplete: {e}")
+
+    # Presence
+    async def device_online(self, device_id: str, subscriptions: Iterable[str], regions: Iterable[str],
+                            risk_threshold: int):
+        self.devices.add(device_id)
+        # Publish the summary with the presence batch if this connection widens what the node can match
+        published = self._published_summary
+        if (
+            not set(subscriptions) <= set(published.get("types", ()))
+            or not set(regions) <= set(published.get("regions", ()))
+            or (not regions and not published.get("any_region"))
+            or risk_threshold < published.get("min_threshold", 101)
+        ):
+            self._publish_pending = True
+        await self._update_presence(device_id, True)
+
+    async def device_offline(self, device_id: str):
+        self.devices.discard(device_id)
+        await self._update_presence(device_id, False)
+
+    async def _update_presence(self, device_id: str, online: bool):
+        """Queue a presence change and wait for the pipeline that writes it"""
+        self._presence_updates[device_id] = online
+        if self._presence_flush is None:
+            self._presence_flush = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._flush_presence())
+        await asyncio.shield(self._presence_flush)
+
+    async def _flush_presence(self):
+        updates, self._presence_updates = self._presence_updates, {}
+        flushed, self._presence_flush = self._presence_flush, None
+        publish, self._publish_pending = self._publish_pending, False
+        try:
+            expires_at = time.time() + self.presence_ttl
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for device_id, online in updates.items():
+                    if online:
+                        pipe.hset(presence_key(device_id), self.node_id, expires_at)
+                        pipe.expire(presence_key(device_id), int(self.presence_ttl))
+                    else:
+                        pipe.hdel(presence_key(device_id), self.node_id)
+                if publish:
+                    summary = {**self.summary(), "at": time.time()}
+                    pipe.hset(NODES_KEY, self.node_id, json.dumps(summary))
+                await pipe.execute()
+            if publish:
+                self._published_summary = summary
+            flushed.set_result(None)
+        except Exception as e:
+            self._publish_pending |= publish
+            flushed.set_exception(e)
+            flushed.exception()  # Mark retrieved when nobody else was waiting
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.refresh_interval)
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket presence refresh failed: {e}")
+
+    async def refresh(self):
+        """Extend presence of every local device, publish our summary and reload the node list"""
+        expires_at = time.time() + self.presence_ttl
+        devices = list(self.devices)
+        for i in range(0, len(devices), PRESENCE_BATCH):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for device_id in devices[i:i + PRESENCE_BATCH]:
+                    pipe.hset(presence_key(device_id), self.node_id, expires_at)
+                    pipe.expire(presence_key(device_id), int(self.presence_ttl))
+                await pipe.execute()
+        await self._publish_summary()
+        metrics.WS_CLUSTER_NODES.set(len(await self.live_nodes()))
+
+    async def live_nodes(self) -> Dict[str, Dict[str, Any]]:
+        """node_id -> published summary, pruning nodes that stopped refreshing"""
+        nodes, dead = {}, []
+        for node_id, raw in (await self.redis.hgetall(NODES_KEY)).items():
+            node_id = node_id.decode() if isinstance(node_id, bytes) else node_id
+            summary = json.loads(raw)
+            if summary["at"] + self.presence_ttl < time.time():
+                dead.append(node_id)
+            else:
+                nodes[node_id] = summary
+        if dead:
+            await self.redis.hdel(NODES_KEY, *dead)
+        return nodes
+
+    async def _publish_summary(self):
+        summary = {**self.summary(), "at": time.time()}
+        await self.redis.hset(NODES_KEY, self.node_id, json.dumps(summary))
+        self._published_summary = summary
+
+    async def locate(self, device_ids: List[str]) -> Dict[str, List[str]]:
+        """node_id -> the given devices it currently holds"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for device_id in device_ids:
+                pipe.hgetall(presence_key(device_id))
+            rows = await pipe.execute()
+        now = time.time()
+        by_node: Dict[str, List[str]] = {}
+        for device_id, entries in zip(device_ids, rows):
+            for node_id, expires_at in entries.items():
+                if float(expires_at) > now:
+                    node_id = node_id.decode() if isinstance(node_id, bytes) else node_id
+                    by_node.setdefault(node_id, []).append(device_id)
+        return by_node
+
+    # Delivery
+    async def fanout(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        device_ids: Optional[List[str]] = None,
+        node_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> int:
+        """Deliver on every node that may hold a recipient; returns the cluster-wide count
+
+        ``device_ids`` targets specific devices through the presence registry;
+        otherwise ``node_filter`` picks nodes by their published summary.
+        """
+        if device_ids:
+            targets: Dict[str, Optional[List[str]]] = dict(await self.locate(device_ids))
+        else:
+            targets = {
+                node_id: None for node_id, summary in (await self.live_nodes()).items()
+                if summary.get("connections") and (node_filter is None or node_filter(summary))
+            }
+            targets[self.node_id] = None  # the local summary may be newer than the published one
+
+        # Local recipients are served directly, alongside the remote nodes
+        local = None
+        if self.node_id in targets:
+            local = asyncio.create_task(self.handlers[kind](payload, targets.pop(self.node_id)))
+
+        fanout_id = uuid.uuid4().hex
+        pending = None
+        if targets:
+            pending = {"waiting": set(targets), "sent": 0, "done": asyncio.Event()}
+            self._pending[fanout_id] = pending
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for node_id, devices in targets.items():
+                    pipe.publish(node_channel(node_id), json.dumps({
+                        "type": "deliver", "id": fanout_id, "kind": kind, "payload": payload,
+                        "devices": devices, "reply_to": self.node_id,
+                    }))
+                receivers = await pipe.execute()
+            metrics.WS_CLUSTER_MESSAGES.labels("published", kind).inc(len(targets))
+            # A node with no subscriber on its channel is gone; don't wait for it
+            for node_id, count in zip(list(targets), receivers):
+                if not count:
+                    pending["waiting"].discard(node_id)
+
+        sent = await local if local else 0
+        if pending:
+            try:
+                if pending["waiting"]:
+                    await asyncio.wait_for(pending["done"].wait(), self.ack_timeout)
+            except asyncio.TimeoutError:
+                metrics.WS_CLUSTER_ACK_TIMEOUTS.inc(len(pending["waiting"]))
+                logger.warning(f"No delivery ack for {kind} from nodes {sorted(pending['waiting'])}")
+            finally:
+                del self._pending[fanout_id]
+            sent += pending["sent"]
+        return sent
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message:
+                    self._dispatch(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket cluster listener error: {e}")
+                await asyncio.sleep(1)
+
+    def _dispatch(self, envelope: Dict[str, Any]):
+        if envelope["type"] == "ack":
+            pending = self._pending.get(envelope["id"])
+            if pending and envelope["node"] in pending["waiting"]:
+                pending["waiting"].discard(envelope["node"])
+                pending["sent"] += envelope["sent"]
+                if not pending["waiting"]:
+                    pending["done"].set()
+        elif envelope["type"] == "deliver":
+            metrics.WS_CLUSTER_MESSAGES.labels("received", envelope["kind"]).inc()
+            task = asyncio.create_task(self._deliver(envelope))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, envelope: Dict[str, Any]):
+        sent = 0
+        try:
+            sent = await self.handlers[envelope["kind"]](envelope["payload"], envelope["devices"])
+        except Exception as e:
+            logger.error(f"Cluster delivery of {envelope['kind']} failed: {e}")
+        await self.redis.publish(node_channel(envelope["reply_to"]), json.dumps({
+            "type": "ack", "id": envelope["id"], "node": self.node_id, "sent": sent,
+        }))
@@ -0,0 +1,127 @@
+"""
+PocketShield WebSocket Alert Coalescing
+Buffers non-critical alerts for a short window and delivers them as one batch
+
+During a campaign hundreds of alerts can go out within minutes, and each used
+to be its own frame (and, on mobile, its own radio wake-up) on every device.
+Alerts are instead collected for ``window`` seconds; each connection then gets
+one threat_alert_batch frame with the alerts it would have received and their
+indicators merged and de-duplicated. Connections that received the same alerts
+share one encoded frame. A critical alert does not wait: it goes out alone at
+once, and only its own recipients' pending alerts leave the window, queued
+right behind it; every other device keeps batching.
+"""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from app import metrics
+from app.ws_index import iter_bits
+
+logger = logging.getLogger(__name__)
+
+# (logged seq or None, ThreatAlert.to_dict())
+PendingAlert = Tuple[Optional[int], Dict[str, Any]]
+
+
+@dataclass
+class CoalesceConfig:
+    window: float = 5.0  # seconds non-critical alerts wait to be batched; 0 disables
+    max_alerts: int = 64  # a window holding this many alerts is flushed early
+
+    @classmethod
+    def from_env(cls) -> "CoalesceConfig":
+        return cls(
+            window=float(os.getenv("WS_COALESCE_WINDOW", "5.0")),
+            max_alerts=int(os.getenv("WS_COALESCE_MAX_ALERTS", "64")),
+        )
+
+
+def merge_alerts(alerts: List[PendingAlert]) -> Tuple[List[PendingAlert], Dict[str, List[str]]]:
+    """Drop alerts whose indicators were all seen earlier in the batch; merge the rest's indicators
+
+    Critical alerts and alerts without indicators are always kept.
+    """
+    kept: List[PendingAlert] = []
+    seen: Dict[str, Dict[str, None]] = {}  # kind -> indicators in first-seen order
+    for seq, alert in alerts:
+        new = False
+        for kind, values in alert["indicators"].items():
+            known = seen.setdefault(kind, {})
+            for value in values:
+                if value not in known:
+                    known[value] = None
+                    new = True
+        if new or alert["severity"] == "critical" or not any(alert["indicators"].values()):
+            kept.append((seq, alert))
+    return kept, {kind: list(values) for kind, values in seen.items() if values}
+
+
+class AlertCoalescer:
+    """Window of pending alerts and, per connection, which of them it gets
+
+    ``on_flush(groups)`` receives ``(alerts, connection_ids)`` pairs: every
+    connection in a group gets the same batch.
+    """
+
+    def __init__(self, config: CoalesceConfig,
+                 on_flush: Callable[[List[Tuple[List[PendingAlert], List[Hashable]]]], None]):
+        self.config = config
+        self.on_flush = on_flush
+        self._alerts: List[PendingAlert] = []
+        self._recipients: Dict[Hashable, int] = {}  # connection_id -> mask over _alerts
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.window > 0
+
+    def add(self, alert: PendingAlert, connection_ids: Iterable[Hashable]) -> int:
+        """Buffer an alert for the given connections; returns how many were buffered"""
+        bit = 1 << len(self._alerts)
+        self._alerts.append(alert)
+        recipients = self._recipients
+        count = 0
+        for connection_id in connection_ids:
+            recipients[connection_id] = recipients.get(connection_id, 0) | bit
+            count += 1
+        if len(self._alerts) >= self.config.max_alerts:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.config.window, self.flush)
+        return count
+
+    def take(self, connection_ids: Iterable[Hashable]) -> List[Tuple[List[PendingAlert], List[Hashable]]]:
+        """Remove and return the pending alerts of just these connections, grouped as for on_flush"""
+        recipients = self._recipients
+        by_mask: Dict[int, List[Hashable]] = {}
+        for connection_id in connection_ids:
+            mask = recipients.pop(connection_id, 0)
+            if mask:
+                by_mask.setdefault(mask, []).append(connection_id)
+        metrics.WS_COALESCED_ALERTS.inc(sum(mask.bit_count() * len(ids) for mask, ids in by_mask.items()))
+        return [([self._alerts[i] for i in iter_bits(mask)], ids) for mask, ids in by_mask.items()]
+
+    def discard(self, connection_id: Hashable):
+        self._recipients.pop(connection_id, None)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        alerts, recipients = self._alerts, self._recipients
+        self._alerts, self._recipients = [], {}
+        if not recipients:
+            return
+
+        by_mask: Dict[int, List[Hashable]] = {}
+        for connection_id, mask in recipients.items():
+            by_mask.setdefault(mask, []).append(connection_id)
+        metrics.WS_COALESCED_ALERTS.inc(sum(mask.bit_count() for mask in recipients.values()))
+        try:
+            self.on_flush([([alerts[i] for i in iter_bits(mask)], ids) for mask, ids in by_mask.items()])
+        except Exception as e:
+            logger.error(f"Failed to deliver coalesced alerts: {e}")
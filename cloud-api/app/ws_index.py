@@ -0,0 +1,182 @@
+"""
+PocketShield WebSocket Subscription Index
+Inverted index from (alert type, region, severity bucket) to connections
+
+Maintained incrementally on connect, disconnect, subscribe and unsubscribe, so
+finding an alert's recipients costs in proportion to the recipients rather
+than to every open connection. The same events keep the counters behind
+connection statistics and the cluster summary.
+
+Alert types and regions are interned in a Vocabulary each, so a connection's
+subscriptions and regions are two int bitmasks rather than a set and a list.
+"""
+
+import logging
+from collections import Counter
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Connections with no regions of interest receive alerts for every region
+ANY_REGION = "*"
+_ANY_REGION_BIT = -1
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """Positions of the set bits in ``mask``, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Vocabulary:
+    """Interned names, each assigned a bit, so a set of names is one int mask
+
+    Names come from clients, so the vocabulary is capped; names past ``limit``
+    are ignored (no alert can carry them anyway).
+    """
+
+    __slots__ = ("limit", "_bits", "_names")
+
+    def __init__(self, names: Iterable[str] = (), limit: int = 256):
+        self.limit = limit
+        self._bits: Dict[str, int] = {}
+        self._names: List[str] = []
+        self.mask(names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def bit(self, name: str) -> Optional[int]:
+        """The bit for ``name`` if it has been interned"""
+        return self._bits.get(name)
+
+    def mask(self, names: Iterable[str]) -> int:
+        mask = 0
+        for name in names:
+            bit = self._bits.get(name)
+            if bit is None:
+                if len(self._names) >= self.limit:
+                    logger.warning(f"Vocabulary full ({self.limit} names); ignoring {name!r}")
+                    continue
+                bit = self._bits[name] = len(self._names)
+                self._names.append(name)
+            mask |= 1 << bit
+        return mask
+
+    def names(self, mask: int) -> List[str]:
+        return [self._names[bit] for bit in iter_bits(mask)]
+
+
+class SubscriptionIndex:
+    """Connections by alert type -> region -> lowest severity they accept
+
+    ``severity_scores`` are the alert severity scores in ascending order. A
+    connection with risk threshold ``t`` lands in the bucket of the lowest
+    score >= ``t``, and receives alerts whose score falls in that bucket or a
+    higher one (the same rule as comparing the score with the threshold).
+
+    Connections are indexed by masks over ``types`` and ``regions``; a
+    regions mask of 0 means every region.
+    """
+
+    def __init__(self, severity_scores: Iterable[int], alert_types: Iterable[str] = ()):
+        self.scores = sorted(severity_scores)
+        self.types = Vocabulary(alert_types)
+        self.regions = Vocabulary()
+        self._index: Dict[int, Dict[int, List[Set[Hashable]]]] = {}
+        self._entries: Dict[Hashable, Tuple[int, int, int]] = {}
+        self.type_counts: Counter = Counter()
+        self.region_counts: Counter = Counter()
+        self.threshold_counts: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bucket(self, risk_threshold: int) -> int:
+        for bucket, score in enumerate(self.scores):
+            if score >= risk_threshold:
+                return bucket
+        return len(self.scores)  # accepts no alert at all
+
+    def _region_bits(self, regions: int) -> List[int]:
+        return list(iter_bits(regions)) if regions else [_ANY_REGION_BIT]
+
+    def _region_names(self, regions: int) -> List[str]:
+        return self.regions.names(regions) if regions else [ANY_REGION]
+
+    def add(self, connection_id: Hashable, types: int, regions: int, risk_threshold: int):
+        if connection_id in self._entries:
+            self.remove(connection_id)
+        bucket = self._bucket(risk_threshold)
+        self._entries[connection_id] = (types, regions, risk_threshold)
+
+        if bucket < len(self.scores):
+            region_bits = self._region_bits(regions)
+            for type_bit in iter_bits(types):
+                by_region = self._index.setdefault(type_bit, {})
+                for region_bit in region_bits:
+                    buckets = by_region.get(region_bit)
+                    if buckets is None:
+                        buckets = by_region[region_bit] = [set() for _ in self.scores]
+                    buckets[bucket].add(connection_id)
+        self.type_counts.update(self.types.names(types))
+        self.region_counts.update(self._region_names(regions))
+        self.threshold_counts[risk_threshold] += 1
+
+    def remove(self, connection_id: Hashable):
+        entry = self._entries.pop(connection_id, None)
+        if entry is None:
+            return
+        types, regions, risk_threshold = entry
+        bucket = self._bucket(risk_threshold)
+
+        if bucket < len(self.scores):
+            region_bits = self._region_bits(regions)
+            for type_bit in iter_bits(types):
+                by_region = self._index[type_bit]
+                for region_bit in region_bits:
+                    buckets = by_region[region_bit]
+                    buckets[bucket].discard(connection_id)
+                    if not any(buckets):
+                        del by_region[region_bit]
+                if not by_region:
+                    del self._index[type_bit]
+        self.type_counts.subtract(self.types.names(types))
+        self.region_counts.subtract(self._region_names(regions))
+        self.threshold_counts[risk_threshold] -= 1
+        for counts in (self.type_counts, self.region_counts, self.threshold_counts):
+            for key in [key for key in counts if counts[key] <= 0]:
+                del counts[key]
+
+    def match(self, alert_type: str, severity_score: int, regions: Optional[List[str]] = None) -> Set[Hashable]:
+        """Connection ids subscribed to ``alert_type`` that accept the score and overlap ``regions``"""
+        type_bit = self.types.bit(alert_type)
+        by_region = self._index.get(type_bit) if type_bit is not None else None
+        if not by_region:
+            return set()
+        accepted = sum(1 for score in self.scores if score <= severity_score)
+        if regions:
+            region_bits = [self.regions.bit(region) for region in regions]
+            region_buckets = [
+                by_region[bit] for bit in (*region_bits, _ANY_REGION_BIT) if bit is not None and bit in by_region
+            ]
+        else:
+            region_buckets = list(by_region.values())
+
+        matches: Set[Hashable] = set()
+        for buckets in region_buckets:
+            for bucket in buckets[:accepted]:
+                matches |= bucket
+        return matches
+
+    def summary(self) -> Dict[str, object]:
+        """What the indexed connections can receive (see WebSocketCluster)"""
+        return {
+            "connections": len(self._entries),
+            "types": sorted(self.type_counts),
+            "regions": sorted(region for region in self.region_counts if region != ANY_REGION),
+            "any_region": ANY_REGION in self.region_counts,
+            "min_threshold": min(self.threshold_counts, default=101),
+        }
@@ -0,0 +1,124 @@
+"""
+PocketShield WebSocket Liveness
+Per-connection ping and idle-expiry timers on a hashed timing wheel
+
+Each connection has one timer. When it fires the connection is either expired
+(no client traffic for ``idle_timeout``) or sent an application ping and
+rescheduled for its next ping or its expiry, whichever is sooner. First pings
+are spread uniformly over the ping interval, so heartbeat traffic stays level
+instead of arriving in one burst, and a tick only touches the timers that are
+due: the cost follows timer events, not open connections.
+
+Dead TCP peers are caught below the application by protocol-level ping frames,
+which uvicorn's websockets implementation sends on its own schedule
+(``--ws-ping-interval``/``--ws-ping-timeout``, see the Dockerfile). The
+application ``server_ping`` is for clients that cannot observe protocol pings;
+``WS_APP_PING_INTERVAL=0`` turns it off and leaves only idle expiry.
+"""
+
+import math
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional
+
+
+@dataclass
+class LivenessConfig:
+    ping_interval: float = 30.0  # seconds between application pings; 0 disables them
+    idle_timeout: float = 300.0  # seconds without client traffic before the connection is closed
+    tick: float = 1.0  # timer resolution in seconds
+
+    @classmethod
+    def from_env(cls) -> "LivenessConfig":
+        return cls(
+            ping_interval=float(os.getenv("WS_APP_PING_INTERVAL", "30")),
+            idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", "300")),
+            tick=float(os.getenv("WS_LIVENESS_TICK", "1.0")),
+        )
+
+
+class TimingWheel:
+    """Hashed timing wheel with ``tick`` resolution
+
+    The wheel spans ``horizon`` seconds, so every timer in a slot is due when
+    the slot comes round: scheduling and cancelling are O(1) and ``advance``
+    is O(timers due). Deadlines beyond the horizon are pulled in to it.
+    """
+
+    def __init__(self, tick: float, horizon: float, now: Optional[float] = None):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, int]] = [{} for _ in range(math.ceil(horizon / tick) + 2)]
+        self.origin = time.monotonic() if now is None else now
+        self.current = 0  # last tick processed
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key: Hashable, when: float):
+        """(Re)schedule ``key`` to fire at monotonic time ``when``"""
+        slots = self.slots
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            del slots[slot][key]
+        due = math.ceil((when - self.origin) / self.tick)
+        if due <= self.current:
+            due = self.current + 1
+        elif due >= self.current + len(slots):
+            due = self.current + len(slots) - 1
+        slot = due % len(slots)
+        slots[slot][key] = due
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Keys whose deadline has passed by ``now``, removed from the wheel"""
+        target = math.floor((now - self.origin) / self.tick)
+        due: List[Hashable] = []
+        while self.current < target:
+            self.current += 1
+            bucket = self.slots[self.current % len(self.slots)]
+            if bucket:
+                for key in bucket:
+                    del self._slot_of[key]
+                due.extend(bucket)
+                bucket.clear()
+        return due
+
+
+class Liveness:
+    """Ping/expiry schedule for a set of connections"""
+
+    def __init__(self, config: LivenessConfig, now: Optional[float] = None):
+        self.config = config
+        self.wheel = TimingWheel(config.tick, max(config.ping_interval, config.idle_timeout), now)
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def add(self, connection_id: Hashable, now: float):
+        """Start timing a new connection; its first ping lands anywhere in the interval"""
+        if self.config.ping_interval > 0:
+            first = now + random.uniform(self.config.tick, self.config.ping_interval)
+            self.wheel.schedule(connection_id, min(first, now + self.config.idle_timeout))
+        else:
+            self.wheel.schedule(connection_id, now + self.config.idle_timeout)
+
+    def remove(self, connection_id: Hashable):
+        self.wheel.cancel(connection_id)
+
+    def due(self, now: float) -> List[Hashable]:
+        return self.wheel.advance(now)
+
+    def reschedule(self, connection_id: Hashable, last_seen: float, now: float):
+        """Next ping or expiry, whichever comes first"""
+        deadline = last_seen + self.config.idle_timeout
+        if self.config.ping_interval > 0:
+            deadline = min(deadline, now + self.config.ping_interval)
+        self.wheel.schedule(connection_id, deadline)
@@ -0,0 +1,162 @@
+"""
+PocketShield WebSocket Outbox
+Bounded per-connection outbound queue drained by its own writer task
+
+Fan-outs only enqueue, so one slow client never delays delivery to the others.
+When a queue is full the overflow policy decides what gives:
+
+- drop_oldest: drop the oldest message of the lowest queued priority
+- coalesce: as drop_oldest, and a keyed message (e.g. server_ping) replaces a
+  queued one with the same key instead of queueing behind it
+- disconnect: close the connection; the client reconnects and catches up
+
+A send that does not complete within ``send_timeout`` also closes the
+connection. High-priority messages are never dropped to make room; if the
+queue holds nothing else, the connection is closed instead.
+
+Most connections are idle most of the time, so an outbox holds no queue and
+no writer task until something is queued; the writer exits once it drains.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Hashable, Optional, Union
+
+from fastapi import WebSocket
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+@dataclass
+class OutboxConfig:
+    max_size: int = 64
+    policy: OverflowPolicy = OverflowPolicy.COALESCE
+    send_timeout: float = 10.0  # seconds for one send before the client counts as stuck
+
+    @classmethod
+    def from_env(cls) -> "OutboxConfig":
+        return cls(
+            max_size=int(os.getenv("WS_OUTBOX_SIZE", "64")),
+            policy=OverflowPolicy(os.getenv("WS_OVERFLOW_POLICY", "coalesce")),
+            send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+        )
+
+
+class Outbox:
+    """Outbound queue and writer task for one connection
+
+    ``on_failure(owner, reason)`` is called once if the connection has to be
+    closed (overflow under the disconnect policy, send timeout or send error).
+    One callback is shared by every outbox; ``owner`` tells them apart.
+    """
+
+    __slots__ = ("websocket", "config", "owner", "on_failure", "queue", "closed", "_task")
+
+    def __init__(self, websocket: WebSocket, config: OutboxConfig, owner: Hashable,
+                 on_failure: Callable[[Hashable, str], None]):
+        self.websocket = websocket
+        self.config = config
+        self.owner = owner
+        self.on_failure = on_failure
+        self.queue: Optional[deque] = None  # [priority, key, payload, message_type]; None while idle
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def stop(self):
+        self.closed = True
+        self.queue = None
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue) if self.queue else 0
+
+    def put(self, payload: Union[str, bytes], message_type: str, priority: int = PRIORITY_NORMAL,
+            key: Optional[str] = None) -> bool:
+        """Queue a text (str) or binary (bytes) frame; False if it was not queued (dropped or connection closing)"""
+        if self.closed:
+            return False
+        queue = self.queue
+        if queue is None:
+            queue = self.queue = deque()
+        if key is not None and self.config.policy is OverflowPolicy.COALESCE:
+            for entry in queue:
+                if entry[1] == key:
+                    entry[2], entry[3] = payload, message_type
+                    metrics.WS_OUTBOX_DROPPED.labels("coalesced").inc()
+                    return True
+        if len(queue) >= self.config.max_size and not self._make_room(priority):
+            return False
+        queue.append([priority, key, payload, message_type])
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+        return True
+
+    def _make_room(self, priority: int) -> bool:
+        if self.config.policy is OverflowPolicy.DISCONNECT:
+            self.fail("overflow")
+            return False
+        lowest = min(entry[0] for entry in self.queue)
+        if lowest == PRIORITY_HIGH:
+            # Only urgent messages are waiting and the client still can't keep up
+            self.fail("overflow")
+            return False
+        if lowest > priority:
+            metrics.WS_OUTBOX_DROPPED.labels("rejected").inc()
+            return False
+        for index, entry in enumerate(self.queue):
+            if entry[0] == lowest:
+                del self.queue[index]
+                break
+        metrics.WS_OUTBOX_DROPPED.labels("evicted").inc()
+        return True
+
+    def fail(self, reason: str):
+        if self.closed:
+            return
+        self.stop()
+        metrics.WS_SLOW_CONSUMER_DISCONNECTS.labels(reason).inc()
+        self.on_failure(self.owner, reason)
+
+    async def _writer(self):
+        while not self.closed:
+            queue = self.queue
+            if not queue:
+                # Drained: go idle until the next put
+                self.queue = None
+                self._task = None
+                return
+            _, _, payload, message_type = queue.popleft()
+            try:
+                async with asyncio.timeout(self.config.send_timeout):
+                    if isinstance(payload, str):
+                        await self.websocket.send_text(payload)
+                    else:
+                        await self.websocket.send_bytes(payload)
+            except TimeoutError:
+                metrics.WS_SEND_FAILURES.labels(message_type).inc()
+                self.fail("send_timeout")
+                return
+            except Exception as e:
+                logger.debug(f"WebSocket send failed: {e}")
+                metrics.WS_SEND_FAILURES.labels(message_type).inc()
+                self.fail("send_error")
+                return
+            metrics.WS_MESSAGES_SENT.labels(message_type).inc()
@@ -0,0 +1,119 @@
+"""
+PocketShield Brand Match Benchmark
+Lookup latency and index size of the typosquat/homoglyph index as the brand list grows
+
+Brands are random lowercase names (4-14 characters). Hosts are an even mix of
+unrelated domains and lookalikes (one edit, digit swaps, brand-plus-word) of
+listed brands. Lookups bypass the per-host cache.
+
+First checks known hosts against the default brand list: lookalikes must score
+as at least suspicious on the brand match alone, and unrelated names one edit
+from a short brand or brands' own sites under other suffixes must not.
+
+Usage: python -m benchmarks.bench_brand_match [--brands 1000 10000 50000] [--hosts N]
+"""
+
+import argparse
+import random
+import string
+import time
+import tracemalloc
+
+from app.brand_protection import DEFAULT_BRANDS, BrandIndex
+from benchmarks.harness import percentile
+
+
+def random_name(rng: random.Random, low: int = 4, high: int = 14) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def lookalike(rng: random.Random, brand: str) -> str:
+    kind = rng.randrange(3)
+    if kind == 0:
+        i = rng.randrange(len(brand))
+        return brand[:i] + rng.choice(string.ascii_lowercase) + brand[i + 1:] + ".com"
+    if kind == 1:
+        return brand.replace("o", "0").replace("l", "1").replace("e", "3") + ".in"
+    return f"{brand}-{rng.choice(['secure', 'login', 'kyc', 'verify'])}.top"
+
+
+SUSPICIOUS_SCORE = 50
+# host -> whether its brand matches alone must reach SUSPICIOUS_SCORE
+REGRESSION_HOSTS = {
+    "paypa1.com": True,
+    "g00gle.com": True,
+    "instagrarn.com": True,
+    "amazon-secure.top": True,
+    "paypal.evil.com": True,
+    "micros0ft-login.com": True,
+    "icicibamk.com": True,
+    "kodak.com": False,
+    "kotaku.com": False,
+    "apply.example.com": False,
+    "www.ample.org": False,
+    "amazon.co.uk": False,
+    "google.de": False,
+    "amazon.com.ar": False,
+}
+
+
+def check_regressions() -> int:
+    from app.main import threat_service
+
+    index = BrandIndex(DEFAULT_BRANDS)
+    failures = 0
+    for host, flagged in REGRESSION_HOSTS.items():
+        matches = index._match(host)
+        score = threat_service._calculate_risk_score([match.to_threat() for match in matches])
+        ok = (score >= SUSPICIOUS_SCORE) == flagged
+        failures += not ok
+        kinds = ", ".join(f"{m.brand}/{m.kind}/{m.confidence}" for m in matches) or "-"
+        print(f"{'ok  ' if ok else 'FAIL'} {host:<22} score={score:3d} {kinds}")
+    return failures
+
+
+def run(brand_count: int, args):
+    rng = random.Random(args.seed)
+    brands = {random_name(rng): (f"brand{i}.com",) for i in range(brand_count)}
+    names = list(brands)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = BrandIndex(brands)
+    build_seconds = time.perf_counter() - start
+    index_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+
+    hosts = [
+        lookalike(rng, rng.choice(names)) if i % 2 else random_name(rng, 5, 16) + ".com"
+        for i in range(args.hosts)
+    ]
+    samples, flagged = [], 0
+    for host in hosts:
+        start = time.perf_counter()
+        matches = index._match(host)
+        samples.append(time.perf_counter() - start)
+        flagged += bool(matches)
+    samples.sort()
+
+    print(
+        f"brands={brand_count:>6} build={build_seconds:6.2f}s index={index_mb:7.1f}MB "
+        f"p50={percentile(samples, 0.5) * 1e6:6.1f}us p99={percentile(samples, 0.99) * 1e6:6.1f}us "
+        f"flagged={flagged / len(hosts):.0%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--brands", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    if check_regressions():
+        raise SystemExit("brand match regressions")
+    for brand_count in args.brands:
+        run(brand_count, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+PocketShield URL Enrichment Benchmark
+Redirect expansion + DNS latency against local stand-in HTTP and DNS servers
+
+A UDP DNS server answers every name with 127.0.0.1, except names starting
+with "nx-" (NXDOMAIN) and "internal-" (10.0.0.1). An HTTP server on the same
+address plays shortener and landing page: /r/<hops>/<n> redirects <hops>
+times, /goto?to=<url> redirects to <url>, /slow hangs, anything else returns
+200. tests/test_enrichment.py runs against the same stand-ins. Each server response waits --server-latency-ms. Shortener hosts
+map to that server through the DNS stand-in.
+
+Scenarios: cold expansions, the same URLs again (cache hits), a hanging
+redirector (bounded by the time budget), and a burst to one host (bounded by
+the per-host limit).
+
+Usage: python -m benchmarks.bench_enrichment [--urls 100] [--hops 2] [--server-latency-ms 20]
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rrset
+from aiohttp import web
+
+from app.enrichment import EnrichmentConfig, UrlEnricher
+from benchmarks.harness import percentile
+
+HOST = "127.0.0.1"
+INTERNAL_ADDRESS = "10.0.0.1"
+
+
+class DnsStandIn(asyncio.DatagramProtocol):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        asyncio.get_running_loop().call_later(self.latency, self._answer, data, addr)
+
+    def _answer(self, data, addr):
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text()
+        if name.startswith("nx-"):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif question.rdtype == dns.rdatatype.A:
+            address = INTERNAL_ADDRESS if name.startswith("internal-") else HOST
+            response.answer.append(dns.rrset.from_text(name, 300, "IN", "A", address))
+        response.flags |= dns.flags.RA
+        self.transport.sendto(response.to_wire(), addr)
+
+
+class HttpStandIn:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.hang = 30.0  # seconds /slow takes to answer
+        self.requests = 0
+        self.in_flight: Dict[str, int] = {}
+        self.peak_in_flight: Dict[str, int] = {}
+        self.port = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        host = request.host.split(":")[0]
+        self.requests += 1
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        self.peak_in_flight[host] = max(self.peak_in_flight.get(host, 0), self.in_flight[host])
+        try:
+            await asyncio.sleep(self.latency)
+            parts = request.path.strip("/").split("/")
+            if parts[0] == "slow":
+                await asyncio.sleep(self.hang)
+            if parts[0] == "goto":
+                raise web.HTTPFound(request.query["to"])
+            if parts[0] == "r" and int(parts[1]) > 0:
+                hops = int(parts[1]) - 1
+                target = f"/r/{hops}/{parts[2]}" if hops else f"http://landing-{parts[2]}.example:{self.port}/"
+                raise web.HTTPFound(target)
+            return web.Response(text="ok")
+        finally:
+            self.in_flight[host] -= 1
+
+
+async def timed(enricher: UrlEnricher, urls):
+    samples = []
+
+    async def one(url):
+        start = time.perf_counter()
+        result = await enricher.enrich(url)
+        samples.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(url) for url in urls))
+    return results, sorted(samples), time.perf_counter() - start
+
+
+def report(name: str, results, samples, elapsed: float):
+    statuses = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    print(
+        f"{name:<12} n={len(results):>5} wall={elapsed * 1000:7.1f}ms "
+        f"p50={percentile(samples, 0.5) * 1000:7.1f}ms p99={percentile(samples, 0.99) * 1000:7.1f}ms "
+        f"max={samples[-1] * 1000:7.1f}ms statuses={statuses}"
+    )
+
+
+async def start_stand_ins(latency: float):
+    """Start both servers on HOST; returns (dns_transport, dns_server, http, runner)"""
+    loop = asyncio.get_running_loop()
+    dns_transport, dns_server = await loop.create_datagram_endpoint(
+        lambda: DnsStandIn(latency), local_addr=(HOST, 0)
+    )
+    http = HttpStandIn(latency)
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", http.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, 0)
+    await site.start()
+    http.port = site._server.sockets[0].getsockname()[1]
+    return dns_transport, dns_server, http, runner
+
+
+async def run(args):
+    dns_transport, dns_server, http, runner = await start_stand_ins(args.server_latency_ms / 1000)
+
+    enricher = UrlEnricher(EnrichmentConfig(
+        enabled=True,
+        expand_all=True,
+        timeout=args.timeout,
+        per_host_limit=args.per_host_limit,
+        nameservers=(HOST,),
+        dns_port=dns_transport.get_extra_info("sockname")[1],
+        allow_private=True,
+    ))
+    await enricher.start()
+    try:
+        urls = [f"http://short-{i % 50}.example:{http.port}/r/{args.hops}/{i}" for i in range(args.urls)]
+        report("cold", *await timed(enricher, urls))
+        report("warm", *await timed(enricher, urls))
+
+        results, samples, elapsed = await timed(enricher, [
+            f"http://nx-{i}.example:{http.port}/r/1/{i}" for i in range(20)
+        ])
+        report("nxdomain", results, samples, elapsed)
+
+        results, samples, elapsed = await timed(enricher, [
+            f"http://hang.example:{http.port}/slow/{i}" for i in range(20)
+        ])
+        report("hanging", results, samples, elapsed)
+
+        enricher.config.timeout = 10
+        results, samples, elapsed = await timed(enricher, [
+            f"http://burst.example:{http.port}/r/1/burst{i}" for i in range(100)
+        ])
+        report("one-host", results, samples, elapsed)
+        print(
+            f"peak concurrent requests to one host: {http.peak_in_flight['burst.example']} "
+            f"(limit {args.per_host_limit}); "
+            f"http requests={http.requests} dns queries={dns_server.queries}"
+        )
+    finally:
+        await enricher.stop()
+        await runner.cleanup()
+        dns_transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=100)
+    parser.add_argument("--hops", type=int, default=2)
+    parser.add_argument("--server-latency-ms", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=1.5)
+    parser.add_argument("--per-host-limit", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+PocketShield Verdict Invalidation Benchmark
+Stale verdicts served and cache hits kept after threat changes, with and without invalidation
+
+--urls URLs spread over --domains hosts are analyzed once, so every verdict is
+cached with no threats. Then --changed of the domains are added as threats, which
+journals their hashes as the threat_indicators trigger would, and every URL
+is analyzed again. Without invalidation the verdicts on the changed domains
+stay "safe" until their TTL runs out; with it one drain of the journal evicts
+exactly those verdicts and everything else is still a cache hit.
+
+Usage: python -m benchmarks.bench_verdict_invalidation [--urls 5000] [--domains 500] [--changed 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from app import metrics
+from app.indicators import hash_canonical
+from benchmarks import run
+
+BATCH = 10
+
+
+async def analyze_all(service, urls):
+    results = []
+    for i in range(0, len(urls), BATCH):
+        results.extend((await service.analyze_urls(urls[i:i + BATCH], {"source": "bench"}))["results"])
+    return results
+
+
+async def scenario(args, invalidate: bool):
+    env = run.build_environment(run.parse_args(["--malicious-domains", "1", "--db-latency-ms", "0"]))
+    db, redis_client, service = env["db"], env["redis"], env["main"].threat_service
+    service.brands = None  # brand lookalikes and enrichment are not what is measured here
+    service.enricher = None
+
+    rng = random.Random(args.seed)
+    domains = [f"shop-{i}.example.com" for i in range(args.domains)]
+    urls = [f"https://{rng.choice(domains)}/item/{i}" for i in range(args.urls)]
+    malicious = set()
+    journal = []
+    threat_row = {
+        "type": "phishing", "risk_score": 95, "confidence": 0.95, "description": "Newly listed",
+        "tags": ["bench"], "expires_in": 7 * 86400.0,
+    }
+    db.on("threat.domain_reputation", lambda query_args: [threat_row] if malicious.intersection(query_args[0]) else [])
+    # One committed transaction per journal row, so the snapshot xmin is past all of them
+    db.on("verdict_cache.invalidations", lambda query_args: [
+        row for row in journal
+        if (int(row["xid"]), row["seq"]) > (int(query_args[0]), query_args[1]) and int(row["xid"]) < int(query_args[2])
+    ][:query_args[3]])
+    db.on("verdict_cache.snapshot_xmin", lambda query_args: [{"xmin": str(len(journal) + 1)}])
+
+    await analyze_all(service, urls)
+    await service.verdicts.drain()  # first drain only sets the shared cursor
+
+    # The feed lists some of the domains
+    changed = rng.sample(domains, args.changed)
+    for domain in changed:
+        malicious.add(hash_canonical(domain))
+        journal.append({"seq": len(journal) + 1, "xid": str(len(journal) + 1), "value_hash": hash_canonical(domain)})
+    changed_hosts = set(changed)
+    expected = sum(1 for url in urls if url.split("/")[2] in changed_hosts)
+
+    drain_ms, evicted = 0.0, 0
+    commands = redis_client.commands
+    if invalidate:
+        start = time.perf_counter()
+        evicted = await service.verdicts.drain()
+        drain_ms = (time.perf_counter() - start) * 1000
+    drain_commands = redis_client.commands - commands
+
+    hits_before = metrics.CACHE_HIT._value.get()
+    results = await analyze_all(service, urls)
+    hits = metrics.CACHE_HIT._value.get() - hits_before
+    stale = sum(
+        1 for url, result in zip(urls, results)
+        if url.split("/")[2] in changed_hosts and not result["threats"]
+    )
+    label = "invalidation" if invalidate else "ttl only"
+    print(
+        f"{label:>12}: stale verdicts served={stale:5d}/{expected} evicted={evicted:5d} "
+        f"hits={hits / len(urls):6.1%} drain={drain_ms:7.1f}ms ({drain_commands} redis round-trips)"
+    )
+
+
+async def run_benchmark(args):
+    logging.getLogger("app.verdict_cache").setLevel(logging.WARNING)
+    print(f"urls={args.urls} domains={args.domains} changed={args.changed}")
+    await scenario(args, invalidate=False)
+    await scenario(args, invalidate=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=5000)
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--changed", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+PocketShield Alert Coalescing Benchmark
+Frames, bytes and CPU per device during an alert burst, with and without coalescing
+
+--alerts HIGH phishing alerts go out over --burst-seconds to --connections
+subscribed devices. Their indicators are drawn from a pool a third the size, as
+repeated campaign URLs are. Every --critical-every-th alert is CRITICAL. The
+burst runs once without coalescing and once with a --window second window. The
+first 100 connections parse what they receive, which gives the latency of the
+critical alerts.
+
+Usage: python -m benchmarks.bench_ws_coalescing [--connections 10000] [--alerts 200] [--window 0.5]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+from app.websocket_service import AlertSeverity, WebSocketManager, create_phishing_alert
+from benchmarks.fakes import FakeRedis, FakeWebSocket, fake_token_verifier
+from benchmarks.harness import percentile
+
+PROBES = 100
+
+
+class ProbeWebSocket(FakeWebSocket):
+    """Records when each critical alert arrives, alone or in a batch"""
+
+    def __init__(self):
+        super().__init__()
+        self.critical_at = {}
+
+    async def send_text(self, data: str):
+        await super().send_text(data)
+        message = json.loads(data)
+        if message["message_type"] == "threat_alert":
+            alerts = [message["data"]["alert"]]
+        elif message["message_type"] == "threat_alert_batch":
+            alerts = [entry["alert"] for entry in message["data"]["alerts"]]
+        else:
+            return
+        for alert in alerts:
+            if alert["severity"] == "critical":
+                self.critical_at[alert["alert_id"]] = time.perf_counter()
+
+
+async def burst(args, window: float):
+    manager = WebSocketManager(FakeRedis(), fake_token_verifier(), cluster=False)
+    manager.coalescer.config.window = window
+    sockets = [ProbeWebSocket() if i < PROBES else FakeWebSocket() for i in range(args.connections)]
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, f"device-{i}", subscriptions={"new_threat"})
+    await asyncio.sleep(0.1)
+    baseline = [(websocket.sent, websocket.sent_bytes) for websocket in sockets]
+
+    rng = random.Random(args.seed)
+    pool = [f"https://campaign-{i}.example/login" for i in range(max(1, args.alerts // 3))]
+    critical_sent = {}
+    cpu_start = time.process_time()
+    for i in range(args.alerts):
+        alert = await create_phishing_alert({"urls": [rng.choice(pool)]}, f"Campaign alert {i}")
+        if i % args.critical_every == args.critical_every - 1:
+            alert.severity = AlertSeverity.CRITICAL
+            critical_sent[alert.alert_id] = time.perf_counter()
+        await manager.send_threat_alert(alert)
+        await asyncio.sleep(args.burst_seconds / args.alerts)
+    await asyncio.sleep(window + 0.2)  # last window flushes, writers drain
+    cpu = time.process_time() - cpu_start
+
+    frames = sum(websocket.sent - sent for websocket, (sent, _) in zip(sockets, baseline))
+    sent_bytes = sum(websocket.sent_bytes - size for websocket, (_, size) in zip(sockets, baseline))
+    latencies = sorted(
+        probe.critical_at[alert_id] - sent_at
+        for probe in sockets[:PROBES] for alert_id, sent_at in critical_sent.items()
+        if alert_id in probe.critical_at
+    )
+    print(
+        f"window={window:4.1f}s frames/device={frames / len(sockets):6.1f} "
+        f"bytes/device={sent_bytes / len(sockets):8.0f} cpu={cpu * 1000:8.1f}ms "
+        f"critical p50={percentile(latencies, 0.5) * 1000:6.2f}ms max={latencies[-1] * 1000:6.2f}ms"
+    )
+    for connection_id in list(manager.active_connections):
+        await manager.disconnect(connection_id)
+
+
+async def run(args):
+    logging.getLogger("app.websocket_service").setLevel(logging.WARNING)
+    print(f"connections={args.connections} alerts={args.alerts} over {args.burst_seconds:.1f}s")
+    await burst(args, 0)
+    await burst(args, args.window)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--alerts", type=int, default=200)
+    parser.add_argument("--burst-seconds", type=float, default=2.0)
+    parser.add_argument("--window", type=float, default=0.5)
+    parser.add_argument("--critical-every", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
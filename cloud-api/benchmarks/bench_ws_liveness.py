@@ -0,0 +1,114 @@
+"""
+PocketShield WebSocket Liveness Benchmark
+Per-connection timers on the timing wheel vs the full-scan heartbeat and cleanup
+
+Opens --connections idle fake connections, --dead-pct of which go past the
+idle timeout at some point in the next --seconds, and plays those seconds of
+ticks through WebSocketManager._liveness_tick on a simulated clock. The scan
+replays what the old loops did in the same time: a server_ping serialized and
+queued for every connection every 30s, and a last-seen check of every
+connection every 60s.
+
+With --app-ping-interval 0 (protocol pings only) the wheel only fires for
+expiring connections, so its cost follows expiries, not open connections.
+
+Usage: python -m benchmarks.bench_ws_liveness [--connections 100000] [--app-ping-interval 30]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime
+
+from app.websocket_service import WebSocketManager
+from benchmarks.fakes import FakeRedis, FakeWebSocket, fake_token_verifier
+from benchmarks.harness import percentile
+
+
+def heartbeat_pass(manager: WebSocketManager):
+    """One pass of the old heartbeat loop"""
+    ping = {
+        "message_id": str(uuid.uuid4()),
+        "message_type": "server_ping",
+        "timestamp": datetime.utcnow().isoformat(),
+        "data": {"server_time": datetime.utcnow().isoformat()},
+    }
+    for connection in list(manager.active_connections.values()):
+        connection.outbox.put(json.dumps({**ping, "device_id": connection.device_id}), "server_ping", key="server_ping")
+
+
+def cleanup_pass(manager: WebSocketManager, now: float) -> int:
+    """One pass of the old stale-connection loop"""
+    idle_timeout = manager.liveness.config.idle_timeout
+    return sum(1 for connection in manager.active_connections.values() if now - connection.last_seen > idle_timeout)
+
+
+async def run(args):
+    logging.getLogger("app.websocket_service").setLevel(logging.WARNING)
+    manager = WebSocketManager(FakeRedis(), fake_token_verifier(), cluster=False)
+    config = manager.liveness.config
+    config.ping_interval = args.app_ping_interval
+
+    rng = random.Random(args.seed)
+    for i in range(args.connections):
+        connection_id = await manager.connect(FakeWebSocket(), f"device-{i}")
+        if rng.random() < args.dead_pct / 100:
+            connection = manager.active_connections[connection_id]
+            connection.last_seen -= config.idle_timeout - rng.uniform(0, args.seconds)
+            manager.liveness.reschedule(connection_id, connection.last_seen, connection.last_seen)
+    await asyncio.sleep(0.1)  # let writers deliver the welcome messages
+
+    clock = time.monotonic()
+    start = time.perf_counter()
+    heartbeat_pass(manager)
+    heartbeat = time.perf_counter() - start
+    start = time.perf_counter()
+    cleanup_pass(manager, clock)
+    cleanup = time.perf_counter() - start
+    scan_total = heartbeat * args.seconds / 30 + cleanup * args.seconds / 60
+    await asyncio.sleep(0.1)
+
+    samples, open_before = [], len(manager.active_connections)
+    for tick in range(1, int(args.seconds / config.tick) + 1):
+        start = time.perf_counter()
+        manager._liveness_tick(clock + tick * config.tick)
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0)  # writers and disconnects run between ticks
+    await asyncio.sleep(0.1)
+    expired = open_before - len(manager.active_connections)
+    samples.sort()
+
+    print(
+        f"connections={args.connections} seconds={args.seconds:.0f} "
+        f"app_ping_interval={config.ping_interval:.0f}s expired={expired}"
+    )
+    print(
+        f"wheel  total={sum(samples) * 1000:8.1f}ms per tick p50={percentile(samples, 0.5) * 1000:7.2f}ms "
+        f"max={samples[-1] * 1000:7.2f}ms"
+    )
+    print(
+        f"scan   total={scan_total * 1000:8.1f}ms heartbeat pass={heartbeat * 1000:7.1f}ms "
+        f"cleanup pass={cleanup * 1000:7.1f}ms"
+    )
+
+    for connection_id in list(manager.active_connections):
+        await manager.disconnect(connection_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--app-ping-interval", type=float, default=30)
+    parser.add_argument("--dead-pct", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
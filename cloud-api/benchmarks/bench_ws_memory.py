@@ -0,0 +1,74 @@
+"""
+PocketShield WebSocket Memory Benchmark
+Bytes of server-side state per idle WebSocket connection
+
+For each size, opens that many fake connections on a fresh WebSocketManager,
+lets the welcome messages drain and measures what stayed allocated with
+tracemalloc. The fake sockets and device id strings are created before
+measuring: they stand in for the framework's socket and the authenticated
+device id, which exist either way. The largest run is broken down by source
+file.
+
+Usage: python -m benchmarks.bench_ws_memory [--sizes 10000,100000,500000]
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import time
+import tracemalloc
+
+from app.websocket_service import WebSocketManager
+from benchmarks.fakes import FakeRedis, FakeWebSocket, fake_token_verifier
+
+
+async def measure(size: int, breakdown: bool):
+    manager = WebSocketManager(FakeRedis(), fake_token_verifier(), cluster=False)
+    sockets = [FakeWebSocket() for _ in range(size)]
+    device_ids = [f"device-{i}" for i in range(size)]
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot() if breakdown else None
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for websocket, device_id in zip(sockets, device_ids):
+        await manager.connect(websocket, device_id)
+    connect_duration = time.perf_counter() - start
+    while any(websocket.sent < 1 for websocket in sockets):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)  # writers finish up after their last send
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    after = tracemalloc.take_snapshot() if breakdown else None
+    tracemalloc.stop()
+
+    print(
+        f"connections={size:>7} bytes/connection={used / size:7.0f} total={used / 2**20:8.1f}MiB "
+        f"connect={connect_duration:6.1f}s"
+    )
+    if breakdown:
+        for stat in after.compare_to(before, "filename")[:8]:
+            print(f"    {stat.size_diff / size:7.0f} B/connection  {stat.traceback[0].filename}")
+
+    for connection_id in list(manager.active_connections):
+        await manager.disconnect(connection_id)
+
+
+async def run(args):
+    logging.getLogger("app.websocket_service").setLevel(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    for size in sizes:
+        await measure(size, breakdown=size == max(sizes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,500000")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
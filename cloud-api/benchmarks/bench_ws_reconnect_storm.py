@@ -0,0 +1,153 @@
+"""
+PocketShield WebSocket Reconnect Storm Benchmark
+Recovery time and event-loop stability when every device reconnects at once
+
+--devices clients open a session at the same moment, each going through
+admit -> authenticate_connection (a real JWT decode) -> connect with cluster
+presence on a FakeRedis. The fakes do none of the TLS, handshake and framing
+work a real session costs, so each admitted session burns --setup-cpu-ms of CPU
+to stand in for it. A client that is not connected within --client-timeout
+hangs up and retries; without admission control it retries after a fixed
+--retry-delay (in lockstep, as naive clients do), with it after the server's
+retry_after hint. The server still finishes the setup for a client that hung up and then
+drops it. All clients start in the same loop iteration, so the first stall
+is mostly the harness itself.
+
+Reports when 50/90/100% of devices were connected, how many attempts that
+took, the worst event-loop stall and the Redis round-trips.
+
+Usage: python -m benchmarks.bench_ws_reconnect_storm [--devices 10000] [--rate 700]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import jwt
+
+from app.websocket_service import WebSocketManager
+from benchmarks.fakes import FakeRedis, FakeWebSocket, fake_token_verifier
+
+
+class StormWebSocket(FakeWebSocket):
+    """Remembers the close reason (which carries the retry_after hint)"""
+
+    def __init__(self):
+        super().__init__()
+        self.reason = None
+
+    async def close(self, code: int = 1000, reason=None):
+        await super().close(code, reason)
+        self.reason = reason
+
+
+async def session(manager: WebSocketManager, websocket: StormWebSocket, token: str, setup_cpu: float):
+    """Server side of one attempt: the endpoint's admit -> authenticate -> connect"""
+    if not await manager.admit(websocket):
+        return None
+    end = time.perf_counter() + setup_cpu
+    while time.perf_counter() < end:
+        pass
+    device_id = await manager.authenticate_connection(websocket, token)
+    return await manager.connect(websocket, device_id, subscriptions={"new_threat"})
+
+
+async def client(manager, token: str, args, stats: dict, start: float):
+    while True:
+        stats["attempts"] += 1
+        websocket = StormWebSocket()
+        server = asyncio.ensure_future(session(manager, websocket, token, args.setup_cpu_ms / 1000))
+        done, _ = await asyncio.wait([server], timeout=args.client_timeout)
+        if done and server.result() is not None:
+            stats["connected"].append(time.perf_counter() - start)
+            return
+        if done:
+            # Told to come back later
+            stats["rejected"] += 1
+            delay = float(websocket.reason.split("=", 1)[1])
+        else:
+            # Hung up; the server drops the session once it finishes setting it up
+            stats["timeouts"] += 1
+            server.add_done_callback(
+                lambda task: not task.cancelled() and task.result() is not None
+                and asyncio.ensure_future(manager.disconnect(task.result()))
+            )
+            delay = args.retry_delay
+        await asyncio.sleep(delay)
+
+
+async def watch_loop(stalls: list, interval: float = 0.01):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - expected)
+
+
+async def storm(args, rate: float):
+    redis_client = FakeRedis(latency=0.001)
+    manager = WebSocketManager(redis_client, fake_token_verifier(), cluster=True)
+    manager.admission.config.rate = rate
+    manager.admission.config.burst = int(rate // 5)
+    await manager.cluster.start()
+    tokens = [
+        jwt.encode({"device_id": f"device-{i}"}, manager.token_verifier.secret, algorithm=manager.token_verifier.algorithm)
+        for i in range(args.devices)
+    ]
+    stats = {"attempts": 0, "rejected": 0, "timeouts": 0, "connected": []}
+    stalls: list = []
+    watcher = asyncio.create_task(watch_loop(stalls))
+    commands_before = redis_client.commands
+
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(client(manager, token, args, stats, start) for token in tokens)),
+            timeout=args.give_up
+        )
+    except asyncio.TimeoutError:
+        pass
+    watcher.cancel()
+
+    connected = sorted(stats["connected"])
+
+    def reached(fraction: float) -> str:
+        needed = int(args.devices * fraction)
+        return f"{connected[needed - 1]:6.2f}s" if len(connected) >= needed else "  never"
+
+    label = f"rate={rate:.0f}/s" if rate else "unlimited"
+    print(
+        f"{label:>13} connected 50%={reached(0.5)} 90%={reached(0.9)} 100%={reached(1.0)} "
+        f"attempts={stats['attempts']} rejected={stats['rejected']} timeouts={stats['timeouts']} "
+        f"max_stall={max(stalls, default=0) * 1000:7.1f}ms redis_rtts={redis_client.commands - commands_before}"
+    )
+    for connection_id in list(manager.active_connections):
+        await manager.disconnect(connection_id)
+    await manager.cluster.stop()
+
+
+async def run(args):
+    logging.getLogger("app.websocket_service").setLevel(logging.WARNING)
+    logging.getLogger("app.ws_cluster").setLevel(logging.WARNING)
+    print(
+        f"devices={args.devices} setup_cpu={args.setup_cpu_ms}ms "
+        f"client_timeout={args.client_timeout}s retry_delay={args.retry_delay}s"
+    )
+    await storm(args, 0)
+    await storm(args, args.rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=700)
+    parser.add_argument("--setup-cpu-ms", type=float, default=0.5)
+    parser.add_argument("--client-timeout", type=float, default=3.0)
+    parser.add_argument("--retry-delay", type=float, default=1.0)
+    parser.add_argument("--give-up", type=float, default=60.0, help="seconds before a run is reported as is")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+PocketShield Alert Targeting Benchmark
+Finding an alert's recipients with the subscription index vs scanning every connection
+
+Connections get 1-3 alert types, 1-2 of --regions regions (some none) and a
+random risk threshold. Alerts range from broad (common type, no region) to
+selective (rare type, one region). The scan applies the per-connection rule
+the index replaces; both must pick the same recipients.
+
+Usage: python -m benchmarks.bench_ws_targeting [--connections 100000] [--alerts 200]
+"""
+
+import argparse
+import random
+import time
+
+from app.websocket_service import SEVERITY_SCORES, AlertSeverity, AlertType
+from app.ws_index import SubscriptionIndex
+from benchmarks.harness import percentile
+
+# Skewed so some types are common and others rare
+TYPE_WEIGHTS = {
+    AlertType.NEW_THREAT.value: 50,
+    AlertType.SECURITY_UPDATE.value: 20,
+    AlertType.APP_VULNERABILITY.value: 15,
+    AlertType.SUSPICIOUS_ACTIVITY.value: 10,
+    AlertType.DEVICE_COMPROMISE.value: 4,
+    AlertType.SYSTEM_MAINTENANCE.value: 1,
+}
+
+
+def scan(connections, alert_type: str, score: int, regions):
+    """Per-connection rule, as applied before the index"""
+    matches = set()
+    for connection_id, (subscriptions, connection_regions, threshold) in connections.items():
+        if alert_type not in subscriptions or score < threshold:
+            continue
+        if regions and connection_regions and not set(regions) & set(connection_regions):
+            continue
+        matches.add(connection_id)
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--alerts", type=int, default=200)
+    parser.add_argument("--regions", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    types, weights = list(TYPE_WEIGHTS), list(TYPE_WEIGHTS.values())
+    regions = [f"R{i}" for i in range(args.regions)]
+
+    connections = {}
+    for i in range(args.connections):
+        subscriptions = set(rng.choices(types, weights, k=rng.randint(1, 3)))
+        connection_regions = [] if rng.random() < 0.05 else rng.sample(regions, rng.randint(1, 2))
+        connections[f"conn-{i}"] = (subscriptions, connection_regions, rng.choice([10, 25, 40, 50, 60, 75, 90, 100]))
+
+    index = SubscriptionIndex(SEVERITY_SCORES.values(), types)
+    masks = {
+        connection_id: (index.types.mask(subscriptions), index.regions.mask(connection_regions))
+        for connection_id, (subscriptions, connection_regions, _) in connections.items()
+    }
+    start = time.perf_counter()
+    for connection_id, (_, _, threshold) in connections.items():
+        index.add(connection_id, *masks[connection_id], threshold)
+    build = time.perf_counter() - start
+
+    alerts = [
+        (
+            rng.choices(types, weights)[0],
+            SEVERITY_SCORES[rng.choice(list(AlertSeverity))],
+            [] if rng.random() < 0.2 else rng.sample(regions, rng.randint(1, 2)),
+        )
+        for _ in range(args.alerts)
+    ]
+
+    index_samples, scan_samples, recipients = [], [], 0
+    for alert in alerts:
+        start = time.perf_counter()
+        matched = index.match(*alert)
+        index_samples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        expected = scan(connections, *alert)
+        scan_samples.append(time.perf_counter() - start)
+        assert matched == expected, f"index disagrees with scan for {alert}"
+        recipients += len(matched)
+    index_samples.sort()
+    scan_samples.sort()
+
+    # Subscription churn: re-index 10k connections with a new threshold
+    churn = list(connections.items())[:10000]
+    start = time.perf_counter()
+    for connection_id, (_, _, threshold) in churn:
+        index.add(connection_id, *masks[connection_id], 100 - threshold)
+    reindex = (time.perf_counter() - start) / len(churn)
+
+    print(f"connections={args.connections} build={build:.2f}s reindex={reindex * 1e6:.1f}us/connection")
+    print(f"recipients/alert avg={recipients / len(alerts):.0f} ({recipients / len(alerts) / args.connections:.1%})")
+    for name, samples in (("index", index_samples), ("scan", scan_samples)):
+        print(
+            f"{name:<6} p50={percentile(samples, 0.5) * 1000:8.2f}ms "
+            f"p99={percentile(samples, 0.99) * 1000:8.2f}ms max={samples[-1] * 1000:8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
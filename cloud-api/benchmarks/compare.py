@@ -0,0 +1,59 @@
+"""
+PocketShield Benchmark Comparison
+Compares two result files and exits non-zero on regressions
+
+Usage: python -m benchmarks.compare BASE.json NEW.json [--threshold 0.10]
+"""
+
+import argparse
+import sys
+
+from benchmarks.harness import load_results
+
+# (metric path, higher_is_better)
+METRICS = [
+    (("throughput_ops",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p99"), False),
+    (("latency_ms", "p999"), False),
+]
+
+
+def _get(result, path):
+    value = result
+    for key in path:
+        value = value[key]
+    return value
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    base = load_results(base_path)
+    new = load_results(new_path)
+    regressions = 0
+
+    for scenario in sorted(set(base) & set(new)):
+        for path, higher_is_better in METRICS:
+            old_value = _get(base[scenario], path)
+            new_value = _get(new[scenario], path)
+            if not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            regressed = change < -threshold if higher_is_better else change > threshold
+            regressions += regressed
+            marker = "REGRESSION" if regressed else ""
+            print(f"{scenario:<28} {'.'.join(path):<16} {old_value:>12.3f} -> {new_value:>12.3f} ({change:+.1%}) {marker}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative change")
+    args = parser.parse_args()
+    sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+PocketShield Benchmark Fakes
+In-process stand-ins for Redis, asyncpg-backed DatabaseManager and WebSocket clients
+"""
+
+import asyncio
+import fnmatch
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from app.auth import TokenVerifier
+from app.verdict_cache import RELEASE_LOCK_SCRIPT
+
+BENCH_JWT_SECRET = "bench-secret"
+
+
+async def _latency(seconds: float, jitter: float = 0.0):
+    """Simulate a network round-trip; always yields to the event loop"""
+    if jitter:
+        seconds += random.uniform(0, jitter)
+    await asyncio.sleep(seconds)
+
+
+class FakeRedis:
+    """Subset of redis.asyncio.Redis used by the service, with latency injection"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.data: Dict[str, Any] = {}
+        self.expiry: Dict[str, float] = {}
+        self.published: List[tuple] = []
+        self.commands = 0
+
+    async def _rtt(self):
+        self.commands += 1
+        await _latency(self.latency, self.jitter)
+
+    def _alive(self, key: str) -> bool:
+        expires_at = self.expiry.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+            return False
+        return key in self.data
+
+    # Synchronous command implementations shared with pipelines
+    def _get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def _set(self, key, value, ex=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self.data[key] = value
+        if ex:
+            self.expiry[key] = time.monotonic() + ex
+        else:
+            self.expiry.pop(key, None)
+        return True
+
+    def _setex(self, key, ttl, value):
+        return self._set(key, value, ex=ttl)
+
+    def _delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                removed += 1
+            self.expiry.pop(key, None)
+        return removed
+
+    def _mget(self, keys):
+        return [self._get(key) for key in keys]
+
+    def _incrby(self, key, amount=1):
+        value = int(self._get(key) or 0) + amount
+        self.data[key] = str(value)
+        return value
+
+    def _incr(self, key):
+        return self._incrby(key, 1)
+
+    def _expire(self, key, ttl):
+        if key in self.data:
+            self.expiry[key] = time.monotonic() + ttl
+            return True
+        return False
+
+    def _sadd(self, key, *members):
+        members_set = self.data.setdefault(key, set())
+        before = len(members_set)
+        members_set.update(members)
+        return len(members_set) - before
+
+    def _srem(self, key, *members):
+        members_set = self.data.get(key, set())
+        before = len(members_set)
+        members_set.difference_update(members)
+        return before - len(members_set)
+
+    def _smembers(self, key):
+        return set(self.data.get(key, set())) if self._alive(key) else set()
+
+    def _zadd(self, key, mapping, nx=False, gt=False):
+        scores = self.data.setdefault(key, {})
+        added = 0
+        for member, score in mapping.items():
+            current = scores.get(member)
+            if current is None:
+                added += 1
+            elif nx or (gt and score <= current):
+                continue
+            scores[member] = float(score)
+        return added
+
+    def _zremrangebyscore(self, key, low, high):
+        scores = self.data.get(key, {})
+        low, high = float(low), float(high)  # float() accepts "-inf" / "+inf" too
+        doomed = [member for member, score in scores.items() if low <= score <= high]
+        for member in doomed:
+            del scores[member]
+        return len(doomed)
+
+    def _zrange(self, key, start, end, withscores=False):
+        ordered = sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+        ordered = ordered[start:None if end == -1 else end + 1]
+        return ordered if withscores else [member for member, _ in ordered]
+
+    def _lpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        items = self.data.setdefault(key, {})
+        if mapping:
+            items.update(mapping)
+        if field is not None:
+            items[field] = value
+        return 1
+
+    def _hgetall(self, key):
+        return dict(self.data.get(key, {})) if self._alive(key) else {}
+
+    def _hdel(self, key, *fields):
+        items = self.data.get(key, {})
+        return sum(1 for field in fields if items.pop(field, None) is not None)
+
+    def _publish(self, channel, message):
+        self.published.append((channel, message))
+        subscribers = self.__dict__.get("subscribers", {}).get(channel, ())
+        for pubsub in subscribers:
+            pubsub.queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(subscribers)
+
+    def _eval(self, script, numkeys, *keys_and_args):
+        """The service's Lua scripts, emulated"""
+        keys, args = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        if script == RELEASE_LOCK_SCRIPT:
+            return self._delete(keys[0]) if self._get(keys[0]) == args[0] else 0
+        raise NotImplementedError("script not emulated")
+
+    def _keys(self, pattern="*"):
+        return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatch(key, pattern)]
+
+    def __getattr__(self, name):
+        impl = self.__dict__.get("_impl_cache", {}).get(name)
+        if impl is None:
+            sync = getattr(type(self), f"_{name}", None)
+            if sync is None:
+                raise AttributeError(name)
+
+            async def impl(*args, **kwargs):
+                await self._rtt()
+                return sync(self, *args, **kwargs)
+
+            self.__dict__.setdefault("_impl_cache", {})[name] = impl
+        return impl
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False):
+        return FakePubSub(self)
+
+    async def ping(self):
+        await self._rtt()
+        return True
+
+    async def close(self):
+        pass
+
+
+class FakePipeline:
+    """Buffers commands and executes them in a single simulated round-trip"""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands: List[tuple] = []
+
+    def __getattr__(self, name):
+        sync = getattr(FakeRedis, f"_{name}", None)
+        if sync is None:
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((sync, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        await self.redis._rtt()
+        results = [sync(self.redis, *args, **kwargs) for sync, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePubSub:
+    """Channel subscriptions on a FakeRedis; every FakeRedis client sharing it is one server"""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.channels: List[str] = []
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        subscribers = self.redis.__dict__.setdefault("subscribers", {})
+        for channel in channels:
+            subscribers.setdefault(channel, []).append(self)
+            self.channels.append(channel)
+
+    async def unsubscribe(self, *channels):
+        subscribers = self.redis.__dict__.get("subscribers", {})
+        for channel in channels or list(self.channels):
+            if self in subscribers.get(channel, ()):
+                subscribers[channel].remove(self)
+            self.channels.remove(channel)
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        await self.unsubscribe()
+
+
+class FakeDatabase:
+    """DatabaseManager stand-in answering queries from Python handlers
+
+    ``handlers`` maps a registered query name (or a substring of ad-hoc SQL)
+    to ``callable(args) -> rows``. Unmatched queries return no rows.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.queries: Dict[str, str] = {}
+        self.handlers: Dict[str, Callable[[Sequence[Any]], List[Dict[str, Any]]]] = {}
+        self.calls = 0
+
+    def register(self, name: str, sql: str, **kwargs):
+        self.queries[name] = sql
+
+    def on(self, key: str, handler: Callable[[Sequence[Any]], List[Dict[str, Any]]]):
+        self.handlers[key] = handler
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def warm_pool(self, connections=None):
+        pass
+
+    def _answer(self, query: str, args) -> List[Dict[str, Any]]:
+        handler = self.handlers.get(query)
+        if handler is None:
+            for key, candidate in self.handlers.items():
+                if key in query:
+                    handler = candidate
+                    break
+        return handler(args) if handler else []
+
+    async def execute_query(self, query: str, *args, readonly: bool = False, timeout=None):
+        self.calls += 1
+        await _latency(self.latency, self.jitter)
+        return self._answer(query, args)
+
+    async def execute_one(self, query: str, *args, readonly: bool = False, timeout=None):
+        rows = await self.execute_query(query, *args)
+        return rows[0] if rows else None
+
+    async def execute(self, query: str, *args, timeout=None):
+        await self.execute_query(query, *args)
+        return "INSERT 0 1"
+
+    async def executemany(self, query: str, args_list, timeout=None):
+        self.calls += 1
+        await _latency(self.latency, self.jitter)
+
+    async def copy_records(self, table: str, records, columns, timeout=None):
+        self.calls += 1
+        await _latency(self.latency, self.jitter)
+        return f"COPY {len(list(records))}"
+
+    def get_pool_stats(self):
+        return {}
+
+
+def fake_token_verifier(db: Optional[FakeDatabase] = None) -> TokenVerifier:
+    """TokenVerifier signing with BENCH_JWT_SECRET, for which every device is active"""
+    db = db or FakeDatabase()
+    db.on("FROM devices", lambda query_args: [{"is_active": True, "api_tier": "enterprise"}])
+    return TokenVerifier(db, BENCH_JWT_SECRET)
+
+
+def seed_threat_rows(count: int, malicious_domains: Sequence[str]) -> List[Dict[str, Any]]:
+    """Threat rows shaped like SELECT * FROM threats"""
+    now = datetime.utcnow()
+    types = ["phishing", "malware", "scam", "suspicious"]
+    return [
+        {
+            "id": uuid.uuid4(),
+            "type": types[i % len(types)],
+            "indicators": {"domains": [malicious_domains[i % len(malicious_domains)]]},
+            "risk_score": 50 + i % 50,
+            "confidence": 0.9,
+            "first_seen": now - timedelta(minutes=i),
+            "tags": ["IN"],
+            "description": f"Seeded threat {i}",
+            "expires_in": None,  # computed by threat.domain_reputation
+        }
+        for i in range(count)
+    ]
+
+
+class FakeWebSocket:
+    """Starlette WebSocket stand-in with configurable send latency"""
+
+    def __init__(self, send_latency: float = 0.0):
+        self.send_latency = send_latency
+        self.sent = 0
+        self.sent_bytes = 0
+        self.closed = False
+        self.close_code: Optional[int] = None
+
+    async def accept(self, subprotocol=None, headers=None):
+        pass
+
+    async def send_text(self, data: str):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent += 1
+        self.sent_bytes += len(data)
+
+    async def send_bytes(self, data: bytes):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent += 1
+        self.sent_bytes += len(data)
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        self.closed = True
+        self.close_code = code
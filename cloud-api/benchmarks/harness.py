@@ -0,0 +1,97 @@
+"""
+PocketShield Benchmark Harness
+Closed-loop load generation, latency percentiles and machine-readable results
+"""
+
+import asyncio
+import json
+import os
+import platform
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(int(q * len(sorted_samples)), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+@dataclass
+class BenchmarkResult:
+    scenario: str
+    operations: int
+    duration_s: float
+    throughput_ops: float
+    latency_ms: Dict[str, float]
+    config: Dict[str, Any] = field(default_factory=dict)
+    extra: Dict[str, Any] = field(default_factory=dict)
+    python: str = platform.python_version()
+    timestamp: float = field(default_factory=time.time)
+
+    def summary(self) -> str:
+        lat = self.latency_ms
+        return (
+            f"{self.scenario:<16} {self.throughput_ops:>12,.0f} ops/s  "
+            f"p50={lat['p50']:.3f}ms p99={lat['p99']:.3f}ms p999={lat['p999']:.3f}ms max={lat['max']:.3f}ms"
+        )
+
+
+def summarize(scenario: str, samples: List[float], duration: float, config: Dict[str, Any], **extra) -> BenchmarkResult:
+    """Build a result from per-operation latencies in seconds"""
+    samples = sorted(samples)
+    to_ms = 1000.0
+    return BenchmarkResult(
+        scenario=scenario,
+        operations=len(samples),
+        duration_s=duration,
+        throughput_ops=len(samples) / duration if duration else 0.0,
+        latency_ms={
+            "mean": (sum(samples) / len(samples) * to_ms) if samples else 0.0,
+            "p50": percentile(samples, 0.50) * to_ms,
+            "p99": percentile(samples, 0.99) * to_ms,
+            "p999": percentile(samples, 0.999) * to_ms,
+            "max": (samples[-1] * to_ms) if samples else 0.0,
+        },
+        config=config,
+        extra=extra,
+    )
+
+
+async def run_closed_loop(
+    operation: Callable[[int], Awaitable[Any]],
+    total: int,
+    concurrency: int,
+    warmup: int = 0,
+) -> tuple:
+    """Run ``total`` operations from ``concurrency`` workers; return (samples, duration)"""
+    for i in range(warmup):
+        await operation(i)
+
+    samples: List[float] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await operation(i)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def write_results(results: List[BenchmarkResult], path: Optional[str]):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"results": [asdict(r) for r in results]}, f, indent=2, default=str)
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path) as f:
+        return {r["scenario"]: r for r in json.load(f)["results"]}
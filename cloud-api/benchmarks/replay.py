@@ -0,0 +1,392 @@
+"""
+PocketShield Traffic Replay
+Replays capture files written by app.traffic_capture against a build
+
+HTTP records are rebuilt into requests with the same route, batch size, URL
+and host repetition, feed filters and per-device distribution, then sent
+open-loop at the recorded arrival times divided by --speed. Latency is
+measured from each request's scheduled time, so a build that falls behind
+shows up as queueing delay instead of a lower send rate.
+
+Usage:
+    python -m benchmarks.replay /captures/capture-*.jsonl.gz --output benchmarks/results/replay-base.json
+    python -m benchmarks.replay /captures/*.jsonl.gz --speed 4 --output benchmarks/results/replay-4x.json
+    python -m benchmarks.replay /captures/*.jsonl.gz --target https://staging.pocketshield.security --token $TOKEN
+    python -m benchmarks.compare benchmarks/results/replay-base.json benchmarks/results/replay-4x.json
+
+WebSocket events (connect/disconnect/fan-out) are replayed against an
+in-process WebSocketManager with fake sockets. With --target they drive the
+deployed /ws route instead: one client socket per captured device, opened,
+subscribed, pinged and closed on the recorded schedule. Fan-outs originate on
+the server, so remotely they show up only as frames the replayed sockets
+receive. Pass --jwt-secret for per-device tokens; with one fixed --token every
+connect replaces the previous socket.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+import jwt
+import websockets
+
+from app.indicators import hash_canonical
+from app.traffic_capture import read_capture
+from benchmarks.fakes import FakeRedis, FakeWebSocket, fake_token_verifier
+from benchmarks.harness import BenchmarkResult, summarize, write_results
+
+IN_PROCESS_BASE_URL = "http://api.pocketshield.security"
+
+
+def load_trace(paths: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Merge per-worker capture files into one timeline ordered by arrival"""
+    events = []
+    for path in paths:
+        records = read_capture(path)
+        header = next(records)
+        for record in records:
+            record["at"] = header["started_at"] + record["t"]
+            events.append(record)
+
+    events.sort(key=lambda record: record["at"])
+    if limit:
+        events = events[:limit]
+    if events:
+        origin = events[0]["at"]
+        for record in events:
+            record["at"] -= origin
+    return events
+
+
+# Indicator hashes of the hosts replayed URLs mark malicious; the fake DB matches on these
+MALICIOUS_HOST_HASHES: Set[bytes] = set()
+
+
+def _is_malicious(host_hash: str, ratio: float) -> bool:
+    # Stable per host so every repeat of a host gets the same verdict
+    return int(hashlib.sha256(host_hash.encode()).hexdigest()[:8], 16) < ratio * 0xFFFFFFFF
+
+
+def build_request(record: Dict[str, Any], malicious_ratio: float) -> Optional[Dict[str, Any]]:
+    """Rebuild method/path/body for a captured HTTP record; None if not replayable"""
+    route, shape = record.get("r"), record.get("q", {})
+
+    if route == "/threat/analyze/url" and "u" in shape:
+        urls = []
+        for url_id, host_hash, length in zip(shape["u"], shape["h"], shape["len"]):
+            host = f"h-{host_hash}.replay.example"
+            if _is_malicious(host_hash, malicious_ratio):
+                host = f"malicious-{host_hash}.replay.example"
+                MALICIOUS_HOST_HASHES.add(hash_canonical(host))
+            url = f"https://{host}/{url_id}"
+            urls.append(url + "?p=" + "x" * max(0, length - len(url) - 3))
+        return {"method": "POST", "path": route, "json": {"urls": urls, "context": {"source": "replay"}}}
+
+    if route == "/threat/analyze/app" and "apps" in shape:
+        apps = [
+            {"package_name": f"com.replay.{app_id}", "version": "1.0.0", "permissions": [], "install_source": "replay"}
+            for app_id in shape["apps"]
+        ]
+        return {"method": "POST", "path": route, "json": {"apps": apps}}
+
+    if route == "/threat/feed":
+        params = {"limit": shape.get("limit", 100)}
+        if shape.get("types"):
+            params["types"] = ",".join(shape["types"])
+        if shape.get("since_s") is not None:
+            params["since"] = (datetime.utcnow() - timedelta(seconds=shape["since_s"])).isoformat()
+        return {"method": "GET", "path": route, "params": params}
+
+    if route == "/health":
+        return {"method": "GET", "path": route}
+
+    return None
+
+
+def setup_in_process(args):
+    """Wire app.main to fakes and seed the domains replayed URLs resolve to"""
+    from benchmarks.run import build_environment
+
+    env = build_environment(args)
+    main = env["main"]
+    threat_row = {
+        "type": "phishing", "risk_score": 90, "confidence": 0.95,
+        "description": "Replayed malicious host", "tags": ["replay"], "expires_in": None,
+    }
+    env["db"].on(
+        "threat.domain_reputation",
+        lambda query_args: [threat_row] if MALICIOUS_HOST_HASHES.intersection(query_args[0]) else [],
+    )
+    main.usage_meter.set_routes(main.app.routes)
+    return env
+
+
+class TokenSource:
+    """Bearer tokens per captured device hash (or one fixed token)"""
+
+    def __init__(self, secret: str, algorithm: str, fixed: Optional[str] = None):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.fixed = fixed
+        self._tokens: Dict[str, str] = {}
+
+    def token(self, device_hash: Optional[str]) -> str:
+        if self.fixed:
+            return self.fixed
+        device_id = f"replay-{device_hash or 'anonymous'}"
+        token = self._tokens.get(device_id)
+        if token is None:
+            payload = {"device_id": device_id, "exp": datetime.utcnow() + timedelta(days=1)}
+            token = self._tokens[device_id] = jwt.encode(payload, self.secret, algorithm=self.algorithm)
+        return token
+
+    def header(self, device_hash: Optional[str]) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token(device_hash)}"}
+
+
+async def replay_http(args, events: List[Dict[str, Any]], client: httpx.AsyncClient, tokens: TokenSource):
+    """Open-loop replay; returns per-route latency samples and status counts"""
+    samples: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    skipped = Counter()
+    tasks = []
+
+    async def fire(route: str, request: Dict[str, Any], scheduled: float, device_hash: Optional[str]):
+        async with in_flight:
+            try:
+                response = await client.request(
+                    request["method"], request["path"],
+                    json=request.get("json"), params=request.get("params"),
+                    headers=tokens.header(device_hash),
+                )
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+        samples[route].append(time.perf_counter() - scheduled)
+        statuses[route][status] += 1
+
+    start = time.perf_counter()
+    for record in events:
+        request = build_request(record, args.malicious_ratio)
+        if request is None:
+            skipped[record.get("r", "unknown")] += 1
+            continue
+        scheduled = start + record["at"] / args.speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(record["r"], request, scheduled, record.get("d"))))
+
+    await asyncio.gather(*tasks)
+    return samples, statuses, skipped, time.perf_counter() - start
+
+
+async def replay_ws(args, events: List[Dict[str, Any]]):
+    """Replay connection churn and fan-outs against an in-process WebSocketManager"""
+    from app.websocket_service import AlertSeverity, AlertType, ThreatAlert, WebSocketManager
+
+    manager = WebSocketManager(FakeRedis(), fake_token_verifier())
+    samples: List[float] = []
+    delivered = 0
+    start = time.perf_counter()
+
+    for record in events:
+        delay = start + record["at"] / args.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        device_id = f"replay-{record.get('d')}"
+        event = record["e"]
+        if event == "connect":
+            subscriptions = set(record.get("subs") or [])
+            await manager.connect(FakeWebSocket(args.send_latency_ms / 1000), device_id, subscriptions or None)
+        elif event == "disconnect":
+            await manager.disconnect_device(device_id)
+        elif event == "fanout" and record.get("kind") == "threat_alert":
+            alert = ThreatAlert(
+                alert_id=f"replay-{len(samples)}",
+                alert_type=AlertType(record["alert_type"]),
+                severity=AlertSeverity(record["severity"]),
+                title="Replayed alert",
+                description="Replayed alert",
+                indicators={},
+                affected_regions=["IN"],
+                threat_tags=[],
+                action_required=False,
+            )
+            fanout_start = time.perf_counter()
+            delivered += await manager.send_threat_alert(alert)
+            samples.append(time.perf_counter() - fanout_start)
+        elif event == "fanout":
+            fanout_start = time.perf_counter()
+            delivered += await manager.broadcast_system_message("Replayed broadcast", record["kind"])
+            samples.append(time.perf_counter() - fanout_start)
+
+    return samples, delivered, time.perf_counter() - start
+
+
+async def replay_ws_remote(args, events: List[Dict[str, Any]], tokens: TokenSource):
+    """Replay connection churn and client pings against a deployed /ws route
+
+    Returns connect latencies (scheduled time to the welcome frame), connect
+    outcomes and the number of frames the target pushed to replayed sockets.
+    """
+    base = "ws" + args.target[len("http"):] if args.target.startswith("http") else args.target
+    samples: List[float] = []
+    outcomes = Counter()
+    received = 0
+    sockets: Dict[Optional[str], asyncio.Task] = {}  # device hash -> task opening its socket
+    tasks = []
+
+    async def drain(socket):
+        nonlocal received
+        try:
+            async for _ in socket:
+                received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def open_socket(device_hash: Optional[str], subscriptions: List[str], scheduled: float, previous):
+        if previous is not None:
+            await close_socket(previous)
+        try:
+            socket = await websockets.connect(
+                f"{base}/ws?token={tokens.token(device_hash)}", open_timeout=args.timeout
+            )
+            welcome = json.loads(await asyncio.wait_for(socket.recv(), args.timeout))
+        except websockets.ConnectionClosed as e:
+            outcomes[f"closed:{e.rcvd.code if e.rcvd else 1006}"] += 1
+            return None
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            outcomes[type(e).__name__] += 1
+            return None
+        samples.append(time.perf_counter() - scheduled)
+        outcomes[welcome.get("message_type", "unknown")] += 1
+        if subscriptions:
+            await socket.send(json.dumps({"type": "subscribe", "threat_types": subscriptions}))
+        tasks.append(asyncio.create_task(drain(socket)))
+        return socket
+
+    async def close_socket(opening: asyncio.Task):
+        socket = await opening
+        if socket is not None:
+            await socket.close()
+
+    async def ping(opening: asyncio.Task):
+        socket = await opening
+        if socket is not None:
+            try:
+                await socket.send(json.dumps({"type": "ping"}))
+            except websockets.ConnectionClosed:
+                pass
+
+    start = time.perf_counter()
+    for record in events:
+        scheduled = start + record["at"] / args.speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        device_hash, event = record.get("d"), record["e"]
+        if event == "connect":
+            sockets[device_hash] = asyncio.create_task(
+                open_socket(device_hash, record.get("subs") or [], scheduled, sockets.get(device_hash))
+            )
+        elif event == "disconnect" and device_hash in sockets:
+            tasks.append(asyncio.create_task(close_socket(sockets.pop(device_hash))))
+        elif event == "message" and record.get("type") == "ping" and device_hash in sockets:
+            tasks.append(asyncio.create_task(ping(sockets[device_hash])))
+
+    await asyncio.gather(*(close_socket(opening) for opening in sockets.values()))
+    await asyncio.gather(*tasks)
+    return samples, outcomes, received, time.perf_counter() - start
+
+
+async def run(args) -> List[BenchmarkResult]:
+    events = load_trace(args.captures, args.limit)
+    http_events = [record for record in events if record["k"] == "http"]
+    ws_events = [record for record in events if record["k"] == "ws"]
+    config = {key: value for key, value in vars(args).items() if key not in ("token", "jwt_secret")}
+    results = []
+
+    if args.target == "inprocess":
+        env = setup_in_process(args)
+        main = env["main"]
+        transport = httpx.ASGITransport(app=main.app)
+        client = httpx.AsyncClient(transport=transport, base_url=IN_PROCESS_BASE_URL)
+        tokens = TokenSource(main.JWT_SECRET, main.JWT_ALGORITHM)
+    else:
+        client = httpx.AsyncClient(base_url=args.target, timeout=args.timeout)
+        tokens = TokenSource(args.jwt_secret or "", "HS256", fixed=args.token)
+
+    async with client:
+        samples, statuses, skipped, duration = await replay_http(args, http_events, client, tokens)
+
+    all_samples = [sample for route_samples in samples.values() for sample in route_samples]
+    if all_samples:
+        results.append(summarize(
+            "replay", all_samples, duration, config,
+            recorded_duration_s=http_events[-1]["at"] if http_events else 0.0,
+            skipped=dict(skipped),
+        ))
+    for route, route_samples in sorted(samples.items()):
+        results.append(summarize(f"replay:{route}", route_samples, duration, config, statuses=dict(statuses[route])))
+
+    if ws_events and args.target == "inprocess":
+        ws_samples, delivered, ws_duration = await replay_ws(args, ws_events)
+        results.append(summarize(
+            "replay:ws_fanout", ws_samples, ws_duration, config,
+            messages_per_second=delivered / ws_duration if ws_duration else 0.0,
+        ))
+    elif ws_events:
+        ws_samples, outcomes, received, ws_duration = await replay_ws_remote(args, ws_events, tokens)
+        results.append(summarize(
+            "replay:ws_connect", ws_samples, ws_duration, config,
+            outcomes=dict(outcomes), frames_received=received,
+        ))
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured PocketShield traffic")
+    parser.add_argument("captures", nargs="+", help="capture-*.jsonl.gz files from TRAFFIC_CAPTURE_DIR")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' (fakes) or a base URL")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival rate multiplier")
+    parser.add_argument("--limit", type=int, help="Replay only the first N events")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--token", help="Bearer token for every request (remote targets)")
+    parser.add_argument("--jwt-secret", help="Mint per-device tokens with this secret (remote targets)")
+    parser.add_argument("--malicious-ratio", type=float, default=0.05, help="Share of hosts the fake DB flags")
+    parser.add_argument("--send-latency-ms", type=float, default=0.0)
+    # Fake backend settings shared with benchmarks.run (in-process target only)
+    parser.add_argument("--redis-latency-ms", type=float, default=0.2)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--feed-rows", type=int, default=1000)
+    parser.add_argument("--malicious-domains", type=int, default=1000)
+    parser.add_argument("--output", help="Write JSON results to this path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    for result in results:
+        print(result.summary())
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+PocketShield Benchmark Suite
+Drives the hot paths against in-process Redis/Postgres fakes with latency injection
+
+Usage:
+    python -m benchmarks.run --scenario all --output benchmarks/results/latest.json
+    python -m benchmarks.run --scenario ws_fanout --connections 100000
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/latest.json
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List
+
+from app.indicators import hash_canonical
+from benchmarks.fakes import FakeDatabase, FakeRedis, FakeWebSocket, fake_token_verifier, seed_threat_rows
+from benchmarks.harness import BenchmarkResult, run_closed_loop, summarize, write_results
+
+SCENARIOS = ["url_analysis", "feed", "app_analysis", "ws_fanout"]
+
+
+def build_environment(args) -> Dict[str, Any]:
+    """Point app.main's globals at fakes and seed threat data"""
+    from app import main
+
+    redis_latency = args.redis_latency_ms / 1000
+    db_latency = args.db_latency_ms / 1000
+    jitter = args.jitter_ms / 1000
+
+    fake_redis = FakeRedis(redis_latency, jitter)
+    fake_db = FakeDatabase(db_latency, jitter)
+
+    malicious_domains = [f"malicious-{i}.example" for i in range(args.malicious_domains)]
+    threat_rows = seed_threat_rows(args.feed_rows, malicious_domains)
+    # The lookup receives indicator hashes of the host and its parent domains
+    malicious = {hash_canonical(domain) for domain in malicious_domains}
+
+    fake_db.on(
+        "threat.domain_reputation",
+        lambda query_args: threat_rows[:1] if malicious.intersection(query_args[0]) else [],
+    )
+    fake_db.on("FROM threats", lambda query_args: threat_rows[: query_args[-1]])
+    fake_db.on("FROM devices", lambda query_args: [{"is_active": True, "api_tier": "enterprise"}])
+
+    cache = main.CacheManager()
+    cache.redis = fake_redis
+
+    main.db_manager = fake_db
+    main.cache_manager = cache
+    # Services constructed at import time hold their own reference to the real manager
+    for service in (main.token_verifier, main.rate_limiter, main.usage_meter, main.evidence_store,
+                    main.prefix_snapshots, main.brand_protection):
+        service.db = fake_db
+    main.threat_service = main.ThreatIntelligenceService(fake_db, cache, main.brand_protection, main.url_enricher)
+
+    return {"main": main, "redis": fake_redis, "db": fake_db, "malicious_domains": malicious_domains}
+
+
+def make_url_batches(args, malicious_domains: List[str]) -> List[List[str]]:
+    """URL batches with a configurable share of repeats (cache hits) and malicious hosts"""
+    rng = random.Random(args.seed)
+    pool_size = max(1, int(args.requests * args.batch_size * args.unique_ratio))
+    url_pool = []
+    for i in range(pool_size):
+        if rng.random() < args.malicious_ratio:
+            host = rng.choice(malicious_domains)
+        else:
+            host = f"site-{i}.example.com"
+        url_pool.append(f"https://{host}/path/{i}?ref=bench")
+    return [
+        [rng.choice(url_pool) for _ in range(args.batch_size)]
+        for _ in range(args.requests)
+    ]
+
+
+async def bench_url_analysis(args, env) -> BenchmarkResult:
+    main = env["main"]
+    batches = make_url_batches(args, env["malicious_domains"])
+
+    async def operation(i):
+        request = main.ThreatAnalysisRequest(urls=batches[i % len(batches)], context={"source": "bench"})
+        await main.analyze_urls(request, device_id="bench-device")
+
+    samples, duration = await run_closed_loop(operation, args.requests, args.concurrency)
+    return summarize(
+        "url_analysis", samples, duration, vars(args),
+        urls_per_second=len(samples) * args.batch_size / duration,
+        redis_commands=env["redis"].commands,
+        db_calls=env["db"].calls,
+    )
+
+
+async def bench_feed(args, env) -> BenchmarkResult:
+    main = env["main"]
+    filters = [None, "phishing", "phishing,malware", "scam"]
+
+    async def operation(i):
+        await main.get_threat_feed(
+            types=filters[i % len(filters)], since=None, limit=args.feed_limit, device_id="bench-device"
+        )
+
+    samples, duration = await run_closed_loop(operation, args.requests, args.concurrency)
+    return summarize("feed", samples, duration, vars(args))
+
+
+async def bench_app_analysis(args, env) -> BenchmarkResult:
+    main = env["main"]
+    rng = random.Random(args.seed)
+    apps = [
+        {
+            "package_name": rng.choice(["com.malicious.app", f"com.example.app{i}"]),
+            "version": "1.0.0",
+            "permissions": ["CAMERA", "LOCATION"],
+            "install_source": "play_store",
+        }
+        for i in range(args.batch_size)
+    ]
+
+    async def operation(i):
+        await main.analyze_apps(main.AppAnalysisRequest(apps=apps), device_id="bench-device")
+
+    samples, duration = await run_closed_loop(operation, args.requests, args.concurrency)
+    return summarize("app_analysis", samples, duration, vars(args))
+
+
+async def bench_ws_fanout(args, env) -> BenchmarkResult:
+    from app.websocket_service import WebSocketManager, create_phishing_alert
+
+    manager = WebSocketManager(FakeRedis(), fake_token_verifier(), cluster=False)
+    # Per-alert fan-out cost; batching is measured by bench_ws_coalescing
+    manager.coalescer.config.window = 0
+    sockets = []
+    connect_start = time.perf_counter()
+    for i in range(args.connections):
+        # The first --slow-clients connections take seconds per send
+        latency = 5.0 if i < args.slow_clients else args.send_latency_ms / 1000
+        websocket = FakeWebSocket(latency)
+        sockets.append(websocket)
+        await manager.connect(websocket, f"device-{i}", subscriptions={"new_threat"})
+    connect_duration = time.perf_counter() - connect_start
+
+    samples = []
+    delivered = 0
+    start = time.perf_counter()
+    for i in range(args.alerts):
+        alert = await create_phishing_alert({"domains": [f"campaign-{i}.example"]}, "Benchmark campaign")
+        alert_start = time.perf_counter()
+        delivered += await manager.send_threat_alert(alert)
+        samples.append(time.perf_counter() - alert_start)
+    # Fan-out only queues; wait for the writers of every healthy client to finish
+    fast = sockets[args.slow_clients:]
+    while any(ws.sent < args.alerts + 1 for ws in fast):
+        await asyncio.sleep(0.005)
+    duration = time.perf_counter() - start
+    for connection_id in list(manager.active_connections):
+        await manager.disconnect(connection_id)
+
+    return summarize(
+        "ws_fanout", samples, duration, vars(args),
+        connections=args.connections,
+        connect_per_second=args.connections / connect_duration,
+        messages_per_second=delivered / duration if duration else 0.0,
+        bytes_sent=sum(ws.sent_bytes for ws in sockets),
+    )
+
+
+BENCHMARKS = {
+    "url_analysis": bench_url_analysis,
+    "feed": bench_feed,
+    "app_analysis": bench_app_analysis,
+    "ws_fanout": bench_ws_fanout,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PocketShield benchmark suite")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=10, help="URLs/apps per request")
+    parser.add_argument("--unique-ratio", type=float, default=0.3, help="Distinct URLs / total URLs")
+    parser.add_argument("--malicious-ratio", type=float, default=0.05)
+    parser.add_argument("--malicious-domains", type=int, default=1000)
+    parser.add_argument("--feed-rows", type=int, default=1000)
+    parser.add_argument("--feed-limit", type=int, default=100)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--alerts", type=int, default=20)
+    parser.add_argument("--send-latency-ms", type=float, default=0.0)
+    parser.add_argument("--slow-clients", type=int, default=0, help="ws_fanout connections with 5s sends")
+    parser.add_argument("--redis-latency-ms", type=float, default=0.2)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write JSON results to this path")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> List[BenchmarkResult]:
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    results = []
+    for scenario in scenarios:
+        # Fresh fakes per scenario so caches/counters don't leak between runs
+        env = build_environment(args)
+        result = await BENCHMARKS[scenario](args, env)
+        print(result.summary())
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Content-addressed evidence storage
+
+-- Evidence blobs (content lives in the blob backend, keyed by SHA-256)
+CREATE TABLE evidence_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size_bytes BIGINT NOT NULL CHECK (size_bytes >= 0),
+    content_type VARCHAR(255) NOT NULL DEFAULT 'application/octet-stream',
+    storage_backend VARCHAR(50) NOT NULL DEFAULT 'local',
+    created_at TIMESTAMP DEFAULT NOW(),
+    last_referenced_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Evidence attached to incident reports
+CREATE TABLE incident_evidence (
+    incident_id UUID REFERENCES incident_reports(id) ON DELETE CASCADE,
+    sha256 CHAR(64) REFERENCES evidence_blobs(sha256),
+    name VARCHAR(255),
+    content_type VARCHAR(255),
+    size_bytes BIGINT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (incident_id, sha256)
+);
+
+-- Create indexes for incident evidence
+CREATE INDEX idx_incident_evidence_sha256 ON incident_evidence(sha256);
@@ -0,0 +1,12 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Tier/endpoint rate limit quotas (refreshed by the API without a restart)
+
+-- Quotas are [requests, period_seconds]; "default" applies to endpoints not listed.
+-- max_api_requests_per_hour still sets the premium default.
+INSERT INTO system_config (key, value, description) VALUES
+('rate_limit_quotas', '{
+    "free": {"default": [100, 60], "threat:analyze_url": [100, 60], "device:assess": [10, 60]},
+    "premium": {"threat:analyze_url": [1000, 60]},
+    "enterprise": {"default": [100000, 3600], "threat:analyze_url": [5000, 60]}
+}', 'Rate limit quotas per API tier and endpoint')
+ON CONFLICT (key) DO NOTHING;
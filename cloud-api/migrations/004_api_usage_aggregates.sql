@@ -0,0 +1,11 @@
+-- PocketShield Threat Intelligence Database Schema
+-- api_usage_stats rows are per-minute aggregates written by the usage meter
+
+-- One row covers request_count requests for (device, endpoint, method, status, minute).
+-- response_time_ms is the average, request/response sizes are totals.
+ALTER TABLE api_usage_stats
+    ADD COLUMN request_count INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN max_response_time_ms INTEGER;
+
+-- Per-device usage per billing period
+CREATE INDEX idx_api_usage_device_created ON api_usage_stats(device_id, created_at DESC);
@@ -0,0 +1,60 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Normalized indicator index and bulk feed ingestion bookkeeping
+
+-- One row per (indicator, threat). value_hash is SHA-256 of the canonical value
+-- (see app/indicators.py), so the primary key B-tree answers hot lookups with an
+-- index-only scan instead of a GIN probe into threats.indicators.
+CREATE TABLE threat_indicators (
+    kind VARCHAR(20) NOT NULL CHECK (kind IN ('domain', 'url', 'ip', 'file_hash', 'app_package')),
+    value_hash BYTEA NOT NULL,
+    value TEXT NOT NULL,
+    threat_id UUID NOT NULL REFERENCES threats(id) ON DELETE CASCADE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (kind, value_hash, threat_id)
+);
+
+CREATE INDEX idx_threat_indicators_threat ON threat_indicators(threat_id);
+
+-- Feed records are upserted by the id the feed gives them
+ALTER TABLE threats ADD COLUMN external_id TEXT;
+CREATE UNIQUE INDEX idx_threats_source_external ON threats(source_id, external_id);
+
+-- Incremental sync state per feed
+ALTER TABLE threat_sources
+    ADD COLUMN watermark TIMESTAMP,
+    ADD COLUMN last_sync_stats JSONB;
+CREATE UNIQUE INDEX idx_threat_sources_name ON threat_sources(name);
+
+-- Threats written outside feed ingestion (analyst tools, imports, manual SQL)
+-- are queued here and indexed from threats.indicators by
+-- `python -m app.feed_ingestion backfill`, which every feed sync run also does
+-- first (canonicalization lives in app/indicators.py). Feed ingestion writes
+-- threat_indicators itself and sets pocketshield.indexed_writer for its
+-- transactions, so its rows are not queued.
+CREATE TABLE threat_index_queue (
+    threat_id UUID PRIMARY KEY REFERENCES threats(id) ON DELETE CASCADE,
+    queued_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION queue_threat_indexing()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO threat_index_queue (threat_id) VALUES (NEW.id)
+    ON CONFLICT (threat_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER queue_threat_inserts AFTER INSERT ON threats
+    FOR EACH ROW
+    WHEN (current_setting('pocketshield.indexed_writer', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION queue_threat_indexing();
+
+CREATE TRIGGER queue_threat_indicator_updates AFTER UPDATE OF indicators ON threats
+    FOR EACH ROW
+    WHEN (OLD.indicators IS DISTINCT FROM NEW.indicators
+          AND current_setting('pocketshield.indexed_writer', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION queue_threat_indexing();
+
+-- Every threat that predates the index
+INSERT INTO threat_index_queue (threat_id) SELECT id FROM threats;
@@ -0,0 +1,17 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Versioned hash-prefix snapshots for on-device URL checks
+
+-- prefixes is the sorted, concatenated list of distinct 4-byte prefixes of
+-- active domain/ip/url indicator hashes; checksum is SHA-256 of it. Devices
+-- fetch deltas between retained versions (see app/hash_prefix.py).
+CREATE TABLE threat_prefix_snapshots (
+    version BIGSERIAL PRIMARY KEY,
+    prefix_count INTEGER NOT NULL,
+    checksum BYTEA NOT NULL,
+    prefixes BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Full-hash lookups by prefix
+CREATE INDEX idx_threat_indicators_prefix ON threat_indicators (substring(value_hash from 1 for 4))
+    WHERE kind IN ('domain', 'ip', 'url');
@@ -0,0 +1,26 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Protected brands for typosquat/homoglyph detection (app/brand_protection.py)
+
+-- name is matched against host labels after confusable folding; domains are the
+-- brand's own registrable domains, which are never flagged. Rows are merged over
+-- the built-in defaults and reloaded by each worker every BRAND_REFRESH_INTERVAL.
+CREATE TABLE protected_brands (
+    name VARCHAR(100) PRIMARY KEY,
+    domains TEXT[] NOT NULL DEFAULT '{}',
+    enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO protected_brands (name, domains) VALUES
+('googlepay', '{google.com}'),
+('bhimupi', '{bhimupi.org.in,npci.org.in}'),
+('airtel', '{airtel.in,airtel.com}'),
+('jiomart', '{jiomart.com,jio.com}'),
+('myntra', '{myntra.com}'),
+('swiggy', '{swiggy.com,swiggy.in}'),
+('zomato', '{zomato.com}'),
+('epfindia', '{epfindia.gov.in}'),
+('uidai', '{uidai.gov.in}'),
+('indiapost', '{indiapost.gov.in}')
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,20 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Durable WebSocket alert log with per-device cursors (app/alert_log.py)
+
+-- Each threat alert is written once as a shared row (device_id NULL). seq orders
+-- the log and is the message_id clients acknowledge; target_devices is NULL for
+-- alerts sent to every matching subscriber. Delivery is tracked by cursors
+-- rather than the per-row delivered/delivered_at columns.
+ALTER TABLE real_time_alerts
+    ADD COLUMN seq BIGSERIAL,
+    ADD COLUMN target_devices TEXT[];
+
+CREATE UNIQUE INDEX idx_alerts_seq ON real_time_alerts(seq);
+CREATE INDEX idx_alerts_shared_created ON real_time_alerts(created_at) WHERE device_id IS NULL;
+
+-- Last alert seq each device acknowledged; alerts after it are replayed on reconnect
+CREATE TABLE alert_delivery_cursors (
+    device_id VARCHAR(255) PRIMARY KEY REFERENCES devices(device_id) ON DELETE CASCADE,
+    last_acked_seq BIGINT NOT NULL,
+    acked_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,76 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Journal of indicator hashes whose cached URL verdicts are stale (app/verdict_cache.py)
+
+-- Every change that can alter a domain/ip/url reputation lookup appends the
+-- affected indicator hashes here; API workers evict the verdicts indexed under
+-- them. Entries older than the longest verdict TTL are pruned by the workers.
+-- Workers read by writing transaction (xid) up to their snapshot's xmin, since
+-- seq values commit out of order (PostgreSQL 13+ for xid8).
+CREATE TABLE verdict_invalidations (
+    seq BIGSERIAL PRIMARY KEY,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    value_hash BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX idx_verdict_invalidations_xid ON verdict_invalidations(xid, seq);
+CREATE INDEX idx_verdict_invalidations_hash ON verdict_invalidations(value_hash, created_at);
+CREATE INDEX idx_verdict_invalidations_created ON verdict_invalidations(created_at);
+
+-- Indicators added to or removed from a threat (feed loads, threat deletes via cascade)
+CREATE OR REPLACE FUNCTION journal_added_indicators()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO verdict_invalidations (value_hash)
+    SELECT DISTINCT value_hash FROM added_indicators WHERE kind IN ('domain', 'ip', 'url');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION journal_removed_indicators()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO verdict_invalidations (value_hash)
+    SELECT DISTINCT value_hash FROM removed_indicators WHERE kind IN ('domain', 'ip', 'url');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER journal_threat_indicator_inserts AFTER INSERT ON threat_indicators
+    REFERENCING NEW TABLE AS added_indicators
+    FOR EACH STATEMENT EXECUTE FUNCTION journal_added_indicators();
+
+CREATE TRIGGER journal_threat_indicator_deletes AFTER DELETE ON threat_indicators
+    REFERENCING OLD TABLE AS removed_indicators
+    FOR EACH STATEMENT EXECUTE FUNCTION journal_removed_indicators();
+
+-- Threats whose lookup result changed: status (false_positive, expired, ...),
+-- anything returned by the lookup, an earlier expiry, or revival of an already
+-- expired threat. Feed refreshes that only extend the ttl journal nothing.
+CREATE OR REPLACE FUNCTION journal_changed_threats()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO verdict_invalidations (value_hash)
+    SELECT DISTINCT i.value_hash
+    FROM new_threats n
+    JOIN old_threats o ON o.id = n.id
+    JOIN threat_indicators i ON i.threat_id = n.id
+    WHERE i.kind IN ('domain', 'ip', 'url')
+    AND (
+        n.status IS DISTINCT FROM o.status
+        OR n.type IS DISTINCT FROM o.type
+        OR n.risk_score IS DISTINCT FROM o.risk_score
+        OR n.confidence IS DISTINCT FROM o.confidence
+        OR n.description IS DISTINCT FROM o.description
+        OR n.tags IS DISTINCT FROM o.tags
+        OR (n.ttl <> 0 AND (o.ttl = 0
+            OR n.first_seen + INTERVAL '1 second' * n.ttl < o.first_seen + INTERVAL '1 second' * o.ttl))
+        OR (o.ttl <> 0 AND o.first_seen + INTERVAL '1 second' * o.ttl <= NOW())
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER journal_threat_updates AFTER UPDATE ON threats
+    REFERENCING OLD TABLE AS old_threats NEW TABLE AS new_threats
+    FOR EACH STATEMENT EXECUTE FUNCTION journal_changed_threats();
@@ -0,0 +1,7 @@
+-- PocketShield Threat Intelligence Database Schema
+-- Garbage collection of unreferenced evidence blobs (app/evidence_store.py)
+
+-- Workers delete blobs that no incident_evidence row references once
+-- last_referenced_at is older than EVIDENCE_GC_GRACE; this index keeps that
+-- scan to the stale end of the table.
+CREATE INDEX idx_evidence_blobs_last_referenced ON evidence_blobs(last_referenced_at);
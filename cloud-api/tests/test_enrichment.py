@@ -0,0 +1,137 @@
+"""
+URL enrichment against the local stand-in HTTP and DNS servers from
+benchmarks/bench_enrichment.py (no network access needed)
+"""
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from app import enrichment
+from app.enrichment import EnrichmentConfig, UrlEnricher
+from benchmarks.bench_enrichment import HOST, start_stand_ins
+
+PER_HOST_LIMIT = 3
+
+
+@pytest_asyncio.fixture
+async def stand_ins():
+    dns_transport, dns_server, http, runner = await start_stand_ins(latency=0.01)
+    try:
+        yield dns_transport, http
+    finally:
+        await runner.cleanup()
+        dns_transport.close()
+
+
+def make_enricher(dns_transport, **overrides) -> UrlEnricher:
+    options = dict(
+        enabled=True,
+        expand_all=True,
+        timeout=2.0,
+        per_host_limit=PER_HOST_LIMIT,
+        nameservers=(HOST,),
+        dns_port=dns_transport.get_extra_info("sockname")[1],
+        allow_private=True,
+    )
+    options.update(overrides)
+    return UrlEnricher(EnrichmentConfig(**options))
+
+
+@pytest_asyncio.fixture
+async def enricher(stand_ins):
+    dns_transport, _ = stand_ins
+    enricher = make_enricher(dns_transport)
+    await enricher.start()
+    try:
+        yield enricher
+    finally:
+        await enricher.stop()
+
+
+@pytest.mark.asyncio
+async def test_redirect_chain_and_final_url(stand_ins, enricher):
+    _, http = stand_ins
+    url = f"http://short.example:{http.port}/r/2/7"
+
+    result = await enricher.enrich(url)
+
+    assert result.status == "ok"
+    assert result.redirects == [
+        f"http://short.example:{http.port}/r/1/7",
+        f"http://landing-7.example:{http.port}/",
+    ]
+    assert result.final_url == f"http://landing-7.example:{http.port}/"
+    assert result.redirected
+    assert result.dns.status == "ok" and result.dns.addresses == [HOST]
+    assert result.threats() == []
+
+
+@pytest.mark.asyncio
+async def test_nxdomain(stand_ins, enricher):
+    _, http = stand_ins
+
+    result = await enricher.enrich(f"http://nx-1.example:{http.port}/r/1/1")
+
+    assert result.status == "blocked"  # nothing to connect to
+    assert result.redirects == []
+    assert result.dns.status == "nxdomain"
+    assert [threat["tags"] for threat in result.threats()] == [["enrichment", "nxdomain"]]
+
+
+@pytest.mark.asyncio
+async def test_time_budget_holds_on_hanging_host(stand_ins):
+    dns_transport, http = stand_ins
+    http.hang = 1.0  # well past the budget, short enough not to hold up server shutdown
+    enricher = make_enricher(dns_transport, timeout=0.3, hop_timeout=5.0)
+    await enricher.start()
+    try:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await asyncio.gather(*(
+            enricher.enrich(f"http://hang.example:{http.port}/slow/{i}") for i in range(5)
+        ))
+        elapsed = loop.time() - start
+    finally:
+        await enricher.stop()
+
+    assert [result.status for result in results] == ["timeout"] * 5
+    assert all(result.elapsed_ms < 500 for result in results)
+    assert elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_per_host_limit(stand_ins, enricher):
+    _, http = stand_ins
+
+    results = await asyncio.gather(*(
+        enricher.enrich(f"http://burst.example:{http.port}/r/1/burst{i}") for i in range(30)
+    ))
+
+    assert all(result.status == "ok" for result in results)
+    assert http.peak_in_flight["burst.example"] <= PER_HOST_LIMIT
+    assert http.peak_in_flight["burst.example"] == PER_HOST_LIMIT  # the limit, not serialization
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("target", [
+    "http://internal-db.example/admin",   # resolves to 10.0.0.1
+    "http://127.0.0.2/",                  # loopback literal
+    "http://169.254.169.254/latest/meta-data/",
+])
+async def test_redirect_to_internal_address_is_refused(stand_ins, monkeypatch, target):
+    dns_transport, http = stand_ins
+    # The stand-in itself listens on loopback: treat exactly that address as public
+    is_public = enrichment._is_public
+    monkeypatch.setattr(enrichment, "_is_public", lambda address: address == HOST or is_public(address))
+    enricher = make_enricher(dns_transport, allow_private=False)
+    await enricher.start()
+    try:
+        result = await enricher.enrich(f"http://redirector.example:{http.port}/goto?to={target}")
+    finally:
+        await enricher.stop()
+
+    assert result.status == "blocked"
+    assert result.redirects == [target]
+    assert http.requests == 1  # only the redirector was fetched
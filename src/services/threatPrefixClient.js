@@ -0,0 +1,297 @@
+// Threat Prefix Client - on-device URL checks against the cloud hash-prefix snapshot
+//
+// The device keeps a sorted list of 32-bit SHA-256 prefixes of malicious
+// hosts/URLs (GET /threat/prefixes, versioned with deltas). A URL is hashed the
+// same way the cloud API canonicalizes indicators (cloud-api/app/indicators.py):
+// the host, up to four parent domains and the canonical URL. Only when one of
+// those prefixes is in the local list do we ask the server for the full hashes
+// (POST /threat/prefixes/lookup), so safe browsing never leaves the device.
+//
+// The two sides can disagree on a URL's canonical form. This client hashes the
+// string it is given, while /threat/analyze/url canonicalizes the pydantic
+// HttpUrl form, which also punycodes the host, percent-encodes the path and
+// query, and adds a trailing '/'. Host checks agree for ASCII hosts; a full-URL
+// listing may only match on one side. Pass a WHATWG-normalized URL
+// (new URL(url).toString()) to get closest, and use analyzeUrl for the
+// server's verdict.
+import AsyncStorage from '@react-native-async-storage/async-storage';
+import * as Crypto from 'expo-crypto';
+
+const STORAGE_KEY = 'threat_prefix_snapshot';
+const MAX_HOST_SUFFIXES = 5;
+const DEFAULT_PORTS = { http: '80', https: '443' };
+const URL_PATTERN = /^([a-zA-Z][a-zA-Z0-9+.-]*):\/\/([^/?#]*)([^?#]*)(?:\?([^#]*))?/;
+const IPV4_PATTERN = /^\d{1,3}(\.\d{1,3}){3}$/;
+
+// Canonicalization (must match cloud-api/app/indicators.py)
+const canonicalHost = (host) => {
+  host = host.trim().split('@').pop();
+  if (host.startsWith('[')) {
+    host = host.slice(1, host.includes(']') ? host.indexOf(']') : undefined);
+  } else if (host.split(':').length === 2) {
+    host = host.split(':')[0];
+  }
+  return host.toLowerCase().replace(/\.+$/, '');
+};
+
+const canonicalUrl = (url) => {
+  url = url.trim();
+  if (!url.includes('://')) {
+    url = `http://${url}`;
+  }
+  const match = URL_PATTERN.exec(url);
+  if (!match) {
+    return null;
+  }
+  const [, rawScheme, netloc, path, query] = match;
+  const scheme = rawScheme.toLowerCase();
+  const host = canonicalHost(netloc);
+  const portMatch = /:(\d+)$/.exec(netloc.split('@').pop());
+  const port = portMatch ? String(Number(portMatch[1])) : null;
+  const authority = port && port !== DEFAULT_PORTS[scheme] ? `${host}:${port}` : host;
+  return `${scheme}://${authority}${path || '/'}${query ? `?${query}` : ''}`;
+};
+
+const hostSuffixes = (host) => {
+  host = canonicalHost(host);
+  if (IPV4_PATTERN.test(host) || host.includes(':')) {
+    return [host];
+  }
+  const labels = host.split('.');
+  const suffixes = [host];
+  for (let i = Math.max(1, labels.length - MAX_HOST_SUFFIXES); i < labels.length - 1; i++) {
+    suffixes.push(labels.slice(i).join('.'));
+  }
+  return suffixes;
+};
+
+// Binary helpers
+const base64ToBytes = (data) => {
+  const binary = atob(data || '');
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+};
+
+const bytesToBase64 = (bytes) => {
+  let binary = '';
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+};
+
+const hexToBase64 = (hex) => bytesToBase64(Uint8Array.from(hex.match(/../g).map(byte => parseInt(byte, 16))));
+
+const unpackPrefixes = (bytes) => {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const prefixes = new Uint32Array(bytes.length / 4);
+  for (let i = 0; i < prefixes.length; i++) {
+    prefixes[i] = view.getUint32(i * 4); // big-endian, so numeric order == byte order
+  }
+  return prefixes;
+};
+
+const packPrefixes = (prefixes) => {
+  const bytes = new Uint8Array(prefixes.length * 4);
+  const view = new DataView(bytes.buffer);
+  prefixes.forEach((prefix, i) => view.setUint32(i * 4, prefix));
+  return bytes;
+};
+
+const applyDelta = (prefixes, added, removed) => {
+  const removedSet = new Set(removed);
+  const merged = Array.from(prefixes).filter(prefix => !removedSet.has(prefix));
+  added.forEach(prefix => merged.push(prefix));
+  return Uint32Array.from(new Set(merged)).sort();
+};
+
+class ThreatPrefixClient {
+  constructor() {
+    this.config = {
+      apiBaseUrl: 'https://api.pocketshield.security',
+      getAuthToken: async () => AsyncStorage.getItem('accessToken'),
+    };
+    this.version = null;
+    this.prefixes = new Uint32Array(0);
+    this.nextSyncAt = 0;
+    this.fullHashCache = new Map(); // prefix (base64) -> { expiresAt, fullHashes }
+    this._syncing = null; // in-flight sync, shared by concurrent callers
+    this.loaded = this.loadSnapshot();
+  }
+
+  configure(config) {
+    this.config = { ...this.config, ...config };
+  }
+
+  async request(path, options = {}) {
+    const token = await this.config.getAuthToken();
+    const response = await fetch(`${this.config.apiBaseUrl}${path}`, {
+      ...options,
+      headers: {
+        'Content-Type': 'application/json',
+        Authorization: `Bearer ${token}`,
+        ...options.headers,
+      },
+    });
+    if (!response.ok) {
+      throw new Error(`Prefix request failed: ${response.status}`);
+    }
+    return response.json();
+  }
+
+  // Concurrent callers share one in-flight sync, so a delta is never fetched
+  // or applied twice against the same version
+  sync(force = false) {
+    this._syncing ??= this._doSync(force).finally(() => {
+      this._syncing = null;
+    });
+    return this._syncing;
+  }
+
+  // Fetch the delta from our version (or a full snapshot) and verify the checksum
+  async _doSync(force) {
+    await this.loaded;
+    if (!force && Date.now() < this.nextSyncAt) {
+      return { updated: false, version: this.version };
+    }
+
+    const query = this.version !== null ? `?version=${this.version}` : '';
+    const update = await this.request(`/threat/prefixes${query}`);
+    this.nextSyncAt = Date.now() + update.minimum_wait_seconds * 1000;
+    if (update.type === 'none') {
+      return { updated: false, version: this.version };
+    }
+
+    const added = unpackPrefixes(base64ToBytes(update.add));
+    const removed = unpackPrefixes(base64ToBytes(update.remove));
+    const prefixes = update.type === 'full' ? added : applyDelta(this.prefixes, added, removed);
+
+    const digest = new Uint8Array(await Crypto.digest(Crypto.CryptoDigestAlgorithm.SHA256, packPrefixes(prefixes)));
+    if (bytesToBase64(digest) !== update.checksum) {
+      // Local list diverged; start over from a full snapshot
+      this.version = null;
+      this.nextSyncAt = 0;
+      if (update.type === 'full') {
+        throw new Error('Prefix snapshot checksum mismatch');
+      }
+      return this._doSync(true);
+    }
+
+    this.prefixes = prefixes;
+    this.version = update.version;
+    this.fullHashCache.clear();
+    await this.saveSnapshot();
+    return { updated: true, version: this.version, type: update.type };
+  }
+
+  hasPrefix(prefix) {
+    let low = 0;
+    let high = this.prefixes.length - 1;
+    while (low <= high) {
+      const mid = (low + high) >>> 1;
+      if (this.prefixes[mid] === prefix) {
+        return true;
+      }
+      if (this.prefixes[mid] < prefix) {
+        low = mid + 1;
+      } else {
+        high = mid - 1;
+      }
+    }
+    return false;
+  }
+
+  // Returns { status: 'unknown' | 'safe' | 'malicious', matches }
+  // 'unknown' means no snapshot yet; fall back to /threat/analyze/url
+  async checkUrl(url) {
+    await this.loaded;
+    const canonical = canonicalUrl(url);
+    if (this.version === null || !canonical) {
+      return { status: 'unknown', matches: [] };
+    }
+
+    const host = URL_PATTERN.exec(canonical)[2];
+    const expressions = [...hostSuffixes(host), canonical];
+    const hashes = await Promise.all(expressions.map(expression => Crypto.digestStringAsync(
+      Crypto.CryptoDigestAlgorithm.SHA256,
+      expression,
+      { encoding: Crypto.CryptoEncoding.HEX }
+    )));
+
+    const candidates = hashes.filter(hash => this.hasPrefix(parseInt(hash.slice(0, 8), 16)));
+    if (candidates.length === 0) {
+      return { status: 'safe', matches: [] };
+    }
+
+    const fullHashes = await this.fullHashesFor(candidates.map(hash => hexToBase64(hash.slice(0, 8))));
+    const matches = candidates
+      .map(hash => fullHashes.get(hexToBase64(hash)))
+      .filter(Boolean);
+    return { status: matches.length ? 'malicious' : 'safe', matches };
+  }
+
+  // Server-side verdict (POST /threat/analyze/url): the fallback on a prefix
+  // match or when there is no snapshot yet
+  async analyzeUrl(url) {
+    const response = await this.request('/threat/analyze/url', {
+      method: 'POST',
+      body: JSON.stringify({ urls: [url], context: { source: 'prefix_check' } }),
+    });
+    return response.results[0];
+  }
+
+  async fullHashesFor(prefixes) {
+    const now = Date.now();
+    const missing = [...new Set(prefixes)].filter(prefix => {
+      const cached = this.fullHashCache.get(prefix);
+      return !cached || cached.expiresAt < now;
+    });
+
+    if (missing.length) {
+      const result = await this.request('/threat/prefixes/lookup', {
+        method: 'POST',
+        body: JSON.stringify({ prefixes: missing }),
+      });
+      const expiresAt = now + result.cache_seconds * 1000;
+      result.matches.forEach(match => {
+        this.fullHashCache.set(match.prefix, { expiresAt, fullHashes: match.full_hashes });
+      });
+    }
+
+    const byHash = new Map();
+    prefixes.forEach(prefix => {
+      (this.fullHashCache.get(prefix)?.fullHashes || []).forEach(entry => byHash.set(entry.hash, entry));
+    });
+    return byHash;
+  }
+
+  // Storage functions
+  async loadSnapshot() {
+    try {
+      const saved = await AsyncStorage.getItem(STORAGE_KEY);
+      if (saved) {
+        const { version, prefixes } = JSON.parse(saved);
+        this.prefixes = unpackPrefixes(base64ToBytes(prefixes));
+        this.version = version;
+      }
+    } catch (error) {
+      console.error('Failed to load threat prefix snapshot:', error);
+    }
+  }
+
+  async saveSnapshot() {
+    try {
+      await AsyncStorage.setItem(STORAGE_KEY, JSON.stringify({
+        version: this.version,
+        prefixes: bytesToBase64(packPrefixes(this.prefixes)),
+      }));
+    } catch (error) {
+      console.error('Failed to save threat prefix snapshot:', error);
+    }
+  }
+}
+
+export default new ThreatPrefixClient();
@@ -1,6 +1,7 @@
 // URL Scanner Service - Detects malicious and suspicious links
 import AsyncStorage from '@react-native-async-storage/async-storage';
 import * as Crypto from 'expo-crypto';
+import threatPrefixClient from './threatPrefixClient';
 
 class URLScannerService {
   constructor() {
@@ -126,6 +127,7 @@ class URLScannerService {
       // Perform multiple checks
       const checks = await Promise.all([
         this.checkMaliciousDomains(parsedURL),
+        this.checkThreatIntelligence(normalizedURL),
         this.checkSuspiciousPatterns(normalizedURL),
         this.checkPhishingIndicators(normalizedURL),
         this.checkURLStructure(parsedURL),
@@ -202,6 +204,52 @@ class URLScannerService {
     };
   }
 
+  // Check against the cloud threat list: locally by hash prefix, on the server
+  // only when a prefix matches or no snapshot has been synced yet
+  async checkThreatIntelligence(url) {
+    const clean = {
+      type: 'threat_intelligence',
+      threat: false,
+      severity: 'LOW',
+      details: 'Not on the threat intelligence list'
+    };
+
+    try {
+      // Usually settles at once (throttled by minimum_wait_seconds); a stale list waits for the shared sync
+      await threatPrefixClient.sync().catch(error => console.warn('Threat prefix sync failed:', error));
+      const local = await threatPrefixClient.checkUrl(url);
+      if (local.status === 'safe') {
+        return clean;
+      }
+
+      // A listed hash (or no local list) gets the server's full verdict
+      let result = null;
+      try {
+        result = await threatPrefixClient.analyzeUrl(url);
+      } catch (error) {
+        console.warn('Server URL analysis failed:', error);
+      }
+
+      const listedScore = Math.max(0, ...local.matches.map(match => match.risk_score || 0));
+      const riskScore = Math.max(listedScore, result ? result.risk_score : 0);
+      if (local.status !== 'malicious' && !(result && result.threats.length)) {
+        return result ? clean : { ...clean, details: 'Threat intelligence unavailable' };
+      }
+      return {
+        type: 'threat_intelligence',
+        threat: true,
+        severity: 'HIGH',
+        details: result && result.threats.length ?
+          result.threats.map(threat => threat.description).join('; ') :
+          `Listed as ${local.matches.map(match => match.threat_type).join(', ')}`,
+        riskScore: riskScore
+      };
+    } catch (error) {
+      console.warn('Threat intelligence check failed:', error);
+      return { ...clean, details: 'Threat intelligence unavailable' };
+    }
+  }
+
   // Check for suspicious URL patterns
   async checkSuspiciousPatterns(url) {
     const suspiciousMatches = [];
@@ -402,7 +450,9 @@ class URLScannerService {
       }
     });
 
-    return Math.min(100, Math.round((score / maxScore) * 100));
+    // A listed URL is at least as risky as the threat intelligence says
+    const listedScore = Math.max(0, ...checks.map(check => (check.threat && check.riskScore) || 0));
+    return Math.min(100, Math.max(listedScore, Math.round((score / maxScore) * 100)));
   }
 
   // Generate comprehensive scan report